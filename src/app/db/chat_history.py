@@ -0,0 +1,231 @@
+import logging
+from typing import Any, List, Optional, Sequence, Tuple
+from langchain_core.messages import BaseMessage, HumanMessage
+from langchain_core.runnables.config import run_in_executor
+from langchain_community.chat_message_histories import SQLChatMessageHistory
+from langchain_community.chat_message_histories.sql import DefaultMessageConverter
+from sqlalchemy import Index, func, select
+from sqlalchemy.engine import Connectable
+from app.setting.config import Settings
+from app.setting.utils_cache import InMemoryBackend
+from app.setting.utils_token import estimate_message_tokens
+from app.setting.utils_tracing import export_stats
+
+
+logger = logging.getLogger(__name__)
+
+TABLE_NAME = "message_store"
+
+# converter 會動態建立 ORM model, 整個 process 共用一個即可
+_converter = DefaultMessageConverter(TABLE_NAME)
+_created_tables = set()
+
+# 依 session 取最後 N 則訊息 (WHERE session_id = ? ORDER BY id DESC LIMIT N) 使用的索引
+_model = _converter.get_sql_model_class()
+_session_index = Index(f"ix_{TABLE_NAME}_session_id_id", _model.session_id, _model.id)
+
+# 每個 session 最近訊息的 write-through 快取, 值為 (版本, 訊息)
+_history_cache = InMemoryBackend(
+    maxsize=Settings.CHAT_HISTORY_CACHE_MAXSIZE,
+    ttl=Settings.CHAT_HISTORY_CACHE_TTL or None,
+)
+export_stats("chat_history_cache", "default", _history_cache.stats)
+
+
+class SQLChatHistory(SQLChatMessageHistory):
+    """
+    SQLChatMessageHistory 的擴充:
+    - 同一個 engine 只在第一次建立時檢查/建立資料表與 (session_id, id) 索引
+    - 使用同步 engine 時, async 讀寫改在 thread pool 執行, 不阻塞 event loop
+    - 只讀取最後 max_messages 則訊息, 再依 max_tokens 由舊到新裁切
+    - 有 cache 時讀取結果與新寫入的訊息保存在 process 內, 下一輪只查詢 session 的版本
+      (筆數與最大 id, 只走索引), 版本相同才使用快取; 同一個 session 被其他 worker
+      或 replica 寫入時版本不同, 改從 SQL 重新讀取
+    """
+
+    def __init__(
+        self,
+        *args: Any,
+        max_messages: int = 0,
+        max_tokens: int = 0,
+        cache: Optional[InMemoryBackend] = None,
+        **kwargs: Any,
+    ):
+        """
+        :param max_messages: 最多讀取的訊息數, 0 表示不限制
+        :param max_tokens: 歷史訊息的 token 上限 (估算), 0 表示不限制
+        :param cache: per-session 訊息快取, None 表示不快取
+        """
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self.cache = cache
+        super().__init__(*args, **kwargs)
+
+    def _create_table_if_not_exists(self) -> None:
+        key = (id(self.engine), TABLE_NAME)
+        if key not in _created_tables:
+            super()._create_table_if_not_exists()
+            _session_index.create(self.engine, checkfirst=True)
+            _created_tables.add(key)
+        self._table_created = True
+
+    async def _acreate_table_if_not_exists(self) -> None:
+        key = (id(self.async_engine), TABLE_NAME)
+        if key not in _created_tables:
+            await super()._acreate_table_if_not_exists()
+            async with self.async_engine.begin() as conn:
+                await conn.run_sync(lambda sync_conn: _session_index.create(sync_conn, checkfirst=True))
+            _created_tables.add(key)
+        self._table_created = True
+
+    def _select_recent(self):
+        stmt = (
+            select(self.sql_model_class)
+            .where(getattr(self.sql_model_class, self.session_id_field_name) == self.session_id)
+            .order_by(self.sql_model_class.id.desc())
+        )
+        if self.max_messages:
+            stmt = stmt.limit(self.max_messages)
+        return stmt
+
+    def _select_version(self):
+        return select(func.count(), func.max(self.sql_model_class.id)).where(
+            getattr(self.sql_model_class, self.session_id_field_name) == self.session_id
+        )
+
+    def _to_messages(self, records) -> List[BaseMessage]:
+        return [self.converter.from_sql_model(record) for record in reversed(list(records))]
+
+    def _window(self, messages: List[BaseMessage]) -> List[BaseMessage]:
+        """
+        依 max_tokens 由最舊的訊息開始捨棄, 並讓歷史從用戶訊息開始。
+        """
+        if self.max_tokens:
+            while len(messages) > 1 and estimate_message_tokens(messages) > self.max_tokens:
+                messages = messages[1:]
+        while len(messages) > 1 and not isinstance(messages[0], HumanMessage):
+            messages = messages[1:]
+        return list(messages)
+
+    def _cache_get(self, version: Tuple[int, Optional[int]]) -> Optional[List[BaseMessage]]:
+        if self.cache is None or (cached := self.cache.get(self.session_id)) is None:
+            return None
+        cached_version, messages = cached
+        return messages if cached_version == version else None
+
+    def _cache_set(self, version: Tuple[int, Optional[int]], messages: List[BaseMessage]):
+        if self.cache is not None:
+            self.cache.set(self.session_id, (version, messages))
+
+    def _cache_append(self, messages: Sequence[BaseMessage], last_id: int):
+        """
+        只更新已載入的 session; 未載入時下一次讀取會從 SQL 取得完整的視窗。
+
+        新版本以快取的筆數加上寫入的筆數計算: 若其他 worker 在這之前也寫入了這個 session,
+        實際筆數會不同, 下一次讀取就會重新載入。
+        """
+        if self.cache is None or (cached := self.cache.get(self.session_id)) is None:
+            return
+        (count, _), cached_messages = cached
+        merged = cached_messages + list(messages)
+        self._cache_set(
+            (count + len(messages), last_id),
+            merged[-self.max_messages:] if self.max_messages else merged,
+        )
+
+    @property
+    def messages(self) -> List[BaseMessage]:  # type: ignore
+        """
+        取得最近的訊息, 版本與 SQL 相同時使用快取。
+        """
+        with self._make_sync_session() as session:
+            version = None
+            if self.cache is not None:
+                version = tuple(session.execute(self._select_version()).one())
+                if (messages := self._cache_get(version)) is not None:
+                    return self._window(messages)
+            messages = self._to_messages(session.scalars(self._select_recent()))
+        if version is not None:
+            self._cache_set(version, messages)
+        return self._window(messages)
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        if not self.async_mode:
+            return await run_in_executor(None, lambda: self.messages)
+
+        await self._acreate_table_if_not_exists()
+        async with self._make_async_session() as session:
+            version = None
+            if self.cache is not None:
+                version = tuple((await session.execute(self._select_version())).one())
+                if (messages := self._cache_get(version)) is not None:
+                    return self._window(messages)
+            messages = self._to_messages((await session.execute(self._select_recent())).scalars())
+        if version is not None:
+            self._cache_set(version, messages)
+        return self._window(messages)
+
+    def add_message(self, message: BaseMessage) -> None:
+        self.add_messages([message])
+
+    async def aadd_message(self, message: BaseMessage) -> None:
+        await self.aadd_messages([message])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        if not messages:
+            return
+        # 與 SQLChatMessageHistory 相同在一個 transaction 寫入, 另外取得新訊息的 id 作為快取版本
+        with self._make_sync_session() as session:
+            records = [self.converter.to_sql_model(message, self.session_id) for message in messages]
+            session.add_all(records)
+            session.flush()
+            last_id = records[-1].id
+            session.commit()
+        self._cache_append(messages, last_id)
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        if not messages:
+            return
+        if not self.async_mode:
+            return await run_in_executor(None, self.add_messages, messages)
+
+        await self._acreate_table_if_not_exists()
+        async with self._make_async_session() as session:
+            records = [self.converter.to_sql_model(message, self.session_id) for message in messages]
+            session.add_all(records)
+            await session.flush()
+            last_id = records[-1].id
+            await session.commit()
+        self._cache_append(messages, last_id)
+
+    def clear(self) -> None:
+        super().clear()
+        if self.cache is not None:
+            self.cache.delete(self.session_id)
+
+    async def aclear(self) -> None:
+        if self.async_mode:
+            await super().aclear()
+            if self.cache is not None:
+                self.cache.delete(self.session_id)
+        else:
+            await run_in_executor(None, self.clear)
+
+
+def get_session_history(session_id: str, connection: Connectable) -> SQLChatHistory:
+    """
+    RunnableWithMessageHistory 使用的 chat history factory。
+
+    :param session_id: 對話 session id
+    :param connection: SQLAlchemy engine (sync 或 async)
+    :return: 該 session 的 chat history
+    """
+    return SQLChatHistory(
+        session_id=session_id,
+        connection=connection,
+        table_name=TABLE_NAME,
+        custom_message_converter=_converter,
+        max_messages=Settings.CHAT_HISTORY_MAX_MESSAGES,
+        max_tokens=Settings.CHAT_HISTORY_MAX_TOKENS,
+        cache=_history_cache if Settings.CHAT_HISTORY_CACHE_ENABLED else None,
+    )
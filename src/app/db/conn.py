@@ -1,7 +1,116 @@
+import logging
+import time
 from setting.config import Settings as settings
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from app.setting.utils_metrics import Counter, Gauge, Histogram
+
+
+logger = logging.getLogger(__name__)
+
+POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_seconds", "Time to get a connection from the pool", ["engine"]
+)
+POOL_WAIT_SECONDS = Histogram(
+    "db_pool_wait_seconds", "Time spent waiting for a connection while the pool was exhausted", ["engine"]
+)
+POOL_TIMEOUTS = Counter("db_pool_timeouts_total", "Checkouts that hit pool_timeout", ["engine"])
+POOL_CONNECTION_ERRORS = Counter(
+    "db_pool_connection_errors_total", "Errors while opening or validating a connection", ["engine"]
+)
+POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Connections currently checked out", ["engine"])
+POOL_OVERFLOW = Gauge("db_pool_overflow", "Connections opened beyond pool_size", ["engine"])
+POOL_SIZE = Gauge("db_pool_size", "Configured pool_size", ["engine"])
+
+
+class _InstrumentedPoolMixin:
+    """
+    記錄取得連線的耗時、pool 用盡時的等待時間、timeout 與連線錯誤次數。
+    """
+
+    metric_label = "sync"
+
+    def _do_get(self):
+        label = self.metric_label
+        exhausted = self.checkedout() >= self.size() + max(self._max_overflow, 0)
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            POOL_TIMEOUTS.inc(engine=label)
+            raise
+        except Exception:
+            POOL_CONNECTION_ERRORS.inc(engine=label)
+            raise
+        elapsed = time.perf_counter() - start
+        POOL_CHECKOUT_SECONDS.observe(elapsed, engine=label)
+        if exhausted:
+            POOL_WAIT_SECONDS.observe(elapsed, engine=label)
+        return connection
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    metric_label = "sync"
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    metric_label = "async"
+
+
+def _register_pool_gauges(engine, label: str):
+    POOL_CHECKED_OUT.set_function(lambda: engine.pool.checkedout(), engine=label)
+    POOL_OVERFLOW.set_function(lambda: max(engine.pool.overflow(), 0), engine=label)
+    POOL_SIZE.set_function(lambda: engine.pool.size(), engine=label)
+
+    @event.listens_for(engine, "handle_error")
+    def _count_disconnect(context):
+        # pool_pre_ping 或執行中斷線
+        if context.is_disconnect:
+            POOL_CONNECTION_ERRORS.inc(engine=label)
+
+
+def _pool_args() -> dict:
+    return dict(
+        echo=settings.ENGINE_ECHO,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+    )
+
+
+def _create_async_engine():
+    """
+    建立 asyncpg 的 async engine, 未啟用時回傳 None。
+    """
+    if not settings.DB_ASYNC_ENABLED:
+        return None
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    connect_args = {}
+    if settings.DB_STATEMENT_TIMEOUT_MS:
+        connect_args["server_settings"] = {"statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS)}
+    engine = create_async_engine(
+        f"postgresql+asyncpg://{settings.DB_USER}:{settings.DB_PWD}@{settings.DB_DSN}",
+        poolclass=InstrumentedAsyncQueuePool,
+        connect_args=connect_args,
+        **_pool_args(),
+    )
+    _register_pool_gauges(engine.sync_engine, "async")
+    logger.info("create async engine finish")
+    return engine
+
 
 sqlalchemy_engine = create_engine(
     f"postgresql://{settings.DB_USER}:{settings.DB_PWD}@{settings.DB_DSN}",
-    echo=settings.ENGINE_ECHO
-)
\ No newline at end of file
+    poolclass=InstrumentedQueuePool,
+    connect_args=(
+        {"options": f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"}
+        if settings.DB_STATEMENT_TIMEOUT_MS else {}
+    ),
+    **_pool_args(),
+)
+_register_pool_gauges(sqlalchemy_engine, "sync")
+
+sqlalchemy_async_engine = _create_async_engine()
@@ -1,32 +1,199 @@
 import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
 from sqlalchemy.engine import Connectable
 from sqlalchemy.orm import Session
 from app.db.model import Evaluate
-from app.setting.exceptions import DBInsertError
+from app.setting.exceptions import DBInsertError, ParsingTranRqError
 
 
 logger = logging.getLogger(__name__)
 
-def insert_evaluation(obj: dict, con: Connectable):
+EVALUATE_KEYS = ("TXNSEQ", "SESSIONI_ID", "CUSTOMER_ID")
+_TIME_FORMATS = ("%Y/%m/%d %H:%M:%S", "%Y-%m-%d %H:%M:%S")
+
+
+def insert_evaluation(obj: dict, con: Connectable, retries: int = 3):
     """
-    Insert evaluation to postgre sql db
+    Insert evaluation to postgre sql db, 每次重試使用新的 session
     """
-    evaluation = Evaluate(**obj)
-    with Session(con) as session:
-        session.begin()
-        retries = 3
-        while retries > 0:
-            try:
-                session.add(evaluation)
+    for attempt in range(1, retries + 1):
+        try:
+            with Session(con) as session:
+                session.merge(Evaluate(**obj))
                 session.commit()
-                logger.info("Insert evaluation success.", extra={obj})
+            logger.info("Insert evaluation success.", extra=obj)
+            return
+        except Exception as e:
+            if attempt == retries:
+                logger.exception("Retry times are exhausted, insert log fail! ", extra=obj)
+                raise DBInsertError(e)
+            logger.info("Insert evaluation fail, retry ...", extra=obj)
+
+
+def _parse_time(value):
+    if not isinstance(value, str):
+        return value
+    for fmt in _TIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ParsingTranRqError(f"invalid time: {value}")
+
+
+def _upsert_statement(con: Connectable, rows: List[Dict]):
+    """
+    建立多筆 INSERT ... ON CONFLICT (TXNSEQ, SESSIONI_ID, CUSTOMER_ID) DO UPDATE。
+    """
+    if con.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif con.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+
+    stmt = insert(Evaluate).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=list(EVALUATE_KEYS),
+        set_={"EVALUATE": stmt.excluded.EVALUATE, "TIME": stmt.excluded.TIME},
+    )
+
+
+class EvaluationWriter:
+    """
+    評價資料的 write-behind buffer:
+    - submit 只把資料放入有上限的 queue, 不等待 DB commit; queue 滿時拋出 DBInsertError (backpressure)
+    - 背景 thread 累積到 batch_size 筆或距第一筆超過 flush_interval 秒時, 以一次多筆 upsert 寫入
+    - 同一批內相同 key 只保留最後一筆, 重送的評價會覆蓋既有的資料 (idempotent)
+    - close 時把 queue 中剩餘的資料全部寫入
+    """
+
+    def __init__(
+        self,
+        con: Connectable,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        max_queue: int = 10000,
+        retries: int = 3,
+    ):
+        """
+        :param con: SQLAlchemy engine
+        :param batch_size: 每次寫入的最多筆數
+        :param flush_interval: 資料在 buffer 中最多停留的秒數
+        :param max_queue: queue 上限, 超過時拒絕新的資料
+        :param retries: 每批寫入的重試次數
+        """
+        self.con = con
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.submitted = 0
+        self.rejected = 0
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self._queue: "queue.Queue[Dict]" = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="evaluation-writer", daemon=True)
+            self._thread.start()
+            logger.info("evaluation writer start")
+
+    def submit(self, obj: dict):
+        """
+        將一筆評價放入 buffer。
+
+        :param obj: Evaluate 欄位的 dict
+        """
+        row = {**obj, "TIME": _parse_time(obj.get("TIME"))}
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.rejected += 1
+            raise DBInsertError("evaluation queue is full")
+        self.submitted += 1
+
+    def _collect(self) -> List[Dict]:
+        try:
+            rows = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(rows) < self.batch_size:
+            if self._stop.is_set():
+                timeout = 0
+            else:
+                timeout = deadline - time.monotonic()
+            try:
+                rows.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
                 break
-            except Exception as e:
-                session.rollback()
-                logger.info("Insert evaluation fail, retry ...", extra={obj})
-                retries -= 1
-                if retries == 0:
-                    logger.exception("Retry times are exhausted, insert log fail! ", extra={obj})
-                    raise DBInsertError(e)
-            finally:
-                session.close()
+        return rows
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            if rows := self._collect():
+                self.flush(rows)
+
+    def flush(self, rows: List[Dict]):
+        """
+        以一次 upsert 寫入一批資料, 失敗時重試, 重試用盡時記錄並捨棄該批。
+
+        :param rows: Evaluate 欄位的 dict 列表
+        """
+        rows = list({tuple(row[key] for key in EVALUATE_KEYS): row for row in rows}.values())
+        for attempt in range(1, self.retries + 1):
+            try:
+                if (stmt := _upsert_statement(self.con, rows)) is None:
+                    with Session(self.con) as session:
+                        for row in rows:
+                            session.merge(Evaluate(**row))
+                        session.commit()
+                else:
+                    with self.con.begin() as conn:
+                        conn.execute(stmt)
+                self.written += len(rows)
+                self.batches += 1
+                logger.info(f"Insert {len(rows)} evaluations success.")
+                return
+            except Exception:
+                if attempt == self.retries:
+                    self.dropped += len(rows)
+                    logger.exception(f"Retry times are exhausted, insert {len(rows)} evaluations fail! ")
+                    return
+                logger.info("Insert evaluations fail, retry ...")
+                time.sleep(0.1 * 2 ** attempt)
+
+    def close(self, timeout: Optional[float] = None):
+        """
+        停止背景 thread, 並等待 queue 中剩餘的資料寫入。
+
+        :param timeout: 最多等待的秒數, None 表示等到寫完
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        logger.info(f"evaluation writer closed, stats: {self.stats()}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "queued": self._queue.qsize(),
+        }
@@ -1,86 +1,149 @@
+import asyncio
 import logging
 import os
-from typing import Dict
+from typing import Dict, List, Optional, Tuple, Union
 from datetime import datetime
 from functools import partial
-from langchain_openai import AzureChatOpenAI
-from langchain_community.chat_message_histories import SQLChatMessageHistory
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import Runnable, RunnableLambda, RunnablePassthrough
 from sqlalchemy.engine import Connectable
 from app.vdb_connector import ChromaDBClient
-from setting.utils_retriever import RetrieveWithScore, get_metadata_runnable
-from setting.constant import PROMPT_COMPLETETION, PROMPT_QUESTION_NER
+from app.db.chat_history import get_session_history
+from setting.utils_retriever import RetrieveWithScore, get_metadata_fields_runnable
+from setting.utils_cache import NerCache, create_backend
+from setting.utils_embedding import EmbeddingCache
+from setting.utils_vindex import InMemoryVectorIndex
+from setting.utils_gate import CompletionGate
+from setting.utils_date import resolve_date_range
+from setting.constant import PROMPT_COMPLETETION, PROMPT_QUESTION_NER, PROMPT_QUESTION_NER_LITE
+from setting.config import Settings
+from app.setting.utils_tracing import export_stats, stage
+from app.setting.exceptions import TimeOutError
+from app.setting.utils_resilience import ResilientChatModel
+from app.gai_executors.models import create_chat_model
 
 logger = logging.getLogger(__name__)
 
 class ChainNer:
+    """
+    NER + 向量檢索 pipeline。
+
+    model / vectorstore / retriever / chains 等重量級物件只在建構時建立一次,
+    可由 registry 於同一個 worker 內共用; sessionId、customerId、time
+    等每次請求的狀態則在呼叫 search 時傳入。
+    """
+
     def __init__(
         self,
-        sessionId: str,
-        customerId: str,
         chromaCollection: str,
         engine: Connectable,
-        time: str,
         k: int = 1,
         scoreThreshold: float = 0,
+        deployment: Optional[str] = None,
+        async_engine: Optional[Connectable] = None,
         **kwargs,
     ):
-        self.time = self._convert_time_format(time)
-        self.sessionId = sessionId
-        self.customerId = customerId
+        self.deployment = deployment or os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT_NAME"]
         self.model = self._create_model()
-        self.vectorstore = self._create_vectorstore(chromaCollection)
+        self.chroma = self._create_chroma(chromaCollection)
         self.retriever = self._create_retriever(k, scoreThreshold)
+        self.ner_cache = self._create_ner_cache()
+        self.completion_gate = CompletionGate()
+        self.ner_overlap = {"overlapped": 0, "sequential": 0}
+        self._export_stats()
+        self.get_chat_history = partial(get_session_history, connection=engine)
         self.chian_completeion = self._create_chain_completeion(engine)
+        # async 路徑有 async engine 時改用 async engine 讀寫 chat history
+        if async_engine is not None:
+            self.aget_chat_history = partial(get_session_history, connection=async_engine)
+            self.achian_completeion = self._create_chain_completeion(async_engine)
+        else:
+            self.aget_chat_history = self.get_chat_history
+            self.achian_completeion = self.chian_completeion
         self.chain_ner = self._create_chain_ner()
 
-    def search(self, user_input: str, **kwargs) -> Dict:
+    def search(
+        self,
+        user_input: str,
+        sessionId: str,
+        customerId: str,
+        time: str,
+        **kwargs,
+    ) -> Dict:
 
         response = {}
-        template = {}
-        template["tid"] = None
-        template["blockReason"] = None
-        template["startDate"] = None
-        template["endDate"] = None
-        template["storeName"] = [None]
-        template["categoryName"] = [None]
-        template["message"] = None
+        template = self._new_template()
 
         try:
             if "被阻擋" in (
-                user_input := self.chian_completeion.invoke(
-                    {"user_input": user_input},
-                    config={"configurable": {"session_id": self.sessionId}},
-                )
+                user_input := self._complete(user_input, sessionId)
             ):
 
                 template["tid"] = "98"  # TBD
                 template["blockReason"] = user_input
                 # self.chain_ner.invoke(user_input)會失敗
-            elif "被阻擋" in (result := self.chain_ner.invoke(user_input)):
+            else:
+                result = self.chain_ner.invoke(
+                    {"question": user_input, "time": self._convert_time_format(time)}
+                )
+                self._fill_template(template, user_input, result)
 
-                template["tid"] = "98"  # TBD
-                template["blockReason"] = user_input
+        except TimeOutError:
+            raise
 
-            elif not result["retriever"]["score"]:
+        except Exception as e:
+            template["tid"] = "99"
+            template["blockReason"] = e
+
+        finally:
+
+            response["sessionId"] = sessionId
+            response["customerId"] = customerId
+            response["template"] = template
+
+        return response
+
+    async def asearch(
+        self,
+        user_input: str,
+        sessionId: str,
+        customerId: str,
+        time: str,
+        **kwargs,
+    ) -> Dict:
+        """
+        search 的 async 版本, LLM、向量檢索與 chat history 皆以 ainvoke 執行,
+        不會阻塞 event loop。
+        """
+
+        response = {}
+        template = self._new_template()
+
+        try:
+            if Settings.CHAIN_OVERLAP_NER:
+                user_input, result = await self._acomplete_with_ner(
+                    user_input, sessionId, self._convert_time_format(time)
+                )
+            else:
+                user_input, result = await self._acomplete(user_input, sessionId), None
 
-                template["tid"] = "99"  # TBD
-                template["blockReason"] = "相似度過低"
+            if "被阻擋" in user_input:
 
+                template["tid"] = "98"  # TBD
+                template["blockReason"] = user_input
             else:
+                if result is None:
+                    result = await self.chain_ner.ainvoke(
+                        {"question": user_input, "time": self._convert_time_format(time)}
+                    )
+                self._fill_template(template, user_input, result)
 
-                template["tid"] = result["retriever"].get("category", None)[0]
-                template["startDate"] = result["keys"].get("&start_date", None)
-                template["endDate"] = result["keys"].get("&end_date", None)
-                template["storeName"] = [
-                    result["keys"].get("&string1", None),
-                    result["keys"].get("&string2", None),
-                ]
-                template["categoryName"] = [result["keys"].get("&string", None)]
-                template["message"] = user_input
+        except TimeOutError:
+            raise
 
         except Exception as e:
             template["tid"] = "99"
@@ -88,36 +151,192 @@ class ChainNer:
 
         finally:
 
-            response["sessionId"] = self.sessionId
-            response["customerId"] = self.customerId
+            response["sessionId"] = sessionId
+            response["customerId"] = customerId
             response["template"] = template
 
         return response
 
+    async def abatch_search(self, items: List[Dict], max_concurrency: int = 8) -> List[Union[Dict, Exception]]:
+        """
+        以 abatch 批次執行 asearch, 最多同時執行 max_concurrency 筆。
+
+        :param items: TRANRQ 清單, 每筆包含 message、sessionId、customerId、time
+        :param max_concurrency: 同時執行的上限
+        :return: 與 items 順序相同的結果, 失敗的項目為 Exception
+        """
+        runnable = RunnableLambda(
+            lambda item: self.search(user_input=item["message"], **item),
+            afunc=lambda item: self.asearch(user_input=item["message"], **item),
+            name="search",
+        )
+        return await runnable.abatch(
+            items,
+            config={"max_concurrency": max_concurrency},
+            return_exceptions=True,
+        )
+
+    def _complete(self, user_input: str, sessionId: str) -> str:
+        """
+        問句補完; 沒有對話歷史或問句已完整時略過 LLM, 只把問句寫入歷史。
+        """
+        with stage("chat_history"):
+            history = self.get_chat_history(sessionId)
+            messages = history.messages
+        if reason := self.completion_gate.check(user_input, messages):
+            logger.info("skip completion: %s", reason)
+            with stage("chat_history"):
+                history.add_messages([HumanMessage(content=user_input), AIMessage(content=user_input)])
+            return user_input
+
+        with stage("completion_llm"):
+            return self.chian_completeion.invoke(
+                {"user_input": user_input},
+                config={"configurable": {"session_id": sessionId}},
+            )
+
+    async def _acomplete(self, user_input: str, sessionId: str) -> str:
+        """
+        _complete 的 async 版本。
+        """
+        history, reason = await self._acheck_completion(user_input, sessionId)
+        if reason:
+            await self._askip_completion(history, user_input)
+            return user_input
+        return await self._acompletion_llm(user_input, sessionId)
+
+    async def _acheck_completion(self, user_input: str, sessionId: str) -> Tuple[BaseChatMessageHistory, Optional[str]]:
+        """
+        讀取對話歷史並由 gate 判定是否需要補完。
+
+        :return: (對話歷史, 略過補完的原因); 需要補完時原因為 None
+        """
+        with stage("chat_history"):
+            history = self.aget_chat_history(sessionId)
+            messages = await history.aget_messages()
+        return history, self.completion_gate.check(user_input, messages)
+
+    @staticmethod
+    async def _askip_completion(history: BaseChatMessageHistory, user_input: str):
+        with stage("chat_history"):
+            await history.aadd_messages(
+                [HumanMessage(content=user_input), AIMessage(content=user_input)]
+            )
+
+    async def _acompletion_llm(self, user_input: str, sessionId: str) -> str:
+        with stage("completion_llm"):
+            return await self.achian_completeion.ainvoke(
+                {"user_input": user_input},
+                config={"configurable": {"session_id": sessionId}},
+            )
+
+    def _export_stats(self):
+        """
+        將快取與 gate 的統計匯出到 /metrics。
+        """
+        export_stats("completion_gate", self.deployment, self.completion_gate.stats)
+        export_stats("ner_overlap", self.deployment, lambda: dict(self.ner_overlap))
+        if self.ner_cache is not None:
+            export_stats("ner_cache", self.deployment, self.ner_cache.stats)
+        if self.embedding_cache is not None:
+            export_stats("embedding_cache", self.deployment, self.embedding_cache.stats)
+
+    async def _acomplete_with_ner(self, user_input: str, sessionId: str, time: str) -> Tuple[str, Optional[Dict]]:
+        """
+        問句補完後執行 NER, 在 gate 判定後才啟動, 每個請求只呼叫一次 NER。
+        gate 略過補完時問句不會改變, NER 與寫入對話歷史重疊執行;
+        需要補完時 NER 依賴補完後的問句, 只能等補完結束後執行。
+
+        :return: (補完後的問句, NER 結果); 問句被阻擋時 NER 結果為 None
+        """
+        history, reason = await self._acheck_completion(user_input, sessionId)
+        if not reason:
+            self.ner_overlap["sequential"] += 1
+            completed = await self._acompletion_llm(user_input, sessionId)
+            if "被阻擋" in completed:
+                return completed, None
+            return completed, await self.chain_ner.ainvoke({"question": completed, "time": time})
+
+        logger.info("skip completion: %s", reason)
+        if "被阻擋" in user_input:
+            await self._askip_completion(history, user_input)
+            return user_input, None
+
+        self.ner_overlap["overlapped"] += 1
+        ner = asyncio.ensure_future(self.chain_ner.ainvoke({"question": user_input, "time": time}))
+        try:
+            await self._askip_completion(history, user_input)
+        except BaseException:
+            ner.cancel()
+            raise
+        return user_input, await ner
+
+    @staticmethod
+    def _new_template() -> Dict:
+        template = {}
+        template["tid"] = None
+        template["blockReason"] = None
+        template["startDate"] = None
+        template["endDate"] = None
+        template["storeName"] = [None]
+        template["categoryName"] = [None]
+        template["message"] = None
+        return template
+
+    @staticmethod
+    def _fill_template(template: Dict, user_input: str, result: Dict):
+        """
+        依 chain_ner 的結果填入 template。
+        """
+        if "被阻擋" in result:
+
+            template["tid"] = "98"  # TBD
+            template["blockReason"] = user_input
+
+        elif not result["retriever"]["score"]:
+
+            template["tid"] = "99"  # TBD
+            template["blockReason"] = "相似度過低"
+
+        else:
+
+            template["tid"] = result["retriever"].get("category", None)[0]
+            template["startDate"] = result["keys"].get("&start_date", None)
+            template["endDate"] = result["keys"].get("&end_date", None)
+            template["storeName"] = [
+                result["keys"].get("&string1", None),
+                result["keys"].get("&string2", None),
+            ]
+            template["categoryName"] = [result["keys"].get("&string", None)]
+            template["message"] = user_input
+
     @staticmethod
     def _convert_time_format(time_str):
         dt = datetime.strptime(time_str, "%Y/%m/%d %H:%M:%S")
         return dt.strftime("%Y-%m-%d")
 
-    def _create_model(self) -> AzureChatOpenAI:
-        logger.info("create_model start")
-        logger.info(f"api_key: {os.environ['AZURE_OPENAI_API_KEY']}")
-        logger.info(f"azure_endpoint: {os.environ['AZURE_OPENAI_ENDPOINT']}")
-        logger.info(f"openai_api_version: {os.environ['AZURE_OPENAI_API_VERSION']}")
-        logger.info(f"azure_deployment: {os.environ['AZURE_OPENAI_CHAT_DEPLOYMENT_NAME']}")
-        model = AzureChatOpenAI(
-            api_key=os.environ["AZURE_OPENAI_API_KEY"],
-            azure_endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
-            openai_api_version=os.environ["AZURE_OPENAI_API_VERSION"],
-            azure_deployment=os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT_NAME"],
+    def _create_model(self) -> ResilientChatModel:
+        logger.info(
+            "create_model start, azure_endpoint: %s, openai_api_version: %s, azure_deployment: %s",
+            os.environ["AZURE_OPENAI_ENDPOINT"],
+            os.environ["AZURE_OPENAI_API_VERSION"],
+            self.deployment,
         )
+        model = create_chat_model(self.deployment)
         logger.info("create_model finish")
         return model
 
-    def _create_vectorstore(self, collection_name):
-        chroma_client = ChromaDBClient(collection_name=collection_name)
+    @property
+    def vectorstore(self):
+        """
+        目前的 vectorstore; Chroma 重新連線時會換成新的物件, 使用時才讀取。
+        """
+        return self.chroma.vectorstore
+
+    def _create_chroma(self, collection_name) -> ChromaDBClient:
+        chroma_client = ChromaDBClient.get_instance(collection_name=collection_name)
         logger.info("create vectorstore finish")
-        return chroma_client.vectorstore
+        return chroma_client
 
     def _create_retriever(
         self,
@@ -125,55 +344,118 @@ class ChainNer:
         scoreThreshold: float,
     ) -> "retriever":
 
+        self.embedding_cache = None
+        if Settings.EMBEDDING_CACHE_ENABLED:
+            self.embedding_cache = EmbeddingCache(
+                namespace=os.environ["AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME"],
+                maxsize=Settings.EMBEDDING_CACHE_MAXSIZE,
+                path=Settings.EMBEDDING_CACHE_PATH or None,
+            )
+
+        self.vector_index = None
+        if Settings.VDB_LOCAL_INDEX:
+            self.vector_index = InMemoryVectorIndex(
+                lambda: self.chroma.vectorstore, refresh_interval=Settings.VDB_INDEX_REFRESH_SECONDS
+            )
+            self.vector_index.start()
+
         retriever = RetrieveWithScore(
-            self.vectorstore,
+            lambda: self.chroma.vectorstore,
             k=k,
             score_threshold=scoreThreshold,
+            embedding_cache=self.embedding_cache,
+            vector_index=self.vector_index,
         )
         logger.info("create retriever finish")
         return retriever
 
+    def _create_ner_cache(self) -> Optional[NerCache]:
+        if not Settings.NER_CACHE_ENABLED:
+            return None
+
+        backend = create_backend(
+            backend=Settings.NER_CACHE_BACKEND,
+            maxsize=Settings.NER_CACHE_MAXSIZE,
+            ttl=Settings.NER_CACHE_TTL,
+            redis_url=Settings.NER_CACHE_REDIS_URL,
+        )
+        ner_cache = NerCache(
+            backend=backend,
+            embeddings=self.vectorstore.embeddings if Settings.NER_CACHE_SEMANTIC else None,
+            similarity_threshold=Settings.NER_CACHE_SIMILARITY,
+        )
+        logger.info(f"create ner cache finish, backend: {Settings.NER_CACHE_BACKEND}")
+        return ner_cache
+
     def _create_chain_completeion(self, connection) -> RunnableWithMessageHistory:
         prompt = ChatPromptTemplate.from_template(PROMPT_COMPLETETION)
 
         chain = prompt | self.model | StrOutputParser()
 
-        logger.info(f"connection: {connection}")
-        get_chat_history = partial(SQLChatMessageHistory, connection=connection)
+        logger.info("connection: %s", connection)
 
         chian_completeion = RunnableWithMessageHistory(
             chain,
-            get_chat_history,
+            partial(get_session_history, connection=connection),
             input_messages_key="user_input",
             history_messages_key="history",
         )
         logger.info("chain complete")
         return chian_completeion
 
+    @staticmethod
+    def _with_date_range(json_parser_chain: Runnable, json_parser_chain_lite: Runnable) -> Runnable:
+        """
+        先以 resolve_date_range 在本地換算時間; 換算成功時改用不含日期規則的
+        lite prompt, 並以換算結果填入 &start_date/&end_date, 否則使用完整 prompt。
+        """
+
+        def fill(result, date_range):
+            if isinstance(result, dict):
+                result["&start_date"], result["&end_date"] = date_range
+            return result
+
+        def ner(inputs: Dict, config) -> Dict:
+            with stage("ner_llm"):
+                if date_range := resolve_date_range(inputs["question"], inputs["time"]):
+                    return fill(json_parser_chain_lite.invoke(inputs, config), date_range)
+                return json_parser_chain.invoke(inputs, config)
+
+        async def aner(inputs: Dict, config) -> Dict:
+            with stage("ner_llm"):
+                if date_range := resolve_date_range(inputs["question"], inputs["time"]):
+                    return fill(await json_parser_chain_lite.ainvoke(inputs, config), date_range)
+                return await json_parser_chain.ainvoke(inputs, config)
+
+        return RunnableLambda(ner, afunc=aner, name="ner")
+
     def _create_chain_ner(self):
 
         prompt = ChatPromptTemplate.from_template(PROMPT_QUESTION_NER)
+        prompt_lite = ChatPromptTemplate.from_template(PROMPT_QUESTION_NER_LITE)
         logger.info("start json_parser_chain")
-        json_parser_chain = prompt | self.model | JsonOutputParser()
+        json_parser_chain = self._with_date_range(
+            prompt | self.model | JsonOutputParser(),
+            prompt_lite | self.model | JsonOutputParser(),
+        )
+        if self.ner_cache is not None:
+            json_parser_chain = self.ner_cache.wrap(json_parser_chain)
 
         logger.info("start retriever_chain")
         retriever_chain = (
             RunnableLambda(lambda response: response["modify_query"])
             | self.retriever
-            | {  # vectordb拉到的內容(包含SQL)
-                "SQL": get_metadata_runnable("SQL1", "SQL2", "SQL3"),
-                "標準問題": get_metadata_runnable("問題類別"),
-                "category": get_metadata_runnable("category"),
-                "score": get_metadata_runnable("score"),
-            }
+            | get_metadata_fields_runnable({  # vectordb拉到的內容(包含SQL), 一次取出
+                "SQL": ("SQL1", "SQL2", "SQL3"),
+                "標準問題": ("問題類別",),
+                "category": ("category",),
+                "score": ("score",),
+            })
         )
         logger.info("start chain_ner")
+        # 輸入為 {"question": ..., "time": ...}, time 於每次請求時傳入
         chain_ner = (
-            {
-                "question": RunnablePassthrough(),
-                "time": RunnableLambda(lambda x: self.time),
-            }
-            | json_parser_chain
+            json_parser_chain
             | {
                 "keys": RunnablePassthrough(),  # 解析出來的參數
                 "retriever": retriever_chain,
@@ -1,85 +1,271 @@
 import os
-from typing import Dict, List
-from langchain_openai import AzureChatOpenAI
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
 from setting.constant import PROMPT_GENAI_RESPONSE, CUST_DESC
+from app.setting.utils_tracing import record_stage, stage
+from app.setting.exceptions import TimeOutError
+from app.gai_executors.models import create_chat_model
+
+BLOCK_MARKER = "被阻擋"
+
 
 class GenAIResponse:
 
-    def __init__(self, sessionId, customerId):
-        self.sessionId = sessionId
-        self.customerId = customerId
-        self.tone = self._set_tone()
+    def __init__(self, deployment: Optional[str] = None):
+        self.deployment = deployment or os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT_NAME"]
         self.chain = self._create_chain_response()
 
     def _create_chain_response(self):
 
-        model = AzureChatOpenAI(
-            api_key=os.environ["AZURE_OPENAI_API_KEY"],
-            azure_endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
-            openai_api_version=os.environ["AZURE_OPENAI_API_VERSION"],
-            azure_deployment=os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT_NAME"],
-        )
+        model = create_chat_model(self.deployment)
         prompt = ChatPromptTemplate.from_template(PROMPT_GENAI_RESPONSE)
         parser = StrOutputParser()
 
         chain = prompt | model | parser
         return chain
 
-    def _set_tone(self):
-        if self.customerId == "A":
+    @staticmethod
+    def _set_tone(customerId: str) -> str:
+        if customerId == "A":
             return "高端VIP用戶"
-        elif self.customerId == "B":
+        elif customerId == "B":
             return "重點關心客戶"
         else:
             return "一般用戶"
 
-    def generate_answer(
+    def _build_input(
         self,
-        tid: str,
+        customerId: str,
         message: str,
         consumptionNumber: str,
         totalAmount: str,
         storeName: List,
         categoryName: List,
-        **kwargs,
     ) -> Dict:
+        tone = self._set_tone(customerId)
+        return {
+            "message": message,
+            "consumptionNumber": consumptionNumber,
+            "totalAmount": totalAmount,
+            "storeName": storeName,
+            "categoryName": categoryName,
+            "tone": tone,
+            "desc": CUST_DESC.get(tone),
+        }
 
+    @staticmethod
+    def _new_response() -> Dict:
         response = {}
         response["genAI"] = {"message": None}
         response["template"] = {"tid": None, "blockReason": None}
+        return response
+
+    @staticmethod
+    def _fill_response(response: Dict, tid: str, gen_ai_message: str):
+        if BLOCK_MARKER in gen_ai_message:
+            response["template"]["tid"] = "98"
+            response["template"]["blockReason"] = gen_ai_message
+
+        else:
+
+            response["genAI"]["message"] = gen_ai_message
+            response["template"]["tid"] = tid
+            response["template"]["blockReason"] = None
+
+    def generate_answer(
+        self,
+        sessionId: str,
+        customerId: str,
+        tid: str,
+        message: str,
+        consumptionNumber: str,
+        totalAmount: str,
+        storeName: List,
+        categoryName: List,
+        **kwargs,
+    ) -> Dict:
+
+        response = self._new_response()
 
         try:
-            if "被阻擋" in (
-                gen_ai_message := self.chain.invoke(
-                    {
-                        "message": message,
-                        "consumptionNumber": consumptionNumber,
-                        "totalAmount": totalAmount,
-                        "storeName": storeName,
-                        "categoryName": categoryName,
-                        "tone": self.tone,
-                        "desc": CUST_DESC.get(self.tone),
-                    }
+            with stage("genai_llm"):
+                gen_ai_message = self.chain.invoke(
+                    self._build_input(
+                        customerId, message, consumptionNumber, totalAmount, storeName, categoryName
+                    )
                 )
-            ):
-                response["template"]["tid"] = "98"
-                response["template"]["blockReason"] = gen_ai_message
+            self._fill_response(response, tid, gen_ai_message)
 
-            else:
+        except TimeOutError:
+            raise
+
+        except Exception as e:
+            response["template"]["tid"] = "98"
+            response["template"]["blockReason"] = e
+
+        finally:
+            response["sessionId"] = sessionId
+            response["customerId"] = customerId
+
+        return response
+
+    async def agenerate_answer(
+        self,
+        sessionId: str,
+        customerId: str,
+        tid: str,
+        message: str,
+        consumptionNumber: str,
+        totalAmount: str,
+        storeName: List,
+        categoryName: List,
+        **kwargs,
+    ) -> Dict:
+        """
+        generate_answer 的 async 版本, 以 ainvoke 呼叫 LLM。
+        """
 
-                response["genAI"]["message"] = gen_ai_message
-                response["template"]["tid"] = tid
-                response["template"]["blockReason"] = None
+        response = self._new_response()
+
+        try:
+            with stage("genai_llm"):
+                gen_ai_message = await self.chain.ainvoke(
+                    self._build_input(
+                        customerId, message, consumptionNumber, totalAmount, storeName, categoryName
+                    )
+                )
+            self._fill_response(response, tid, gen_ai_message)
+
+        except TimeOutError:
+            raise
 
         except Exception as e:
             response["template"]["tid"] = "98"
             response["template"]["blockReason"] = e
 
         finally:
-            response["sessionId"] = self.sessionId
-            response["customerId"] = self.customerId
+            response["sessionId"] = sessionId
+            response["customerId"] = customerId
 
         return response
 
+    async def abatch_generate_answer(
+        self, items: List[Dict], max_concurrency: int = 8
+    ) -> List[Union[Dict, Exception]]:
+        """
+        以 chain.abatch 批次產生回覆, 最多同時執行 max_concurrency 筆。
+
+        :param items: TRANRQ 清單, 欄位同 generate_answer 的參數
+        :return: 與 items 順序相同的結果, 欄位缺漏的項目為 Exception
+        """
+        results: List[Union[Dict, Exception]] = [None] * len(items)
+        inputs, positions = [], []
+        for i, item in enumerate(items):
+            try:
+                position = (i, item["tid"], item["sessionId"], item["customerId"])
+                inputs.append(
+                    self._build_input(
+                        item["customerId"],
+                        item["message"],
+                        item["consumptionNumber"],
+                        item["totalAmount"],
+                        item["storeName"],
+                        item["categoryName"],
+                    )
+                )
+                positions.append(position)
+            except Exception as e:
+                results[i] = e
+
+        with stage("genai_llm_batch"):
+            messages = await self.chain.abatch(
+                inputs,
+                config={"max_concurrency": max_concurrency},
+                return_exceptions=True,
+            )
+        for (i, tid, sessionId, customerId), gen_ai_message in zip(positions, messages):
+            response = self._new_response()
+            if isinstance(gen_ai_message, TimeOutError):
+                results[i] = gen_ai_message
+                continue
+            if isinstance(gen_ai_message, Exception):
+                response["template"]["tid"] = "98"
+                response["template"]["blockReason"] = gen_ai_message
+            else:
+                self._fill_response(response, tid, gen_ai_message)
+            response["sessionId"] = sessionId
+            response["customerId"] = customerId
+            results[i] = response
+
+        return results
+
+    async def astream_answer(
+        self,
+        sessionId: str,
+        customerId: str,
+        tid: str,
+        message: str,
+        consumptionNumber: str,
+        totalAmount: str,
+        storeName: List,
+        categoryName: List,
+        **kwargs,
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        generate_answer 的串流版本, 以 astream 逐段產生回覆。
+
+        依序 yield ("token", 文字片段), 最後 yield ("end", response)。
+        串流過程中持續檢查 BLOCK_MARKER, 偵測到時立即停止生成並以 tid 98 結束;
+        為了不輸出半個 BLOCK_MARKER, 最後 len(BLOCK_MARKER) - 1 個字會延後送出。
+        """
+
+        response = self._new_response()
+        hold = len(BLOCK_MARKER) - 1
+        text = ""
+        sent = 0
+        # generator 會跨 yield 暫停, 以 record_stage 記錄首字與總耗時, 不使用 stage()
+        start = time.perf_counter()
+        first_token = None
+
+        try:
+            stream = self.chain.astream(
+                self._build_input(
+                    customerId, message, consumptionNumber, totalAmount, storeName, categoryName
+                )
+            )
+            try:
+                async for chunk in stream:
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                        record_stage("genai_llm_first_token", first_token)
+                    text += chunk
+                    if BLOCK_MARKER in text[max(0, sent - hold):]:
+                        break
+                    if len(text) - hold > sent:
+                        yield "token", text[sent:len(text) - hold]
+                        sent = len(text) - hold
+            finally:
+                # 提前結束 (被阻擋、用戶斷線) 時關閉上游串流, 停止 LLM 繼續生成
+                await stream.aclose()
+
+            if BLOCK_MARKER not in text and sent < len(text):
+                yield "token", text[sent:]
+            self._fill_response(response, tid, text)
+            record_stage("genai_llm_stream", time.perf_counter() - start)
+
+        except TimeOutError:
+            record_stage("genai_llm_stream", time.perf_counter() - start, "error")
+            raise
+
+        except Exception as e:
+            record_stage("genai_llm_stream", time.perf_counter() - start, "error")
+            response["template"]["tid"] = "98"
+            response["template"]["blockReason"] = e
+
+        finally:
+            response["sessionId"] = sessionId
+            response["customerId"] = customerId
+
+        yield "end", response
@@ -0,0 +1,115 @@
+import os
+import threading
+from typing import List, Optional
+from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
+from setting.config import Settings
+from app.setting.utils_resilience import ResiliencePolicy, ResilientChatModel, ResilientEmbeddings, parse_stage_timeouts
+from app.setting.utils_router import DeploymentRouter, parse_deployments
+from app.setting.utils_token import token_usage_callback
+
+_lock = threading.Lock()
+_router: Optional[DeploymentRouter] = None
+
+
+def create_policy(router: Optional[DeploymentRouter] = None) -> ResiliencePolicy:
+    """
+    依設定建立 LLM / embedding 呼叫共用的逾時、重試與 hedging 規則。
+
+    :param router: 多個 deployment 時依負載分配請求
+    """
+    return ResiliencePolicy(
+        timeout=Settings.LLM_TIMEOUT,
+        stage_timeouts=parse_stage_timeouts(Settings.LLM_STAGE_TIMEOUTS),
+        max_retries=Settings.LLM_MAX_RETRIES,
+        backoff=Settings.LLM_RETRY_BACKOFF,
+        backoff_max=Settings.LLM_RETRY_BACKOFF_MAX,
+        hedge_delay=Settings.LLM_HEDGE_DELAY,
+        failure_threshold=Settings.LLM_CIRCUIT_FAILURES,
+        reset_timeout=Settings.LLM_CIRCUIT_RESET_SECONDS,
+        router=router,
+    )
+
+
+def get_router() -> DeploymentRouter:
+    """
+    取得 AZURE_OPENAI_CHAT_DEPLOYMENTS 的共用 router, 讓各 pipeline 看到同一份負載。
+    """
+    global _router
+    if _router is None:
+        with _lock:
+            if _router is None:
+                _router = DeploymentRouter(
+                    parse_deployments(Settings.LLM_DEPLOYMENTS, os.environ["AZURE_OPENAI_ENDPOINT"]),
+                    throttle_seconds=Settings.LLM_THROTTLE_SECONDS,
+                )
+    return _router
+
+
+def _chat_deployments(deployment: str) -> List[str]:
+    if Settings.LLM_HEDGE_DEPLOYMENT and Settings.LLM_HEDGE_DEPLOYMENT != deployment:
+        return [deployment, Settings.LLM_HEDGE_DEPLOYMENT]
+    return [deployment]
+
+
+def _create_routed_chat_model() -> ResilientChatModel:
+    router = get_router()
+    models = [
+        (d.name, AzureChatOpenAI(
+            api_key=os.environ[d.api_key_env],
+            azure_endpoint=d.endpoint,
+            openai_api_version=os.environ["AZURE_OPENAI_API_VERSION"],
+            azure_deployment=d.deployment,
+            timeout=Settings.LLM_TIMEOUT,
+            max_retries=0,
+            callbacks=[token_usage_callback, router.callback(d.name)],
+        ))
+        for d in router.deployments.values()
+    ]
+    return ResilientChatModel(models, create_policy(router))
+
+
+def create_chat_model(deployment: str) -> ResilientChatModel:
+    """
+    建立 chat model; 有設定 hedge deployment 時一併建立, 逾時與重試都由 ResiliencePolicy 處理。
+
+    hedge deployment 可在另一個 region, 以 AZURE_OPENAI_HEDGE_ENDPOINT / AZURE_OPENAI_HEDGE_API_KEY
+    指定, 未設定時與主要 deployment 相同。
+
+    有設定 AZURE_OPENAI_CHAT_DEPLOYMENTS 時, 預設 deployment 改為依負載分配到清單中的
+    deployment, 回應 429 的 deployment 暫停使用並改送其他 deployment。
+
+    :param deployment: Azure OpenAI chat deployment
+    :return: 可直接放在 chain 中的 model
+    """
+    if Settings.LLM_DEPLOYMENTS and deployment == os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT_NAME"]:
+        return _create_routed_chat_model()
+
+    models = []
+    for i, name in enumerate(_chat_deployments(deployment)):
+        prefix = "AZURE_OPENAI_HEDGE" if i else "AZURE_OPENAI"
+        models.append((name, AzureChatOpenAI(
+            api_key=os.environ.get(f"{prefix}_API_KEY") or os.environ["AZURE_OPENAI_API_KEY"],
+            azure_endpoint=os.environ.get(f"{prefix}_ENDPOINT") or os.environ["AZURE_OPENAI_ENDPOINT"],
+            openai_api_version=os.environ["AZURE_OPENAI_API_VERSION"],
+            azure_deployment=name,
+            timeout=Settings.LLM_TIMEOUT,
+            max_retries=0,  # 重試由 ResiliencePolicy 處理, 避免 openai client 的重試疊加
+            callbacks=[token_usage_callback],
+        )))
+    return ResilientChatModel(models, create_policy())
+
+
+def create_embeddings() -> ResilientEmbeddings:
+    """
+    建立 Azure OpenAI embeddings, 查詢與寫入共用同一個 client。
+    """
+    deployment = os.environ["AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME"]
+    embeddings = AzureOpenAIEmbeddings(
+        api_key=os.environ["AZURE_OPENAI_EMBEDDING_API_KEY"],
+        azure_endpoint=os.environ["AZURE_OPENAI_EMBEDDING_ENDPOINT"],
+        azure_deployment=deployment,
+        openai_api_version=os.environ["AZURE_OPENAI_EMBEDDING_API_VERSION"],
+        timeout=Settings.LLM_TIMEOUT,
+        max_retries=0,
+    )
+    return ResilientEmbeddings([(deployment, embeddings)], create_policy())
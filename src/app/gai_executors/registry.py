@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple
+from sqlalchemy.engine import Connectable
+
+# ChainNer / GenAIResponse 會載入 langchain_openai 與 chromadb, 第一次建立時才 import
+if TYPE_CHECKING:
+    from app.gai_executors.chain_ner import ChainNer
+    from app.gai_executors.gai_response import GenAIResponse
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_chain_ners: Dict[Tuple[str, str], "ChainNer"] = {}
+_genai_responses: Dict[str, "GenAIResponse"] = {}
+# 建立中的 pipeline, 同一個 key 的 async 呼叫共用同一個建立 thread
+_building: Dict[Tuple, asyncio.Future] = {}
+
+
+def _default_deployment() -> str:
+    return os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT_NAME"]
+
+
+def get_chain_ner(
+    collection_name: str,
+    engine: Connectable,
+    deployment: Optional[str] = None,
+    async_engine: Optional[Connectable] = None,
+) -> "ChainNer":
+    """
+    取得 (collection, deployment) 對應的共用 ChainNer, 每個 worker 只建立一次。
+
+    :param collection_name: Chroma DB 集合的名稱
+    :param engine: chat history 使用的 SQLAlchemy engine
+    :param deployment: Azure OpenAI chat deployment, 預設讀取環境變數
+    :param async_engine: async 路徑使用的 async engine, None 時共用 engine
+    :return: 共用的 ChainNer
+    """
+    key = (collection_name, deployment or _default_deployment())
+    if (chain_ner := _chain_ners.get(key)) is not None:
+        return chain_ner
+
+    with _lock:
+        if (chain_ner := _chain_ners.get(key)) is None:
+            from app.gai_executors.chain_ner import ChainNer
+
+            logger.info(f"build ChainNer for {key}")
+            chain_ner = ChainNer(
+                chromaCollection=collection_name,
+                engine=engine,
+                deployment=key[1],
+                async_engine=async_engine,
+            )
+            _chain_ners[key] = chain_ner
+    return chain_ner
+
+
+def get_genai_response(deployment: Optional[str] = None) -> "GenAIResponse":
+    """
+    取得 deployment 對應的共用 GenAIResponse, 每個 worker 只建立一次。
+
+    :param deployment: Azure OpenAI chat deployment, 預設讀取環境變數
+    :return: 共用的 GenAIResponse
+    """
+    key = deployment or _default_deployment()
+    if (genai_response := _genai_responses.get(key)) is not None:
+        return genai_response
+
+    with _lock:
+        if (genai_response := _genai_responses.get(key)) is None:
+            from app.gai_executors.gai_response import GenAIResponse
+
+            logger.info(f"build GenAIResponse for {key}")
+            genai_response = GenAIResponse(deployment=key)
+            _genai_responses[key] = genai_response
+    return genai_response
+
+
+async def _abuild(key: Tuple, build: Callable[..., Any], **kwargs) -> Any:
+    """
+    在 thread 中執行 build, 不阻塞 event loop; 同一個 key 同時只建立一次。
+    呼叫端取消 (例如 warm-up 逾時) 時繼續建立, 下一次呼叫等待同一個結果。
+    """
+    if (future := _building.get(key)) is None:
+        future = asyncio.ensure_future(asyncio.to_thread(build, **kwargs))
+        _building[key] = future
+
+        def done(future: asyncio.Future):
+            _building.pop(key, None)
+            # 沒有呼叫端在等待時也取出例外, 失敗後下一次呼叫重新建立
+            if not future.cancelled() and (error := future.exception()) is not None:
+                logger.warning(f"build {key} fail: {type(error).__name__}: {error}")
+
+        future.add_done_callback(done)
+    return await asyncio.shield(future)
+
+
+async def aget_chain_ner(
+    collection_name: str,
+    engine: Connectable,
+    deployment: Optional[str] = None,
+    async_engine: Optional[Connectable] = None,
+) -> "ChainNer":
+    """
+    get_chain_ner 的 async 版本; 尚未建立時在 thread 中建立 (會連線 Chroma), 不阻塞 event loop。
+    """
+    key = (collection_name, deployment or _default_deployment())
+    if (chain_ner := _chain_ners.get(key)) is not None:
+        return chain_ner
+    return await _abuild(
+        ("chain_ner",) + key,
+        get_chain_ner,
+        collection_name=collection_name,
+        engine=engine,
+        deployment=key[1],
+        async_engine=async_engine,
+    )
+
+
+async def aget_genai_response(deployment: Optional[str] = None) -> "GenAIResponse":
+    """
+    get_genai_response 的 async 版本; 尚未建立時在 thread 中建立, 不阻塞 event loop。
+    """
+    key = deployment or _default_deployment()
+    if (genai_response := _genai_responses.get(key)) is not None:
+        return genai_response
+    return await _abuild(("genai_response", key), get_genai_response, deployment=key)
+
+
+def is_built(collection_name: str, deployment: Optional[str] = None) -> bool:
+    """
+    :return: collection 的 ChainNer 與 GenAIResponse 是否皆已建立
+    """
+    key = deployment or _default_deployment()
+    return (collection_name, key) in _chain_ners and key in _genai_responses
+
+
+def clear():
+    """
+    清除所有共用的 pipeline, 下一次取得時重新建立。
+    """
+    with _lock:
+        _chain_ners.clear()
+        _genai_responses.clear()
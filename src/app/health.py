@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from app.setting.config import Settings
+from app.setting.utils_metrics import Gauge
+from app.gai_executors.registry import aget_chain_ner, aget_genai_response
+
+
+logger = logging.getLogger(__name__)
+
+DEPENDENCY_UP = Gauge("dependency_up", "Last check of a dependency, 1 ok / 0 fail", ["dependency"])
+WARMUP_SECONDS = Gauge("warmup_seconds", "Wall time of the startup warm-up")
+
+WARMUP_QUESTION = "請給我上個月在蝦皮的消費紀錄"
+
+
+class HealthMonitor:
+    """
+    啟動 warm-up 與依賴檢查:
+    - warm_up 預先建立共用的 client / chain, 填滿 DB pool, 並對 LLM、embedding、向量檢索各送一次請求
+    - /healthz 只回報目前已知的狀態, 不做網路呼叫
+    - /readyz 在 warm-up 完成後即時檢查 DB 與 Chroma, 結果快取 check_ttl 秒;
+      pipeline 尚未建立時 (warm-up 逾時或未執行) 一併在背景建立, 建立完成前不接收流量
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        collection_name: str,
+        async_engine=None,
+        required=("database", "chroma", "pipelines"),
+        check_ttl: float = 5,
+        check_timeout: float = 3,
+    ):
+        """
+        :param engine: SQLAlchemy engine
+        :param collection_name: Chroma DB 集合的名稱
+        :param async_engine: async engine, 有設定時一併填滿其 pool
+        :param required: readiness 必須成功的依賴, 其餘依賴失敗只標示為 degraded
+        :param check_ttl: readiness 即時檢查的快取秒數
+        :param check_timeout: 單一依賴檢查的 timeout 秒數
+        """
+        self.engine = engine
+        self.async_engine = async_engine
+        self.collection_name = collection_name
+        self.required = tuple(required)
+        self.check_ttl = check_ttl
+        self.check_timeout = check_timeout
+        self.started_at = time.time()
+        self.warmed_up = False
+        self.dependencies: Dict[str, Dict] = {}
+        self._checked_at = 0.0
+        self._check_lock: Optional[asyncio.Lock] = None
+
+    def _set(self, name: str, ok: bool, seconds: float, error: Optional[Exception] = None):
+        self.dependencies[name] = {
+            "status": "ok" if ok else "fail",
+            "latencyMs": round(seconds * 1000, 1),
+            "error": None if error is None else f"{type(error).__name__}: {error}"[:200],
+            "checkedAt": datetime.now().strftime("%Y/%m/%d %H:%M:%S"),
+        }
+        DEPENDENCY_UP.set(1 if ok else 0, dependency=name)
+
+    async def _run(self, name: str, func: Callable[[], Awaitable], timeout: float) -> bool:
+        """
+        執行一項檢查並記錄結果, 失敗時不拋出例外。
+        """
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(func(), timeout)
+        except Exception as e:
+            self._set(name, False, time.perf_counter() - start, e)
+            logger.warning(f"{name} check fail: {type(e).__name__}: {e}")
+            return False
+        ok = result is not False
+        self._set(name, ok, time.perf_counter() - start)
+        return ok
+
+    def _check_database(self, connections: int = 1):
+        """
+        取出 connections 條連線並各執行一次 SELECT 1, 用來檢查 DB 或預先建立 pool 的連線。
+        """
+        opened = []
+        try:
+            for _ in range(connections):
+                connection = self.engine.connect()
+                opened.append(connection)
+                connection.execute(text("SELECT 1"))
+        finally:
+            for connection in opened:
+                connection.close()
+
+    async def _check_async_database(self, connections: int = 1):
+        async def select():
+            async with self.async_engine.connect() as connection:
+                await connection.execute(text("SELECT 1"))
+
+        await asyncio.gather(*(select() for _ in range(connections)))
+
+    def _check_chroma(self, reconnect: bool = False) -> bool:
+        """
+        :param reconnect: heartbeat 失敗時重新連線; 只在 warm-up 時使用, 不在接收流量時替換 client
+        """
+        from app.vdb_connector import ChromaDBClient
+
+        chroma = ChromaDBClient.get_instance(collection_name=self.collection_name)
+        return chroma.ensure_healthy() if reconnect else chroma.heartbeat()
+
+    async def _build_pipelines(self):
+        """
+        在 thread 中建立共用的 ChainNer 與 GenAIResponse; 逾時後仍繼續建立, 供下一次檢查或請求使用。
+
+        :return: ChainNer
+        """
+        chain_ner = await aget_chain_ner(
+            collection_name=self.collection_name,
+            engine=self.engine,
+            async_engine=self.async_engine,
+        )
+        await aget_genai_response()
+        return chain_ner
+
+    def _pipelines_ready(self) -> bool:
+        return self.dependencies.get("pipelines", {}).get("status") == "ok"
+
+    async def warm_up(self):
+        """
+        建立共用物件並對每個 backend 送出一次請求; 個別步驟失敗不影響其他步驟,
+        結果記錄在 dependencies。
+        """
+        start = time.perf_counter()
+        timeout = Settings.WARMUP_TIMEOUT
+        connections = min(Settings.WARMUP_DB_CONNECTIONS, Settings.DB_POOL_SIZE)
+        logger.info("warm-up start")
+
+        await self._run(
+            "database", lambda: asyncio.to_thread(self._check_database, max(connections, 1)), timeout
+        )
+        if self.async_engine is not None:
+            await self._run("database_async", lambda: self._check_async_database(max(connections, 1)), timeout)
+        await self._run("chroma", lambda: asyncio.to_thread(self._check_chroma, True), timeout)
+
+        chain_ner = None
+
+        async def build():
+            nonlocal chain_ner
+            chain_ner = await self._build_pipelines()
+
+        if await self._run("pipelines", build, timeout) and Settings.WARMUP_SYNTHETIC_CALLS:
+            # embedding 直接呼叫, 不經過 embedding cache, 確保連線真的建立
+            await self._run(
+                "embedding", lambda: chain_ner.vectorstore.embeddings.aembed_query(WARMUP_QUESTION), timeout
+            )
+            await self._run("vector_search", lambda: chain_ner.retriever.ainvoke(WARMUP_QUESTION), timeout)
+            await self._run(
+                "llm",
+                lambda: chain_ner.chain_ner.ainvoke(
+                    {"question": WARMUP_QUESTION, "time": datetime.now().strftime("%Y-%m-%d")}
+                ),
+                timeout,
+            )
+
+        self._checked_at = time.monotonic()
+        self.warmed_up = True
+        elapsed = time.perf_counter() - start
+        WARMUP_SECONDS.set(elapsed)
+        summary = " ".join(f"{name}={value['status']}" for name, value in self.dependencies.items())
+        logger.info(f"warm-up finish in {elapsed:.2f}s: {summary}")
+
+    def skip_warm_up(self):
+        self.warmed_up = True
+
+    async def check(self):
+        """
+        即時檢查 DB 與 Chroma, pipeline 尚未建立時一併建立; check_ttl 秒內重複呼叫時沿用上一次的結果。
+        """
+        if self._check_lock is None:
+            self._check_lock = asyncio.Lock()
+        async with self._check_lock:
+            if time.monotonic() - self._checked_at < self.check_ttl:
+                return
+            checks = [
+                self._run("database", lambda: asyncio.to_thread(self._check_database), self.check_timeout),
+                self._run("chroma", lambda: asyncio.to_thread(self._check_chroma), self.check_timeout),
+            ]
+            if not self._pipelines_ready():
+                checks.append(self._run("pipelines", self._build_pipelines, self.check_timeout))
+            await asyncio.gather(*checks)
+            self._checked_at = time.monotonic()
+
+    def _status(self) -> str:
+        if not self.warmed_up:
+            return "starting"
+        for name in self.required:
+            if self.dependencies.get(name, {}).get("status") != "ok":
+                return "fail"
+        if any(value["status"] != "ok" for value in self.dependencies.values()):
+            return "degraded"
+        return "ok"
+
+    def report(self) -> Dict:
+        return {
+            "status": self._status(),
+            "warmedUp": self.warmed_up,
+            "uptimeSeconds": round(time.time() - self.started_at, 1),
+            "dependencies": self.dependencies,
+        }
+
+    async def readiness(self) -> Dict:
+        """
+        :return: report(); status 為 ok 或 degraded 時可以接收流量
+        """
+        if self.warmed_up:
+            await self.check()
+        return self.report()
@@ -1,35 +1,134 @@
+import asyncio
 import logging
 import os
 import orjson
-import uvicorn
-import mlflow
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from typing import List
+from app.schemas import codec
+from app.schemas.payload import ChatRequest, GenaiRequest, EvaluateRequest, ChatBatchRequest, GenaiBatchRequest
 from app.schemas.response import (
     ChatResponse, GenaiResponse, EvaluateResponse, MWHeader, ChatTranRS,
-    GenAIResponseTranRS, EvaluateTranRS, GenAIModel, BaseGenaiTemplate, ChatTemplate
+    GenAIResponseTranRS, EvaluateTranRS, GenAIModel, BaseGenaiTemplate, ChatTemplate,
+    ChatBatchResponse, GenaiBatchResponse
 )
-from app.setting.utils_mlflow import mlflow_exception_logger, mlflow_openai_callback
+from app.setting.utils_mlflow import configure_autolog, get_openai_callback, mlflow_exception_logger, mlflow_openai_callback, record_stream_usage, telemetry_exporter
 from app.setting.config import Settings
-from app.gai_executors.chain_ner import ChainNer
-from app.gai_executors.gai_response import GenAIResponse
-from app.db.conn import sqlalchemy_engine
+from app.setting.constant import PROMPT_GENAI_RESPONSE, PROMPT_QUESTION_NER
+from app.setting import utils_metrics
+from app.setting.utils_tracing import TimingMiddleware, export_stats
+from app.setting.utils_resilience import DeadlineMiddleware
+from app.setting.utils_admission import AdmissionController, parse_endpoint_limits
+from app.setting.utils_token import estimate_tokens
+from app.setting.utils_logging import LogContextMiddleware, parse_sample_rates, setup_logging, shutdown_logging
+from app.gai_executors.registry import aget_chain_ner, aget_genai_response
+from app.db.conn import sqlalchemy_async_engine, sqlalchemy_engine
 from app.db.model import Base
-from app.db.insert_db import insert_evaluation
+from app.db.insert_db import EvaluationWriter, insert_evaluation
+from app.health import HealthMonitor
 from app.setting.exceptions import *
 
 
-# logging.basicConfig(level=logging.INFO)
+setup_logging(
+    level=Settings.LOG_LEVEL,
+    fmt=Settings.LOG_FORMAT,
+    max_chars=Settings.LOG_MAX_FIELD_CHARS,
+    queue_size=Settings.LOG_QUEUE_MAXSIZE,
+)
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 
 os.environ["PYDEVD_WARN_EVALUATION_TIMEOUT"] = "30"
-tracking_server_uri = os.environ["TRACKING_SERVER_URI"]
-mlflow.set_tracking_uri(tracking_server_uri)
-mlflow.set_experiment("cubelab_demo")
-mlflow.langchain.autolog()
 
-app = FastAPI()
+evaluation_writer = EvaluationWriter(
+    sqlalchemy_engine,
+    batch_size=Settings.EVALUATION_BATCH_SIZE,
+    flush_interval=Settings.EVALUATION_FLUSH_SECONDS,
+    max_queue=Settings.EVALUATION_QUEUE_MAXSIZE,
+)
+export_stats("evaluation_writer", "default", evaluation_writer.stats)
+
+health_monitor = HealthMonitor(
+    sqlalchemy_engine,
+    collection_name=Settings.VDB_COLLECTION,
+    async_engine=sqlalchemy_async_engine,
+    required=[name for name in Settings.READINESS_REQUIRED.split(",") if name],
+    check_ttl=Settings.READINESS_CHECK_TTL,
+    check_timeout=Settings.READINESS_CHECK_TIMEOUT,
+)
+
+admission = AdmissionController(
+    max_concurrency=Settings.ADMISSION_MAX_CONCURRENCY,
+    endpoint_limits=parse_endpoint_limits(Settings.ADMISSION_ENDPOINT_LIMITS),
+    tokens_per_minute=Settings.ADMISSION_TOKENS_PER_MINUTE,
+    burst_tokens=Settings.ADMISSION_TOKEN_BURST,
+    max_queue=Settings.ADMISSION_QUEUE_MAXSIZE,
+    max_wait=Settings.ADMISSION_MAX_WAIT,
+)
+
+# admission control 的 token 成本: prompt 模板加上用戶輸入的估算 token 數
+NER_PROMPT_TOKENS = estimate_tokens(PROMPT_QUESTION_NER)
+GENAI_PROMPT_TOKENS = estimate_tokens(PROMPT_GENAI_RESPONSE)
+
+
+def _chat_tokens(tranrq) -> int:
+    return NER_PROMPT_TOKENS + estimate_tokens(tranrq.message)
+
+
+def _genai_tokens(tranrq) -> int:
+    return GENAI_PROMPT_TOKENS + estimate_tokens(tranrq.message)
+
+
+def _log_task_error(task: asyncio.Task):
+    """
+    取出背景 task 的例外並記錄, 避免例外未被讀取而遺失。
+    """
+    if not task.cancelled() and (error := task.exception()) is not None:
+        logger.warning(f"background task fail: {type(error).__name__}: {error}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if Settings.EVALUATION_WRITE_BEHIND:
+        evaluation_writer.start()
+    telemetry_exporter.start()
+    # autolog 需要連線 tracking server, 在背景設定, 不阻塞啟動
+    autolog = None
+    if Settings.MLFLOW_AUTOLOG:
+        autolog = asyncio.create_task(asyncio.to_thread(configure_autolog))
+        autolog.add_done_callback(_log_task_error)
+    # warm-up 在背景執行, 期間 /healthz 可回應, /readyz 回傳 503
+    warm_up = None
+    if Settings.WARMUP_ENABLED:
+        warm_up = asyncio.create_task(health_monitor.warm_up())
+        warm_up.add_done_callback(_log_task_error)
+    else:
+        health_monitor.skip_warm_up()
+    yield
+    for task in (autolog, warm_up):
+        if task is not None and not task.done():
+            task.cancel()
+    telemetry_exporter.close(timeout=Settings.EVALUATION_DRAIN_TIMEOUT)
+    # 關閉前把尚未寫入的評價寫完
+    evaluation_writer.close(timeout=Settings.EVALUATION_DRAIN_TIMEOUT)
+    if sqlalchemy_async_engine is not None:
+        await sqlalchemy_async_engine.dispose()
+    shutdown_logging()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(TimingMiddleware)
+app.add_middleware(
+    DeadlineMiddleware,
+    budget=Settings.REQUEST_BUDGET_SECONDS,
+    batch_budget=Settings.BATCH_REQUEST_BUDGET_SECONDS,
+)
+app.add_middleware(
+    LogContextMiddleware,
+    prefix="/api/card-consumption/",
+    rates=parse_sample_rates(Settings.LOG_SAMPLE_RATES),
+    default_rate=Settings.LOG_SAMPLE_RATE,
+)
 
 
 # 定义路由
@@ -37,140 +136,336 @@ app = FastAPI()
 # @mlflow_exception_logger
 @mlflow_openai_callback
 async def chat(request: Request):
-    jdata = await request.json()
-    logger.info(f"request: {jdata}")
+    body = await request.body()
+    logger.info("request", extra={"body": body})
     collection_name = Settings.VDB_COLLECTION
-    logger.info(f"collection_name: {collection_name}")
     response = ChatResponse()
-    mwheader = MWHeader(MSGID=jdata["MWHEADER"]["MSGID"],
-                        SOURCECHANNEL=jdata["MWHEADER"]["SOURCECHANNEL"],
-                        TXNSEQ=jdata["MWHEADER"]["TXNSEQ"]
-    )
 
     try:
-        logger.info(f"start chain ner")
-        chain_ner = ChainNer(
-            sessionId=jdata["TRANRQ"]["sessionId"],
-            customerId=jdata["TRANRQ"]["customerId"],
-            chromaCollection=collection_name,
+        rq = codec.decode(body, ChatRequest, response)
+        chain_ner = await aget_chain_ner(
+            collection_name=collection_name,
             engine=sqlalchemy_engine,
-            time=jdata["TRANRQ"]["time"]
+            async_engine=sqlalchemy_async_engine,
         )
-        logger.info("Handling chat request")
-        logger.info(f"message: {jdata['TRANRQ']['message']}")
-        gai_response = chain_ner.search(user_input=jdata["TRANRQ"]["message"])
-        logger.info(f"GAI Response: {gai_response}")
+        async with admission.admit("chat", tokens=_chat_tokens(rq.TRANRQ)):
+            gai_response = await chain_ner.asearch(
+                user_input=rq.TRANRQ.message,
+                sessionId=rq.TRANRQ.sessionId,
+                customerId=rq.TRANRQ.customerId,
+                time=rq.TRANRQ.time
+            )
+        logger.debug("GAI Response: %s", gai_response)
 
         # 建立 ChatTranRS 回應
-        tranrs = ChatTranRS(**gai_response)
+        response.TRANRS = ChatTranRS(**gai_response)
 
-        # 建立 ChatResponse 回應
-        response = ChatResponse(
-            MWHEADER=mwheader,
-            TRANRS=tranrs
-        )
-        
     except CathayDefinedException as e:
         response.MWHEADER.RETURNCODE = e.error_code
         response.MWHEADER.RETURNDESC = e.error_describe
-        logger.exception(e, extra=response.MWHEADER.dict())
+        logger.exception(e, extra={"response": response})
     except Exception as e:
         response.MWHEADER.RETURNCODE = "9999"
         response.MWHEADER.RETURNDESC = "其他異常錯誤"
-        logger.exception(e, extra=response.MWHEADER.dict())
+        logger.exception(e, extra={"response": response})
     else:
-        logger.info("Processed successfully", extra=response.MWHEADER.dict())
+        logger.info("Processed successfully", extra={"response": response})
     finally:
-        logger.info("Return Response", extra=response.dict())
-        return orjson.dumps(response.dict())
+        return codec.encode(response)
 
 @app.post("/api/card-consumption/genai-response")
 # @mlflow_exception_logger
 @mlflow_openai_callback
 async def gai_response(request: Request):
-    jdata = await request.json()
-    logger.info(f"request: {jdata}")
+    body = await request.body()
+    logger.info("request", extra={"body": body})
     response = GenaiResponse()
-    mwheader = MWHeader(MSGID=jdata["MWHEADER"]["MSGID"],
-                        SOURCECHANNEL=jdata["MWHEADER"]["SOURCECHANNEL"],
-                        TXNSEQ=jdata["MWHEADER"]["TXNSEQ"]
+
+    try:
+        rq = codec.decode(body, GenaiRequest, response)
+        genai_response = await aget_genai_response()
+
+        async with admission.admit("genai-response", tokens=_genai_tokens(rq.TRANRQ)):
+            gai_response_msg = await genai_response.agenerate_answer(
+                sessionId=rq.TRANRQ.sessionId,
+                customerId=rq.TRANRQ.customerId,
+                message=rq.TRANRQ.message,
+                tid=rq.TRANRQ.tid,
+                consumptionNumber=rq.TRANRQ.consumptionNumber,
+                totalAmount=rq.TRANRQ.totalAmount,
+                storeName=rq.TRANRQ.storeName,
+                categoryName=rq.TRANRQ.categoryName
+            )
+        logger.debug("GAI response msg: %s", gai_response_msg)
+
+        response.TRANRS = GenAIResponseTranRS(**gai_response_msg)
+
+    except CathayDefinedException as e:
+        response.MWHEADER.RETURNCODE = e.error_code
+        response.MWHEADER.RETURNDESC = e.error_describe
+        logger.exception(e, extra={"response": response})
+    except Exception as e:
+        response.MWHEADER.RETURNCODE = "9999"
+        response.MWHEADER.RETURNDESC = "其他異常錯誤"
+        logger.exception(e, extra={"response": response})
+    else:
+        logger.info("Processed successfully", extra={"response": response})
+    finally:
+        return codec.encode(response)
+
+def _batch_item_response(response_cls, tranrs_cls, mwheader: MWHeader, result):
+    """
+    將批次中單筆的結果包裝成該筆的回應電文, 錯誤以該筆 MWHEADER 的 RETURNCODE 表示。
+    """
+    response = response_cls(MWHEADER=mwheader.model_copy())
+    try:
+        if isinstance(result, Exception):
+            raise result
+        response.TRANRS = tranrs_cls(**result)
+    except CathayDefinedException as e:
+        response.MWHEADER.RETURNCODE = e.error_code
+        response.MWHEADER.RETURNDESC = e.error_describe
+    except KeyError:
+        response.MWHEADER.RETURNCODE = ParsingTranRqError.error_code
+        response.MWHEADER.RETURNDESC = ParsingTranRqError.error_describe
+    except Exception:
+        response.MWHEADER.RETURNCODE = "9999"
+        response.MWHEADER.RETURNDESC = "其他異常錯誤"
+    return response
+
+
+async def _run_valid(items: List, run) -> List:
+    """
+    只把驗證通過的項目交給 run 批次執行, 驗證失敗的項目保留其 ParsingTranRqError。
+    """
+    valid = [i for i, item in enumerate(items) if not isinstance(item, Exception)]
+    results = list(items)
+    if valid:
+        outputs = await run([items[i].model_dump() for i in valid])
+        for i, output in zip(valid, outputs):
+            results[i] = output
+    return results
+
+
+def _admit_batch(endpoint: str, items: List, tokens):
+    """
+    批次請求依驗證通過的項目計算 token 成本, 並以批次的並行上限佔用並行數。
+    """
+    valid = [item for item in items if not isinstance(item, Exception)]
+    return admission.admit(
+        endpoint,
+        tokens=sum(tokens(item) for item in valid),
+        slots=min(len(valid), Settings.BATCH_MAX_CONCURRENCY),
     )
 
+
+@app.post("/api/card-consumption/chat:batch")
+@mlflow_openai_callback
+async def chat_batch(request: Request):
+    body = await request.body()
+    logger.info("request", extra={"body": body})
+    response = ChatBatchResponse()
+
     try:
-        genai_response = GenAIResponse(
-            sessionId=jdata["TRANRQ"]["sessionId"],
-            customerId=jdata["TRANRQ"]["customerId"]
-        )
+        _, items = codec.decode_batch(body, ChatBatchRequest, response, Settings.BATCH_MAX_ITEMS)
 
-        gai_response_msg = genai_response.generate_answer(
-            message=jdata["TRANRQ"]["message"],
-            tid=jdata["TRANRQ"]["tid"],
-            consumptionNumber=jdata["TRANRQ"]["consumptionNumber"],
-            totalAmount=jdata["TRANRQ"]["totalAmount"],
-            storeName=jdata["TRANRQ"]["storeName"],
-            categoryName=jdata["TRANRQ"]["categoryName"]
-        )
-        logger.info(f"GAI response msg: {gai_response_msg}")
-        
-        tranrs = GenAIResponseTranRS(**gai_response_msg)
-        # 建立 ChatResponse 回應
-        response = GenaiResponse(
-            MWHEADER=mwheader,
-            TRANRS=tranrs
+        chain_ner = await aget_chain_ner(
+            collection_name=Settings.VDB_COLLECTION,
+            engine=sqlalchemy_engine,
+            async_engine=sqlalchemy_async_engine,
         )
+        async with _admit_batch("chat:batch", items, _chat_tokens):
+            results = await _run_valid(
+                items,
+                lambda valid: chain_ner.abatch_search(valid, max_concurrency=Settings.BATCH_MAX_CONCURRENCY),
+            )
+        response.TRANRS = [
+            _batch_item_response(ChatResponse, ChatTranRS, response.MWHEADER, result)
+            for result in results
+        ]
 
     except CathayDefinedException as e:
         response.MWHEADER.RETURNCODE = e.error_code
         response.MWHEADER.RETURNDESC = e.error_describe
-        logger.exception(e, extra=response.MWHEADER.dict())
+        logger.exception(e, extra={"response": response})
     except Exception as e:
         response.MWHEADER.RETURNCODE = "9999"
         response.MWHEADER.RETURNDESC = "其他異常錯誤"
-        logger.exception(e, extra=response.MWHEADER.dict())
+        logger.exception(e, extra={"response": response})
     else:
-        logger.info("Processed successfully", extra=response.MWHEADER.dict())
+        logger.info("Processed successfully", extra={"response": response})
     finally:
-        logger.info("Return Response", extra=response.dict())
-        return orjson.dumps(response.dict())
+        return codec.encode(response)
+
+
+@app.post("/api/card-consumption/genai-response:batch")
+@mlflow_openai_callback
+async def gai_response_batch(request: Request):
+    body = await request.body()
+    logger.info("request", extra={"body": body})
+    response = GenaiBatchResponse()
+
+    try:
+        _, items = codec.decode_batch(body, GenaiBatchRequest, response, Settings.BATCH_MAX_ITEMS)
+
+        genai_response = await aget_genai_response()
+        async with _admit_batch("genai-response:batch", items, _genai_tokens):
+            results = await _run_valid(
+                items,
+                lambda valid: genai_response.abatch_generate_answer(valid, max_concurrency=Settings.BATCH_MAX_CONCURRENCY),
+            )
+        response.TRANRS = [
+            _batch_item_response(GenaiResponse, GenAIResponseTranRS, response.MWHEADER, result)
+            for result in results
+        ]
+
+    except CathayDefinedException as e:
+        response.MWHEADER.RETURNCODE = e.error_code
+        response.MWHEADER.RETURNDESC = e.error_describe
+        logger.exception(e, extra={"response": response})
+    except Exception as e:
+        response.MWHEADER.RETURNCODE = "9999"
+        response.MWHEADER.RETURNDESC = "其他異常錯誤"
+        logger.exception(e, extra={"response": response})
+    else:
+        logger.info("Processed successfully", extra={"response": response})
+    finally:
+        return codec.encode(response)
+
+
+def _sse(event: str, data: dict) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+@app.post("/api/card-consumption/genai-response/stream")
+async def gai_response_stream(request: Request):
+    """
+    /genai-response 的 SSE 版本: 第一個 frame (event: header) 為 MWHEADER 與 TRANRS 外框,
+    接著逐段送出回覆 (event: token), 最後一個 frame (event: end) 為完整的回應電文。
+    電文檢核失敗或系統忙碌 (2004) 時只送出 end frame。
+    """
+    body = await request.body()
+    logger.info("request", extra={"body": body})
+
+    async def event_stream():
+        response = GenaiResponse()
+        prompt_tokens = 0
+        completion = []
+        cb = None
+        try:
+            rq = codec.decode(body, GenaiRequest, response)
+            response.TRANRS.sessionId = rq.TRANRQ.sessionId
+            response.TRANRS.customerId = rq.TRANRQ.customerId
+            prompt_tokens = _genai_tokens(rq.TRANRQ)
+            # 排隊逾時時只送出 end frame, 與電文檢核失敗相同
+            async with admission.admit("genai-response/stream", tokens=prompt_tokens):
+                yield _sse("header", response.model_dump())
+
+                genai_response = await aget_genai_response()
+                # 與 /genai-response 的 mlflow_openai_callback 相同, 記錄用量到 telemetry
+                with get_openai_callback() as cb:
+                    async for event, data in genai_response.astream_answer(
+                        sessionId=rq.TRANRQ.sessionId,
+                        customerId=rq.TRANRQ.customerId,
+                        message=rq.TRANRQ.message,
+                        tid=rq.TRANRQ.tid,
+                        consumptionNumber=rq.TRANRQ.consumptionNumber,
+                        totalAmount=rq.TRANRQ.totalAmount,
+                        storeName=rq.TRANRQ.storeName,
+                        categoryName=rq.TRANRQ.categoryName
+                    ):
+                        if event == "token":
+                            completion.append(data)
+                            yield _sse("token", {"message": data})
+                        else:
+                            logger.debug("GAI response msg: %s", data)
+                            response.TRANRS = GenAIResponseTranRS(**data)
+
+        except CathayDefinedException as e:
+            response.MWHEADER.RETURNCODE = e.error_code
+            response.MWHEADER.RETURNDESC = e.error_describe
+            logger.exception(e, extra={"response": response})
+        except Exception as e:
+            response.MWHEADER.RETURNCODE = "9999"
+            response.MWHEADER.RETURNDESC = "其他異常錯誤"
+            logger.exception(e, extra={"response": response})
+        else:
+            logger.info("Processed successfully", extra={"response": response})
+        finally:
+            if cb is not None:
+                record_stream_usage("gai_response_stream", cb, prompt_tokens, "".join(completion))
+
+        yield _sse("end", response.model_dump())
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.post("/api/card-consumption/evaluate")
 async def evaluate(request: Request):
-    jdata = await request.json()
-    logger.info(f"request: {jdata}")
+    body = await request.body()
+    logger.info("request", extra={"body": body})
     response = EvaluateResponse()
-    response.MWHEADER.MSGID = jdata["MWHEADER"]["MSGID"]
-    response.MWHEADER.SOURCECHANNEL = jdata["MWHEADER"]["SOURCECHANNEL"]
-    response.MWHEADER.TXNSEQ = jdata["MWHEADER"]["TXNSEQ"]
-
-    response.TRANRS.sessionId = jdata["TRANRQ"]["sessionId"]
-    response.TRANRS.customerId = jdata["TRANRQ"]["customerId"]
 
     try:
+        rq = codec.decode(body, EvaluateRequest, response)
+        response.TRANRS = EvaluateTranRS.model_construct(
+            sessionId=rq.TRANRQ.sessionId,
+            customerId=rq.TRANRQ.customerId,
+        )
         evaluation_data = {
-            "TXNSEQ": jdata["MWHEADER"]["TXNSEQ"],
-            "SESSIONI_ID": jdata["TRANRQ"]["sessionId"],
-            "CUSTOMER_ID": jdata["TRANRQ"]["customerId"],
-            "EVALUATE": jdata["TRANRQ"]["evaluate"],
-            "TIME": jdata["TRANRQ"]["time"]
+            "TXNSEQ": rq.MWHEADER.TXNSEQ,
+            "SESSIONI_ID": rq.TRANRQ.sessionId,
+            "CUSTOMER_ID": rq.TRANRQ.customerId,
+            "EVALUATE": rq.TRANRQ.evaluate,
+            "TIME": rq.TRANRQ.time
         }
-        insert_evaluation(obj=evaluation_data,
-                          con=sqlalchemy_engine)
+        if Settings.EVALUATION_WRITE_BEHIND:
+            evaluation_writer.submit(evaluation_data)
+        else:
+            insert_evaluation(obj=evaluation_data,
+                              con=sqlalchemy_engine)
 
     except CathayDefinedException as e:
         response.MWHEADER.RETURNCODE = e.error_code
         response.MWHEADER.RETURNDESC = e.error_describe
-        logger.exception(e, extra=response.MWHEADER.dict())
+        logger.exception(e, extra={"response": response})
     except Exception as e:
         response.MWHEADER.RETURNCODE = "9999"
         response.MWHEADER.RETURNDESC = "其他異常錯誤"
-        logger.exception(e, extra=response.MWHEADER.dict())
+        logger.exception(e, extra={"response": response})
     else:
-        logger.info("Processed successfully", extra=response.MWHEADER.dict())
+        logger.info("Processed successfully", extra={"response": response})
     finally:
-        logger.info("Return Response", extra=response.dict())
-        return orjson.dumps(response.dict())
+        return codec.encode(response)
+
+
+@app.get("/healthz")
+async def healthz():
+    """
+    liveness: 只回報目前已知的狀態, 不呼叫任何依賴。
+    """
+    return JSONResponse(health_monitor.report())
+
+
+@app.get("/readyz")
+async def readyz():
+    """
+    readiness: warm-up 完成且必要的依賴可連線時回傳 200, 否則 503。
+    """
+    report = await health_monitor.readiness()
+    return JSONResponse(report, status_code=200 if report["status"] in ("ok", "degraded") else 503)
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(utils_metrics.render(), media_type=utils_metrics.CONTENT_TYPE)
+
 
+if __name__ == "__main__":
+    import uvicorn
 
-if __name__ == "__main__":    
     Base.metadata.create_all(bind=sqlalchemy_engine)
     uvicorn.run(app="main:app", host="0.0.0.0", port=8080, reload=True)
\ No newline at end of file
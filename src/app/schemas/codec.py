@@ -0,0 +1,108 @@
+# codec.py
+
+import typing
+from typing import List, Tuple, Type, TypeVar, Union
+import orjson
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ValidationError
+from app.schemas import payload, response as rs
+from app.setting.exceptions import ParsingHeaderError, ParsingJsonError, ParsingTranRqError
+
+
+RequestModel = TypeVar("RequestModel", bound=BaseModel)
+
+
+def _describe(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(loc) for loc in item['loc'])}: {item['msg']}" for item in error.errors()
+    )[:500]
+
+
+def _set_header(response: BaseModel, header: payload.MWHeader):
+    # 上下行 MWHEADER 的欄位限制相同; 以驗證的建構子建立, 比 model_construct 快
+    response.MWHEADER = rs.MWHeader(
+        MSGID=header.MSGID,
+        SOURCECHANNEL=header.SOURCECHANNEL,
+        TXNSEQ=header.TXNSEQ,
+    )
+
+
+def _parse_error(error: ValidationError, body: bytes, response: BaseModel) -> Exception:
+    """
+    依第一個錯誤的位置轉成對應的 CathayDefinedException; TRANRQ 錯誤時仍帶入可解析的 MWHEADER。
+    """
+    first = error.errors()[0]
+    if first["type"] == "json_invalid" or not first["loc"]:
+        return ParsingJsonError(_describe(error))
+    if first["loc"][0] == "MWHEADER":
+        return ParsingHeaderError(_describe(error))
+    try:
+        _set_header(response, payload.MWHeader.model_validate(orjson.loads(body)["MWHEADER"]))
+    except Exception:
+        pass
+    return ParsingTranRqError(_describe(error))
+
+
+def decode(body: bytes, request_cls: Type[RequestModel], response: BaseModel) -> RequestModel:
+    """
+    將上行電文一次解析並驗證為 request model, 並把 MWHEADER 帶入回應電文。
+
+    :param body: request body
+    :param request_cls: ChatRequest / GenaiRequest / EvaluateRequest
+    :param response: 回應電文
+    :return: request model
+    :raises ParsingJsonError: 非 JSON 物件
+    :raises ParsingHeaderError: MWHEADER 檢核失敗
+    :raises ParsingTranRqError: TRANRQ 檢核失敗, 回應電文仍帶有原本的 TXNSEQ
+    """
+    try:
+        request = request_cls.model_validate_json(body)
+    except ValidationError as e:
+        raise _parse_error(e, body, response) from None
+    _set_header(response, request.MWHEADER)
+    return request
+
+
+def decode_batch(
+    body: bytes, request_cls: Type[BaseModel], response: BaseModel, max_items: int
+) -> Tuple[payload.MWHeader, List[Union[BaseModel, ParsingTranRqError]]]:
+    """
+    解析批次電文; 全部通過時一次驗證, 否則每筆 TRANRQ 分別驗證, 單筆失敗不影響其他筆。
+
+    :param request_cls: ChatBatchRequest / GenaiBatchRequest
+    :param max_items: TRANRQ 筆數上限
+    :return: (MWHEADER, 與 TRANRQ 順序相同的 model, 驗證失敗的項目為 ParsingTranRqError)
+    """
+    request = None
+    try:
+        request = request_cls.model_validate_json(body)
+    except ValidationError as e:
+        error = _parse_error(e, body, response)
+        if not isinstance(error, ParsingTranRqError):
+            raise error from None
+        data = orjson.loads(body)
+        header, items = payload.MWHeader.model_validate(data["MWHEADER"]), data.get("TRANRQ")
+    else:
+        header, items = request.MWHEADER, request.TRANRQ
+        _set_header(response, header)
+
+    if not isinstance(items, list) or len(items) > max_items:
+        raise ParsingTranRqError(f"TRANRQ must be a list of at most {max_items} items")
+    if request is None:
+        item_cls = typing.get_args(request_cls.model_fields["TRANRQ"].annotation)[0]
+        items = [_validate_item(item_cls, item) for item in items]
+    return header, items
+
+
+def _validate_item(item_cls: Type[BaseModel], item) -> Union[BaseModel, ParsingTranRqError]:
+    try:
+        return item_cls.model_validate(item)
+    except ValidationError as e:
+        return ParsingTranRqError(_describe(e))
+
+
+def encode(response: BaseModel) -> ORJSONResponse:
+    """
+    以 orjson 直接輸出回應電文, 不經過 FastAPI 的 jsonable_encoder。
+    """
+    return ORJSONResponse(response.model_dump())
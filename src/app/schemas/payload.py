@@ -21,6 +21,7 @@ class ChatTRANRQ(BaseTRANRQ):
 
 # TRANRQ 模型 for /genai-response request
 class GenaiTranRQ(BaseTRANRQ):
+    message: str
     tid: constr(max_length=2)
     consumptionNumber: conint(ge=0)
     totalAmount: condecimal(max_digits=20, decimal_places=2)
@@ -65,6 +66,7 @@ class GenaiRequest(BaseModel):
         "TRANRQ": {
             "sessionId": "16574823aA",
             "customerId": "E222222897",
+            "message": "上個月在信義微風的消費",
             "tid": "99",
             "consumptionNumber": 12,
             "totalAmount": 24000.38,
@@ -99,3 +101,54 @@ class EvaluateRequest(BaseModel):
     MWHEADER: MWHeader
     TRANRQ: EvaluateTranRQ
 
+
+# request model for /chat:batch
+class ChatBatchRequest(BaseModel):
+    """
+    {
+        "MWHEADER": {
+            "MSGID": null,
+            "SOURCECHANNEL": "CHAT-API",
+            "TXNSEQ": "008788888-da-aaa-dd"
+        },
+        "TRANRQ": [
+            {
+                "sessionId": "16574823aA",
+                "customerId": "E222222897",
+                "message": "上個月在蝦皮的消費",
+                "time": "2024/09/02 15:35:40"
+            }
+        ]
+    }
+    """
+    MWHEADER: MWHeader
+    TRANRQ: List[ChatTRANRQ]
+
+# request model for /genai-response:batch
+class GenaiBatchRequest(BaseModel):
+    """
+    {
+        "MWHEADER": {
+            "MSGID": null,
+            "SOURCECHANNEL": "CHAT-API",
+            "TXNSEQ": "008788888-da-aaa-dd"
+        },
+        "TRANRQ": [
+            {
+                "sessionId": "16574823aA",
+                "customerId": "E222222897",
+                "message": "上個月在信義微風的消費",
+                "tid": "99",
+                "consumptionNumber": 12,
+                "totalAmount": 24000.38,
+                "startDate": "2024/05/11",
+                "endDate": "2024/06/11",
+                "storeName": ["信義微風"],
+                "categoryName": ["百貨類別"],
+                "time": "2024/09/02 16:35:40"
+            }
+        ]
+    }
+    """
+    MWHEADER: MWHeader
+    TRANRQ: List[GenaiTranRQ]
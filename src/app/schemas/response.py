@@ -1,8 +1,10 @@
 # response.py
 
-from pydantic import BaseModel, constr
+from pydantic import BaseModel, Field, constr
 from typing import Optional, List, Dict
 
+# 巢狀的預設值以 default_factory 建立, 避免每次建構回應時 deepcopy 共用的預設 model
+
 # MWHEADER 模型 for response
 class MWHeader(BaseModel):
     MSGID: Optional[constr(max_length=20)] = None
@@ -38,7 +40,7 @@ class ChatTemplate(BaseGenaiTemplate):
 class ChatTranRS(BaseModel):
     sessionId: constr(max_length=12) = None
     customerId: constr(max_length=10) = None
-    template: ChatTemplate = ChatTemplate()
+    template: ChatTemplate = Field(default_factory=ChatTemplate)
 
 # TranRS for GenAI field
 class GenAIModel(BaseModel):
@@ -52,8 +54,8 @@ class GenAIModel(BaseModel):
 class GenAIResponseTranRS(BaseModel):
     sessionId: constr(max_length=12) = None
     customerId: constr(max_length=10) = None
-    genAI: GenAIModel = GenAIModel()
-    template: BaseGenaiTemplate = BaseGenaiTemplate()
+    genAI: GenAIModel = Field(default_factory=GenAIModel)
+    template: BaseGenaiTemplate = Field(default_factory=BaseGenaiTemplate)
 
 
 # TRANRS for /evaluate response
@@ -64,8 +66,8 @@ class EvaluateTranRS(BaseModel):
 
 # response model for /chat
 class ChatResponse(BaseModel):
-    MWHEADER: MWHeader = MWHeader()
-    TRANRS: ChatTranRS = ChatTranRS()
+    MWHEADER: MWHeader = Field(default_factory=MWHeader)
+    TRANRS: ChatTranRS = Field(default_factory=ChatTranRS)
 
     class Config:
         validate_assignment = True
@@ -73,8 +75,8 @@ class ChatResponse(BaseModel):
 
 # response model for /genai-response
 class GenaiResponse(BaseModel):
-    MWHEADER: MWHeader = MWHeader()
-    TRANRS: GenAIResponseTranRS = GenAIResponseTranRS()
+    MWHEADER: MWHeader = Field(default_factory=MWHeader)
+    TRANRS: GenAIResponseTranRS = Field(default_factory=GenAIResponseTranRS)
 
     class Config:
         validate_assignment = True
@@ -82,9 +84,21 @@ class GenaiResponse(BaseModel):
 
 # response model for /evaluate
 class EvaluateResponse(BaseModel):
-    MWHEADER: MWHeader = MWHeader()
-    TRANRS: EvaluateTranRS = EvaluateTranRS()
+    MWHEADER: MWHeader = Field(default_factory=MWHeader)
+    TRANRS: EvaluateTranRS = Field(default_factory=EvaluateTranRS)
 
     class Config:
         validate_assignment = True
 
+
+
+# response model for /chat:batch
+class ChatBatchResponse(BaseModel):
+    MWHEADER: MWHeader = Field(default_factory=MWHeader)
+    TRANRS: List[ChatResponse] = Field(default_factory=list)
+
+
+# response model for /genai-response:batch
+class GenaiBatchResponse(BaseModel):
+    MWHEADER: MWHeader = Field(default_factory=MWHeader)
+    TRANRS: List[GenaiResponse] = Field(default_factory=list)
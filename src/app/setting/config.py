@@ -6,5 +6,107 @@ class Settings():
     DB_USER = os.environ["DB_USER"]
     DB_PWD = os.environ["DB_PWD"]
     DB_DSN = os.environ["DB_DSN"]
-    ENGINE_ECHO = True
+    ENGINE_ECHO = os.environ.get("ENGINE_ECHO", "false").lower() == "true"
 
+    # SQLAlchemy connection pool
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "20"))
+    DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+    DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+    DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true"
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", "5000"))  # 0 表示不限制
+    DB_ASYNC_ENABLED = os.environ.get("DB_ASYNC_ENABLED", "false").lower() == "true"  # 需要 asyncpg
+
+    # NER cache
+    NER_CACHE_ENABLED = os.environ.get("NER_CACHE_ENABLED", "true").lower() == "true"
+    NER_CACHE_BACKEND = os.environ.get("NER_CACHE_BACKEND", "memory")  # memory / redis
+    NER_CACHE_REDIS_URL = os.environ.get("NER_CACHE_REDIS_URL", "redis://localhost:6379/0")
+    NER_CACHE_MAXSIZE = int(os.environ.get("NER_CACHE_MAXSIZE", "4096"))
+    NER_CACHE_TTL = float(os.environ.get("NER_CACHE_TTL", "86400"))
+    NER_CACHE_SEMANTIC = os.environ.get("NER_CACHE_SEMANTIC", "false").lower() == "true"
+    NER_CACHE_SIMILARITY = float(os.environ.get("NER_CACHE_SIMILARITY", "0.97"))
+
+    # batch endpoints
+    BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "8"))
+    BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "100"))
+
+    # Chroma http client
+    CHROMA_TIMEOUT = float(os.environ.get("CHROMA_TIMEOUT", "10"))
+    CHROMA_MAX_CONNECTIONS = int(os.environ.get("CHROMA_MAX_CONNECTIONS", "50"))
+    CHROMA_KEEPALIVE_EXPIRY = float(os.environ.get("CHROMA_KEEPALIVE_EXPIRY", "60"))
+
+    # query embedding cache
+    EMBEDDING_CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    EMBEDDING_CACHE_MAXSIZE = int(os.environ.get("EMBEDDING_CACHE_MAXSIZE", "4096"))
+    EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "")  # sqlite 檔案, 空值表示只用記憶體
+
+    # in-process mirror of the QA collection
+    VDB_LOCAL_INDEX = os.environ.get("VDB_LOCAL_INDEX", "false").lower() == "true"
+    VDB_INDEX_REFRESH_SECONDS = float(os.environ.get("VDB_INDEX_REFRESH_SECONDS", "300"))
+
+    # chat history 視窗與 per-session 快取
+    CHAT_HISTORY_MAX_MESSAGES = int(os.environ.get("CHAT_HISTORY_MAX_MESSAGES", "20"))
+    CHAT_HISTORY_MAX_TOKENS = int(os.environ.get("CHAT_HISTORY_MAX_TOKENS", "2000"))  # 0 表示不限制
+    CHAT_HISTORY_CACHE_ENABLED = os.environ.get("CHAT_HISTORY_CACHE_ENABLED", "true").lower() == "true"
+    CHAT_HISTORY_CACHE_MAXSIZE = int(os.environ.get("CHAT_HISTORY_CACHE_MAXSIZE", "10000"))
+    CHAT_HISTORY_CACHE_TTL = float(os.environ.get("CHAT_HISTORY_CACHE_TTL", "1800"))  # 每次讀取都以 SQL 的版本驗證, TTL 只限制記憶體用量
+
+    # evaluation write-behind buffer
+    EVALUATION_WRITE_BEHIND = os.environ.get("EVALUATION_WRITE_BEHIND", "true").lower() == "true"
+    EVALUATION_BATCH_SIZE = int(os.environ.get("EVALUATION_BATCH_SIZE", "500"))
+    EVALUATION_FLUSH_SECONDS = float(os.environ.get("EVALUATION_FLUSH_SECONDS", "1"))
+    EVALUATION_QUEUE_MAXSIZE = int(os.environ.get("EVALUATION_QUEUE_MAXSIZE", "10000"))
+    EVALUATION_DRAIN_TIMEOUT = float(os.environ.get("EVALUATION_DRAIN_TIMEOUT", "30"))
+
+    # MLflow telemetry
+    TRACKING_SERVER_URI = os.environ["TRACKING_SERVER_URI"]
+    MLFLOW_EXPERIMENT = os.environ.get("MLFLOW_EXPERIMENT", "cubelab_demo")
+    MLFLOW_AUTOLOG = os.environ.get("MLFLOW_AUTOLOG", "false").lower() == "true"  # langchain trace, 會在請求中同步送出
+    MLFLOW_SAMPLE_RATE = float(os.environ.get("MLFLOW_SAMPLE_RATE", "1.0"))
+    MLFLOW_FLUSH_SECONDS = float(os.environ.get("MLFLOW_FLUSH_SECONDS", "30"))
+    MLFLOW_QUEUE_MAXSIZE = int(os.environ.get("MLFLOW_QUEUE_MAXSIZE", "10000"))
+
+    # async 路徑在 gate 略過問句補完時, NER 與寫入對話歷史重疊執行 (預設開啟); 需要補完時仍依序執行
+    CHAIN_OVERLAP_NER = os.environ.get("CHAIN_OVERLAP_NER", "true").lower() == "true"
+
+    # 啟動 warm-up 與 readiness
+    WARMUP_ENABLED = os.environ.get("WARMUP_ENABLED", "true").lower() == "true"
+    WARMUP_SYNTHETIC_CALLS = os.environ.get("WARMUP_SYNTHETIC_CALLS", "true").lower() == "true"  # 對 LLM / embedding / Chroma 各送一次請求
+    WARMUP_TIMEOUT = float(os.environ.get("WARMUP_TIMEOUT", "60"))  # 每個步驟
+    WARMUP_DB_CONNECTIONS = int(os.environ.get("WARMUP_DB_CONNECTIONS", str(DB_POOL_SIZE)))
+    READINESS_REQUIRED = os.environ.get("READINESS_REQUIRED", "database,chroma,pipelines")
+    READINESS_CHECK_TTL = float(os.environ.get("READINESS_CHECK_TTL", "5"))
+    READINESS_CHECK_TIMEOUT = float(os.environ.get("READINESS_CHECK_TIMEOUT", "3"))
+
+    # logging
+    LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+    LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")  # json / text
+    LOG_MAX_FIELD_CHARS = int(os.environ.get("LOG_MAX_FIELD_CHARS", "2000"))
+    LOG_QUEUE_MAXSIZE = int(os.environ.get("LOG_QUEUE_MAXSIZE", "10000"))
+    LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "1.0"))  # INFO log 的取樣比例, 錯誤一律輸出
+    LOG_SAMPLE_RATES = os.environ.get("LOG_SAMPLE_RATES", "")  # 各 endpoint 的取樣比例, 例如 "chat=0.1,evaluate=0.01"
+
+    # Azure OpenAI 逾時、重試、hedging 與 circuit breaker
+    REQUEST_BUDGET_SECONDS = float(os.environ.get("REQUEST_BUDGET_SECONDS", "30"))  # 每個請求所有 LLM / embedding 呼叫共用, 0 表示不限制
+    BATCH_REQUEST_BUDGET_SECONDS = float(os.environ.get("BATCH_REQUEST_BUDGET_SECONDS", "120"))
+    LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "10"))  # 單次呼叫, 另受剩餘預算限制
+    LLM_STAGE_TIMEOUTS = os.environ.get("LLM_STAGE_TIMEOUTS", "completion_llm=8,ner_llm=8,genai_llm=15,embedding=3")
+    LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "2"))
+    LLM_RETRY_BACKOFF = float(os.environ.get("LLM_RETRY_BACKOFF", "0.2"))
+    LLM_RETRY_BACKOFF_MAX = float(os.environ.get("LLM_RETRY_BACKOFF_MAX", "2"))
+    LLM_HEDGE_DEPLOYMENT = os.environ.get("AZURE_OPENAI_CHAT_HEDGE_DEPLOYMENT_NAME", "")  # 空值表示不使用第二個 deployment
+    LLM_HEDGE_DELAY = float(os.environ.get("LLM_HEDGE_DELAY", "0"))  # 0 表示只在重試與斷路時改送 hedge deployment
+    LLM_CIRCUIT_FAILURES = int(os.environ.get("LLM_CIRCUIT_FAILURES", "5"))
+    LLM_CIRCUIT_RESET_SECONDS = float(os.environ.get("LLM_CIRCUIT_RESET_SECONDS", "30"))
+
+    # 多個 chat deployment 的負載平衡, JSON 陣列 (見 utils_router.parse_deployments), 空值表示只用單一 deployment
+    LLM_DEPLOYMENTS = os.environ.get("AZURE_OPENAI_CHAT_DEPLOYMENTS", "")
+    LLM_THROTTLE_SECONDS = float(os.environ.get("LLM_THROTTLE_SECONDS", "10"))  # 429 沒有 Retry-After 時暫停該 deployment 的秒數
+
+    # Admission control: 超過並行上限或 prompt token 預算時排隊, 佇列已滿或等候逾時回傳 2004
+    ADMISSION_MAX_CONCURRENCY = int(os.environ.get("ADMISSION_MAX_CONCURRENCY", "64"))  # 0 表示不限制
+    ADMISSION_ENDPOINT_LIMITS = os.environ.get("ADMISSION_ENDPOINT_LIMITS", "")  # 例如 "chat=48,genai-response=32"
+    ADMISSION_TOKENS_PER_MINUTE = float(os.environ.get("ADMISSION_TOKENS_PER_MINUTE", "0"))  # 估算的 prompt tokens, 0 表示不限制
+    ADMISSION_TOKEN_BURST = float(os.environ.get("ADMISSION_TOKEN_BURST", "0"))  # 0 表示 10 秒的預算
+    ADMISSION_QUEUE_MAXSIZE = int(os.environ.get("ADMISSION_QUEUE_MAXSIZE", "256"))
+    ADMISSION_MAX_WAIT = float(os.environ.get("ADMISSION_MAX_WAIT", "5"))
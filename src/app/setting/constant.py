@@ -17,7 +17,8 @@ user_input:
 """
 
 
-PROMPT_QUESTION_NER = """
+# PROMPT_QUESTION_NER 拆成數段, 以便組出不含日期換算規則的 PROMPT_QUESTION_NER_LITE
+_NER_HEAD = """
     請對用戶問題進行命名實體識別(ner), 並嚴格以json格式只返回'命名實體'。
     請以json格式返回識別到的內容, key值請遵照下列原則給定:
         時間: "&start_date","&end_date"
@@ -26,14 +27,25 @@ PROMPT_QUESTION_NER = """
         用戶問題挖空命名實體後的結果: "modify_query", 例如'請給我上個月在蝦皮的消費紀錄'辨識出'時間'、'商戶',就要改寫成 '請給我[時間]在[商戶]的消費紀錄'，不會是'請給我[時間]在[蝦皮]的消費紀錄'
     綜合上述, 合法key值的選項只有["modify_query",""&start_date","&end_date","&string","&string1","&string2","&string3",...,"&string999"]
     請注意在user_input中, "商戶"、"類別"不會同時出現, 一定只會有其中一種
-    請注意"&start_date","&end_date"都不可以是空值
+"""
+
+_NER_DATE_REQUIRED = """    請注意"&start_date","&end_date"都不可以是空值
+"""
+
+_NER_DATE_RESOLVED = """    請注意"&start_date","&end_date"已由系統換算, 不需返回, 但時間仍需挖空成[時間]
+"""
 
+_NER_ENTITY_SOURCE = """
     請注意商戶、類別一定源自於user_input的原句, 不會出現任何一個字的改寫, 如果比對不到就表示該段文字不屬於商戶、類別
 
-    時間需依照今天日期轉換為開始時間、結束時間
+"""
+
+_NER_DATE_HINT = """    時間需依照今天日期轉換為開始時間、結束時間
     一周的第一天是星期日
 
-    時間請一定要挖空成[時間],請注意時間副詞如過去、現在、近, 都是[時間]的一部分
+"""
+
+_NER_ENTITY_RULES = """    時間請一定要挖空成[時間],請注意時間副詞如過去、現在、近, 都是[時間]的一部分
     例如'過去[時間]我在[商戶]的消費數字?'就不對, 應該是'[時間]我在[商戶]的消費數字?'
 
     請注意用戶的問題中可能會包含以下類別的命名實體:時間如今天、明天、昨天...、商戶如uber, 蝦皮...、消費類別如餐飲、百貨、休閒等...
@@ -89,7 +101,9 @@ PROMPT_QUESTION_NER = """
     - user_input出現"XXXXXX購物"、"OOO購物"(XXX、OOO只是範例, 實際會是其他商戶名稱)時, 出現在購物兩字前的OOO、XXX都是商戶名稱, "購物"本身是動作, 例如我在"星巴克所購物"的明細, "星巴克所"就是商戶名稱
 
 
-    時間區間部分, 請依據以下規則來計算並返回日期描述所對應的時間區間：
+"""
+
+_NER_DATE_RULES = """    時間區間部分, 請依據以下規則來計算並返回日期描述所對應的時間區間：
     ------------
     1. 每週的第一天是星期日。
 
@@ -153,14 +167,38 @@ PROMPT_QUESTION_NER = """
     ------------
 
 
-    時間請依照今日是{time}進行換算
+"""
+
+_NER_DATE_FORMAT = """    時間請依照今日是{time}進行換算
     解析出來的日期請以YYYY/MM/DD日期格式呈現, 例如"2024-05-01"請寫成2024/05/01
 
-    用戶問題: {question}
+"""
+
+_NER_QUESTION = """    用戶問題: {question}
 
     命名實體:
 """
 
+PROMPT_QUESTION_NER = (
+    _NER_HEAD
+    + _NER_DATE_REQUIRED
+    + _NER_ENTITY_SOURCE
+    + _NER_DATE_HINT
+    + _NER_ENTITY_RULES
+    + _NER_DATE_RULES
+    + _NER_DATE_FORMAT
+    + _NER_QUESTION
+)
+
+# 時間已由 setting.utils_date 換算時使用, 省略日期換算規則
+PROMPT_QUESTION_NER_LITE = (
+    _NER_HEAD
+    + _NER_DATE_RESOLVED
+    + _NER_ENTITY_SOURCE
+    + _NER_ENTITY_RULES
+    + _NER_QUESTION
+)
+
 
 PROMPT_GENAI_RESPONSE = """
 
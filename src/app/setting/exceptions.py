@@ -36,5 +36,10 @@ class TimeOutError(CathayDefinedException):
     error_describe = "連線逾時"
 
 
+class ServiceBusyError(CathayDefinedException):
+    error_code = "2004"
+    error_describe = "系統忙碌中, 請稍後再試"
+
+
 def fmt_msg(e: Exception) -> str:
     return f"{type(e).__name__}, {e}"
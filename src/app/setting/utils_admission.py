@@ -0,0 +1,253 @@
+"""
+Admission control in front of the LLM pipelines.
+
+A request is admitted when a global slot, a slot for its endpoint and its
+estimated prompt tokens in the token bucket are all available. Otherwise it
+waits in a bounded FIFO queue for at most ``max_wait`` seconds (or what is
+left of the request budget). Requests that find the queue full or time out
+are shed with ServiceBusyError (2004), so a burst is answered quickly
+instead of fanning out into provider throttling and retries.
+
+The controller is used from a single event loop and is not thread-safe.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional
+
+from app.setting.exceptions import ServiceBusyError
+from app.setting.utils_metrics import Counter, Gauge, Histogram
+from app.setting.utils_resilience import remaining
+
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_IN_FLIGHT = Gauge("admission_in_flight", "Admitted requests per endpoint", ["endpoint"])
+ADMISSION_WAITING = Gauge("admission_waiting", "Requests waiting for admission")
+ADMISSION_TOKENS = Gauge("admission_bucket_tokens", "Prompt tokens left in the token bucket")
+ADMISSION_SHED = Counter("admission_shed_total", "Requests shed by admission control", ["endpoint", "reason"])
+ADMISSION_WAIT_SECONDS = Histogram("admission_wait_seconds", "Time spent waiting for admission", ["endpoint"])
+
+
+class TokenBucket:
+    """
+    每秒補充 rate 個 token, 最多累積 capacity 個。
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        :param rate: 每秒補充的 token 數
+        :param capacity: 最多累積的 token 數, 即允許的瞬間流量
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def level(self) -> float:
+        self._refill()
+        return self.tokens
+
+    def try_take(self, tokens: float) -> bool:
+        self._refill()
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+    def delay(self, tokens: float) -> float:
+        """
+        :return: 累積到 tokens 個還需要等待的秒數
+        """
+        self._refill()
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+
+class _Waiter:
+    __slots__ = ("endpoint", "slots", "tokens", "future")
+
+    def __init__(self, endpoint: str, slots: int, tokens: float):
+        self.endpoint = endpoint
+        self.slots = slots
+        self.tokens = tokens
+        self.future: Optional[asyncio.Future] = None
+
+
+class AdmissionController:
+    """
+    以全域與各 endpoint 的並行上限, 加上 prompt token 的 token bucket 控制進入 LLM pipeline 的請求。
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 0,
+        endpoint_limits: Optional[Dict[str, int]] = None,
+        tokens_per_minute: float = 0,
+        burst_tokens: float = 0,
+        max_queue: int = 0,
+        max_wait: float = 0,
+    ):
+        """
+        :param max_concurrency: 全域同時處理的請求數, 0 表示不限制
+        :param endpoint_limits: {endpoint: 同時處理的請求數}, 未列出的 endpoint 只受全域限制
+        :param tokens_per_minute: 每分鐘的 prompt token 預算, 0 表示不限制
+        :param burst_tokens: token bucket 的容量, 0 表示 10 秒的預算
+        :param max_queue: 等候中的請求數上限, 0 表示不排隊, 滿載時直接拒絕
+        :param max_wait: 最長等候秒數, 另受請求剩餘預算限制
+        """
+        self.max_concurrency = max_concurrency
+        self.endpoint_limits = endpoint_limits or {}
+        self.bucket = None
+        if tokens_per_minute:
+            self.bucket = TokenBucket(tokens_per_minute / 60, burst_tokens or tokens_per_minute / 6)
+            ADMISSION_TOKENS.set_function(self.bucket.level)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._in_flight = 0
+        self._endpoint_in_flight: Dict[str, int] = {}
+        self._queue: Deque[_Waiter] = deque()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        ADMISSION_WAITING.set_function(lambda: len(self._queue))
+
+    @asynccontextmanager
+    async def admit(self, endpoint: str, tokens: float = 0, slots: int = 1) -> AsyncIterator[None]:
+        """
+        取得配額後執行區塊, 結束時歸還並放行等候中的請求。
+
+        :param endpoint: endpoint 名稱, 對應 endpoint_limits
+        :param tokens: 估算的 prompt tokens, 超過 bucket 容量時以容量計
+        :param slots: 佔用的並行數, 例如批次請求的並行上限
+        :raises ServiceBusyError: 等候佇列已滿或等候逾時
+        """
+        waiter = _Waiter(endpoint, self._slots(endpoint, slots), tokens)
+        if self.bucket is not None:
+            waiter.tokens = min(tokens, self.bucket.capacity)
+        await self._acquire(waiter)
+        try:
+            yield
+        finally:
+            self._release(waiter)
+
+    def _slots(self, endpoint: str, slots: int) -> int:
+        for limit in (self.max_concurrency, self.endpoint_limits.get(endpoint, 0)):
+            if limit:
+                slots = min(slots, limit)
+        return max(1, slots)
+
+    def _has_slots(self, waiter: _Waiter) -> bool:
+        if self.max_concurrency and self._in_flight + waiter.slots > self.max_concurrency:
+            return False
+        limit = self.endpoint_limits.get(waiter.endpoint, 0)
+        return not limit or self._endpoint_in_flight.get(waiter.endpoint, 0) + waiter.slots <= limit
+
+    def _take(self, waiter: _Waiter):
+        self._in_flight += waiter.slots
+        count = self._endpoint_in_flight.get(waiter.endpoint, 0) + waiter.slots
+        self._endpoint_in_flight[waiter.endpoint] = count
+        ADMISSION_IN_FLIGHT.set(count, endpoint=waiter.endpoint)
+
+    def _release(self, waiter: _Waiter):
+        self._in_flight -= waiter.slots
+        count = self._endpoint_in_flight[waiter.endpoint] - waiter.slots
+        self._endpoint_in_flight[waiter.endpoint] = count
+        ADMISSION_IN_FLIGHT.set(count, endpoint=waiter.endpoint)
+        self._dispatch()
+
+    def _shed(self, waiter: _Waiter, reason: str):
+        ADMISSION_SHED.inc(endpoint=waiter.endpoint, reason=reason)
+        raise ServiceBusyError(f"{waiter.endpoint}: {reason}, {self._in_flight} in flight, {len(self._queue)} waiting")
+
+    async def _acquire(self, waiter: _Waiter):
+        # 有人排隊時不插隊, 依序放行
+        if not self._queue and self._has_slots(waiter) and (self.bucket is None or self.bucket.try_take(waiter.tokens)):
+            self._take(waiter)
+            return
+        if len(self._queue) >= self.max_queue:
+            self._shed(waiter, "queue_full")
+        wait = self.max_wait
+        if (left := remaining()) is not None:
+            wait = min(wait, left)
+        if wait <= 0:
+            self._shed(waiter, "deadline")
+
+        waiter.future = asyncio.get_running_loop().create_future()
+        self._queue.append(waiter)
+        self._dispatch()
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter.future, wait)
+        except asyncio.TimeoutError:
+            # 逾時與放行可能同時發生: 名額已交給這個請求時要歸還, 否則會一直被佔用
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(waiter)
+            else:
+                self._remove(waiter)
+            self._shed(waiter, "timeout")
+        except BaseException:
+            # 請求被取消: 已放行就歸還, 否則離開佇列
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(waiter)
+            else:
+                self._remove(waiter)
+            raise
+        finally:
+            ADMISSION_WAIT_SECONDS.observe(time.monotonic() - start, endpoint=waiter.endpoint)
+
+    def _remove(self, waiter: _Waiter):
+        try:
+            self._queue.remove(waiter)
+        except ValueError:
+            return
+        # 離開的可能是佇列最前面等 token 的請求, 讓後面的請求有機會放行
+        self._dispatch()
+
+    def _dispatch(self):
+        """
+        依序放行佇列中的請求: 並行數不足的先略過 (可能是其他 endpoint 已滿),
+        token 不足時停止並在補充足夠時再放行, 避免大的請求一直被小的請求搶先。
+        """
+        for waiter in list(self._queue):
+            if waiter.future.done():
+                continue
+            if not self._has_slots(waiter):
+                continue
+            if self.bucket is not None and not self.bucket.try_take(waiter.tokens):
+                self._schedule(self.bucket.delay(waiter.tokens))
+                break
+            self._queue.remove(waiter)
+            self._take(waiter)
+            waiter.future.set_result(None)
+
+    def _schedule(self, delay: float):
+        loop = asyncio.get_running_loop()
+        when = loop.time() + delay
+        if self._timer is not None:
+            if self._timer.when() <= when:
+                return
+            self._timer.cancel()
+        self._timer = loop.call_at(when, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+
+def parse_endpoint_limits(value: str) -> Dict[str, int]:
+    """
+    :param value: 例如 "chat=48,genai-response=32"
+    :return: {endpoint: 同時處理的請求數}
+    """
+    limits = {}
+    for item in value.split(","):
+        if "=" in item:
+            endpoint, limit = item.rsplit("=", 1)
+            limits[endpoint.strip()] = int(limit)
+    return limits
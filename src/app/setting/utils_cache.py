@@ -0,0 +1,390 @@
+import json
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables import Runnable, RunnableLambda
+from langchain_core.runnables.config import run_in_executor
+
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryBackend:
+    """
+    Process-local cache backend with LRU eviction and per-entry TTL.
+    """
+
+    blocking = False
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        """
+        Args:
+            maxsize (int): Max number of entries before the least recently used is evicted.
+            ttl (Optional[float]): Seconds an entry stays valid, None means no expiry.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expire_at, value = item
+            if expire_at and expire_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any):
+        expire_at = time.monotonic() + self.ttl if self.ttl else 0
+        with self._lock:
+            self._data[key] = (expire_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_prefix(self, prefix: str, keep: Optional[str] = None):
+        with self._lock:
+            for key in [key for key in self._data if key.startswith(prefix) and not (keep and key.startswith(keep))]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self._data)}
+
+
+class RedisBackend:
+    """
+    Cache backend on a Redis-compatible server (Redis, Valkey, KeyDB ...).
+
+    TTL is set per key; LRU eviction is left to the server's
+    ``maxmemory-policy allkeys-lru``.
+    """
+
+    blocking = True
+
+    def __init__(self, url: str, ttl: Optional[float] = None, prefix: str = "qblab:"):
+        """
+        Args:
+            url (str): Redis connection url, e.g. redis://localhost:6379/0.
+            ttl (Optional[float]): Seconds an entry stays valid, None means no expiry.
+            prefix (str): Prefix added to every key.
+
+        Raises:
+            RuntimeError: The redis package is not installed.
+        """
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError(
+                "cache backend 'redis' needs the redis package (see requirements-app.txt); "
+                "install it or set NER_CACHE_BACKEND=memory"
+            ) from e
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.client.get(self.prefix + key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key: str, value: Any):
+        self.client.set(
+            self.prefix + key,
+            json.dumps(value, ensure_ascii=False),
+            ex=int(self.ttl) if self.ttl else None,
+        )
+
+    def delete(self, key: str):
+        self.client.delete(self.prefix + key)
+
+    def delete_prefix(self, prefix: str, keep: Optional[str] = None):
+        keep = self.prefix.encode() + keep.encode() if keep else None
+        keys = [
+            key for key in self.client.scan_iter(match=f"{self.prefix}{prefix}*")
+            if not (keep and key.startswith(keep))
+        ]
+        if keys:
+            self.client.delete(*keys)
+
+    def clear(self):
+        self.delete_prefix("")
+
+
+def create_backend(
+    backend: str = "memory",
+    maxsize: int = 1024,
+    ttl: Optional[float] = None,
+    redis_url: Optional[str] = None,
+):
+    """
+    Creates a cache backend by name ("memory" or "redis").
+    """
+    if backend == "redis":
+        return RedisBackend(url=redis_url, ttl=ttl)
+    return InMemoryBackend(maxsize=maxsize, ttl=ttl)
+
+
+_PUNCTUATION = re.compile(r"[\s?？。!！.,，、~～]+$")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normalizes a question for exact-match lookups: NFKC width folding,
+    lower case, collapsed whitespace and no trailing punctuation.
+    """
+    question = unicodedata.normalize("NFKC", question).strip().lower()
+    question = _SPACES.sub(" ", question)
+    return _PUNCTUATION.sub("", question)
+
+
+class NerCache:
+    """
+    Cache in front of the NER chain keyed on (normalized question, reference date).
+
+    The exact tier looks up the normalized question in the backend. The
+    optional semantic tier embeds the question and reuses the answer of the
+    most similar cached question of the same reference date when the cosine
+    similarity reaches ``similarity_threshold``.
+
+    Dates are resolved relative to the reference date, so entries never
+    cross days. The reference date comes from the client, so it only selects
+    the key; once per server day every entry that is not for the server's
+    current date is dropped, including entries a shared backend kept from
+    earlier days. A request dated in the future cannot purge today's entries.
+    """
+
+    def __init__(
+        self,
+        backend,
+        embeddings: Optional[Embeddings] = None,
+        similarity_threshold: float = 0.97,
+        semantic_maxsize: int = 1024,
+        today: Optional[Callable[[], str]] = None,
+    ):
+        """
+        Args:
+            backend: InMemoryBackend, RedisBackend or any object with get/set/delete_prefix.
+            embeddings (Optional[Embeddings]): Enables the semantic tier when given.
+            similarity_threshold (float): Minimum cosine similarity of a semantic hit.
+            semantic_maxsize (int): Max number of vectors kept for the semantic tier.
+            today (Optional[Callable[[], str]]): Server's current date in the
+                reference date format, defaults to the local date as %Y-%m-%d.
+        """
+        self.backend = backend
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.semantic_maxsize = semantic_maxsize
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.today = today or (lambda: datetime.now().strftime("%Y-%m-%d"))
+        self._current_date: Optional[str] = None
+        self._vectors: "OrderedDict[str, Tuple[str, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(question: str, reference_date: str) -> str:
+        return f"ner:{reference_date}:{question}"
+
+    def _advance_date(self) -> Optional[str]:
+        """
+        Moves to the server's current date and drops semantic vectors of other dates.
+
+        Returns:
+            Optional[str]: The new date when it changed, i.e. the backend needs a purge.
+        """
+        today = self.today()
+        if today == self._current_date:
+            return None
+        with self._lock:
+            if self._current_date is not None and today <= self._current_date:
+                return None
+            previous, self._current_date = self._current_date, today
+            self._vectors = OrderedDict(
+                (key, item) for key, item in self._vectors.items() if item[0] == today
+            )
+        logger.info(f"ner cache date {previous} -> {today}")
+        return today
+
+    def _roll_date(self):
+        """
+        Drops entries of every date other than the server's current date, once per day.
+        """
+        if (today := self._advance_date()) is not None:
+            self.backend.delete_prefix("ner:", keep=self._key("", today))
+
+    async def _aroll_date(self):
+        """
+        Async version of _roll_date, a blocking backend purges in the executor.
+        """
+        if (today := self._advance_date()) is not None:
+            if self.backend.blocking:
+                await run_in_executor(None, self.backend.delete_prefix, "ner:", self._key("", today))
+            else:
+                self.backend.delete_prefix("ner:", keep=self._key("", today))
+
+    def _semantic_lookup(self, vector: np.ndarray, reference_date: str) -> Optional[str]:
+        with self._lock:
+            candidates = [
+                (key, item[1]) for key, item in self._vectors.items() if item[0] == reference_date
+            ]
+        if not candidates:
+            return None
+        keys, matrix = zip(*candidates)
+        similarity = np.stack(matrix) @ vector
+        best = int(np.argmax(similarity))
+        if similarity[best] >= self.similarity_threshold:
+            return keys[best]
+        return None
+
+    def _remember_vector(self, key: str, reference_date: str, vector: np.ndarray):
+        with self._lock:
+            self._vectors[key] = (reference_date, vector)
+            while len(self._vectors) > self.semantic_maxsize:
+                self._vectors.popitem(last=False)
+
+    @staticmethod
+    def _to_unit(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _hit(self, value: Any, semantic: bool = False) -> Dict:
+        if semantic:
+            self.semantic_hits += 1
+        else:
+            self.exact_hits += 1
+        return dict(value)
+
+    def get(self, question: str, reference_date: str) -> Tuple[Optional[Dict], Optional[np.ndarray]]:
+        """
+        Looks up a cached NER result.
+
+        Returns:
+            Tuple[Optional[Dict], Optional[np.ndarray]]: The cached result (None on miss)
+            and the question embedding when the semantic tier computed one.
+        """
+        self._roll_date()
+        key = self._key(normalize_question(question), reference_date)
+        if (value := self.backend.get(key)) is not None:
+            return self._hit(value), None
+
+        vector = None
+        if self.embeddings is not None:
+            vector = self._to_unit(self.embeddings.embed_query(question))
+            similar_key = self._semantic_lookup(vector, reference_date)
+            if similar_key and (value := self.backend.get(similar_key)) is not None:
+                return self._hit(value, semantic=True), vector
+
+        self.misses += 1
+        return None, vector
+
+    async def aget(self, question: str, reference_date: str) -> Tuple[Optional[Dict], Optional[np.ndarray]]:
+        """
+        Async version of get.
+        """
+        await self._aroll_date()
+        key = self._key(normalize_question(question), reference_date)
+        if (value := await self._backend_get(key)) is not None:
+            return self._hit(value), None
+
+        vector = None
+        if self.embeddings is not None:
+            vector = self._to_unit(await self.embeddings.aembed_query(question))
+            similar_key = self._semantic_lookup(vector, reference_date)
+            if similar_key and (value := await self._backend_get(similar_key)) is not None:
+                return self._hit(value, semantic=True), vector
+
+        self.misses += 1
+        return None, vector
+
+    async def _backend_get(self, key: str) -> Optional[Any]:
+        if self.backend.blocking:
+            return await run_in_executor(None, self.backend.get, key)
+        return self.backend.get(key)
+
+    def set(self, question: str, reference_date: str, value: Dict, vector: Optional[np.ndarray] = None):
+        """
+        Stores a NER result; results without "modify_query" are not cached.
+        """
+        if not isinstance(value, dict) or "modify_query" not in value:
+            return
+        key = self._key(normalize_question(question), reference_date)
+        self.backend.set(key, dict(value))
+        if vector is not None:
+            self._remember_vector(key, reference_date, vector)
+
+    async def aset(self, question: str, reference_date: str, value: Dict, vector: Optional[np.ndarray] = None):
+        """
+        Async version of set.
+        """
+        if self.backend.blocking:
+            await run_in_executor(None, self.set, question, reference_date, value, vector)
+        else:
+            self.set(question, reference_date, value, vector)
+
+    def wrap(self, runnable: Runnable) -> Runnable:
+        """
+        Wraps a NER runnable taking {"question": ..., "time": ...} with this cache.
+        """
+
+        def cached(inputs: Dict, config) -> Dict:
+            value, vector = self.get(inputs["question"], inputs["time"])
+            if value is None:
+                value = runnable.invoke(inputs, config)
+                self.set(inputs["question"], inputs["time"], value, vector)
+            return value
+
+        async def acached(inputs: Dict, config) -> Dict:
+            value, vector = await self.aget(inputs["question"], inputs["time"])
+            if value is None:
+                value = await runnable.ainvoke(inputs, config)
+                await self.aset(inputs["question"], inputs["time"], value, vector)
+            return value
+
+        return RunnableLambda(cached, afunc=acached, name="ner_cache")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the hit/miss counters and the hit rate.
+        """
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+            "evictions": getattr(self.backend, "evictions", 0),
+        }
@@ -0,0 +1,308 @@
+"""
+依照 PROMPT_QUESTION_NER 的時間區間規則, 以基準日換算問句中的時間描述。
+
+- 每週的第一天是星期日
+- 「上個」、「去」表示前一個完整週期; 「這個」、「本」、「今」表示當前週期, 迄日為基準日
+- 「過去n天/週/個月/季/年」: 基準日所在的週期算作第一個, 往前推 n-1 個週期的起始日至基準日
+- 「去年星期二」、「去年的這一週」: 以基準日於當年的週數換算去年同週
+- 「上週一」: 上一週的星期一當天
+- 「昨天」、「前天」: 基準日前 1、2 天
+- 「去年同期」: 去年的基準日當天
+- 特定日期(如「去年8/1」): 起迄日皆為該日
+- Q1: 1/1~3/31, Q2: 4/1~6/30, Q3: 7/1~9/30, Q4: 10/1~12/31
+- 未指定年份的月份、日期與季(如「12月」、「8/1」、「Q4」)晚於基準日時, 視為去年
+
+問句中沒有時間描述、有多個時間描述, 或時間描述旁還有未換算的修飾語
+(如「上上個月」、「上個月底」、「今年上半年」)時回傳 None, 交由 LLM 處理。
+"""
+
+import re
+from datetime import date, datetime, timedelta
+from typing import Callable, List, Optional, Tuple, Union
+
+
+DateRange = Tuple[date, date]
+
+_DIGITS = {"零": 0, "一": 1, "二": 2, "兩": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_WEEKDAYS = {"日": 0, "天": 0, "一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6}
+
+_N = r"[0-9一二兩三四五六七八九十]+"
+_YEAR = r"(?P<year>今年|本年|去年|前年|(?P<abs_year>\d{4})\s*年)"
+_WEEK = r"(?:週|周|星期|禮拜)"
+
+
+def _to_int(text: str) -> int:
+    """
+    將阿拉伯數字或中文數字(一~九十九)轉為整數。
+    """
+    if text.isdigit():
+        return int(text)
+    if "十" in text:
+        tens, _, ones = text.partition("十")
+        return (_DIGITS[tens] if tens else 1) * 10 + (_DIGITS[ones] if ones else 0)
+    return _DIGITS[text]
+
+
+def _shift_year(day: date, years: int) -> date:
+    try:
+        return day.replace(year=day.year + years)
+    except ValueError:  # 2/29
+        return day.replace(year=day.year + years, day=28)
+
+
+def _month_start(year: int, month: int) -> date:
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return date(year, month, 1)
+
+
+def _month_end(year: int, month: int) -> date:
+    return _month_start(year, month + 1) - timedelta(days=1)
+
+
+def _week_start(day: date) -> date:
+    # date.weekday(): 星期一為 0, 換算成以星期日為一週的第一天
+    return day - timedelta(days=(day.weekday() + 1) % 7)
+
+
+def _week_number(day: date) -> int:
+    """
+    基準日於當年的週數, 1/1 所在的週為第 1 週。
+    """
+    return (day - _week_start(date(day.year, 1, 1))).days // 7 + 1
+
+
+def _nth_week_start(year: int, week: int) -> date:
+    return _week_start(date(year, 1, 1)) + timedelta(weeks=week - 1)
+
+
+def _quarter_start(year: int, quarter: int) -> date:
+    return _month_start(year, (quarter - 1) * 3 + 1)
+
+
+def _has_year(match: re.Match) -> bool:
+    return bool(match.groupdict().get("year"))
+
+
+def _year_of(match: re.Match, base: date) -> int:
+    year = match.groupdict().get("year")
+    if not year or year in ("今年", "本年"):
+        return base.year
+    if year == "去年":
+        return base.year - 1
+    if year == "前年":
+        return base.year - 2
+    return int(match.group("abs_year"))
+
+
+def _specific_date(m: re.Match, base: date) -> DateRange:
+    month, day = int(m.group("month")), int(m.group("day"))
+    if _has_year(m):
+        day = date(_year_of(m, base), month, day)
+        return day, day
+    # 未指定年份時取基準日當天或以前最近的一次
+    for year in (base.year, base.year - 1):
+        try:
+            candidate = date(year, month, day)
+        except ValueError:  # 該年沒有 2/29
+            continue
+        if candidate <= base:
+            return candidate, candidate
+    raise ValueError(f"no {month}/{day} within a year before {base}")
+
+
+def _iso_date(m: re.Match, base: date) -> DateRange:
+    day = date(int(m.group("y")), int(m.group("m")), int(m.group("d")))
+    return day, day
+
+
+def _same_day_last_year(m: re.Match, base: date) -> DateRange:
+    day = _shift_year(base, _year_of(m, base) - base.year)
+    return day, day
+
+
+def _check_in_year(day: date, year: int, base: date):
+    """
+    :raises ValueError: 同週數的日期跨入隔年, 例如基準日在第 53 週而去年的第 53 週只有 12/31
+    """
+    if day.year > year:
+        raise ValueError(f"week {_week_number(base)} of {year} runs into {day.year}")
+
+
+def _same_week_last_year(m: re.Match, base: date) -> DateRange:
+    year = _year_of(m, base)
+    start = _nth_week_start(year, _week_number(base))
+    end = start + timedelta(days=6)
+    _check_in_year(end, year, base)
+    return start, end
+
+
+def _weekday_last_year(m: re.Match, base: date) -> DateRange:
+    year = _year_of(m, base)
+    start = _nth_week_start(year, _week_number(base))
+    day = start + timedelta(days=_WEEKDAYS[m.group("weekday")])
+    _check_in_year(day, year, base)
+    return day, day
+
+
+def _weekday_of_week(m: re.Match, base: date) -> DateRange:
+    start = _week_start(base)
+    if m.group("which") == "上":
+        start -= timedelta(weeks=1)
+    day = start + timedelta(days=_WEEKDAYS[m.group("weekday")])
+    return day, day
+
+
+def _quarter(m: re.Match, base: date) -> DateRange:
+    quarter = _to_int(m.group("quarter") or m.group("quarter_zh"))
+    start = _quarter_start(_year_of(m, base), quarter)
+    if not _has_year(m) and start > base:
+        start = _quarter_start(start.year - 1, quarter)
+    return start, _month_end(start.year, start.month + 2)
+
+
+def _relative_quarter(m: re.Match, base: date) -> DateRange:
+    start = _quarter_start(base.year, (base.month - 1) // 3 + 1)
+    if m.group("which") == "上":
+        start = _month_start(start.year, start.month - 3)
+        return start, _month_end(start.year, start.month + 2)
+    return start, base
+
+
+def _month(m: re.Match, base: date) -> DateRange:
+    year, month = _year_of(m, base), _to_int(m.group("month"))
+    if not _has_year(m) and _month_start(year, month) > base:
+        year -= 1
+    return _month_start(year, month), _month_end(year, month)
+
+
+def _relative_month(m: re.Match, base: date) -> DateRange:
+    if m.group("which") == "上":
+        start = _month_start(base.year, base.month - 1)
+        return start, _month_end(start.year, start.month)
+    return _month_start(base.year, base.month), base
+
+
+def _relative_week(m: re.Match, base: date) -> DateRange:
+    start = _week_start(base)
+    if m.group("which") == "上":
+        start -= timedelta(weeks=1)
+        return start, start + timedelta(days=6)
+    return start, base
+
+
+def _relative_year(m: re.Match, base: date) -> DateRange:
+    year = _year_of(m, base)
+    if year == base.year:
+        return date(year, 1, 1), base
+    return date(year, 1, 1), date(year, 12, 31)
+
+
+def _past_n(m: re.Match, base: date) -> DateRange:
+    n, unit = _to_int(m.group("n")), m.group("unit")
+    if n < 1:
+        raise ValueError(f"past {n} {unit}")
+    if unit in ("天", "日"):
+        return base - timedelta(days=n - 1), base
+    if unit == "月":
+        return _month_start(base.year, base.month - (n - 1)), base
+    if unit == "季":
+        start = _quarter_start(base.year, (base.month - 1) // 3 + 1)
+        return _month_start(start.year, start.month - 3 * (n - 1)), base
+    if unit == "年":
+        return date(base.year - (n - 1), 1, 1), base
+    return _week_start(base) - timedelta(weeks=n - 1), base
+
+
+def _relative_day(m: re.Match, base: date) -> DateRange:
+    offset = {"今天": 0, "今日": 0, "昨天": 1, "昨日": 1, "前天": 2, "大前天": 3}[m.group(0)]
+    day = base - timedelta(days=offset)
+    return day, day
+
+
+# 緊鄰時間描述、會改變區間的修飾語: 出現時表示規則只比對到描述的一部分
+_MODIFIER_BEFORE = re.compile(r"[上下前後中半\d０-９]$")
+_MODIFIER_AFTER = re.compile(r"[上下前後初中底末半季旬\d０-９]|[一二三四五六七八九十兩]+\s*[號日天週周個月年季]")
+
+# 依序比對, 較長、較具體的描述放在前面; 已比對到的區段不會再被後面的規則比對
+_RULES: List[Tuple[re.Pattern, Callable[[re.Match, date], DateRange]]] = [
+    (re.compile(r"(?P<y>\d{4})\s*[/\-]\s*(?P<m>\d{1,2})\s*[/\-]\s*(?P<d>\d{1,2})"), _iso_date),
+    (
+        re.compile(
+            _YEAR + r"?\s*的?\s*(?P<month>\d{1,2})\s*[/月]\s*(?P<day>\d{1,2})\s*[日號]?"
+        ),
+        _specific_date,
+    ),
+    (re.compile(_YEAR + r"\s*的?\s*同期"), _same_day_last_year),
+    (re.compile(_YEAR + r"\s*的?\s*(?:這|同)一?(?:個)?" + _WEEK), _same_week_last_year),
+    (re.compile(_YEAR + r"\s*的?\s*" + _WEEK + r"(?P<weekday>[一二三四五六日天])"), _weekday_last_year),
+    (re.compile(r"(?P<which>上|本|這)一?(?:個)?" + _WEEK + r"(?P<weekday>[一二三四五六日天])"), _weekday_of_week),
+    (
+        re.compile(_YEAR + r"?\s*的?\s*(?:[Qq](?P<quarter>[1-4])|第(?P<quarter_zh>[1-4一二三四])季度?)"),
+        _quarter,
+    ),
+    (re.compile(r"(?P<which>上|本|這)一?(?:個)?季度?"), _relative_quarter),
+    (re.compile(r"(?:過去|最近|近|前)\s*(?P<n>" + _N + r")\s*(?:個)?\s*(?P<unit>天|日|週|周|星期|禮拜|月|季|年)"), _past_n),
+    (re.compile(_YEAR + r"?\s*的?\s*(?P<month>1[0-2]|0?[1-9]|十[一二]?|[一二三四五六七八九])\s*月份?"), _month),
+    (re.compile(r"(?P<which>上|本|這)一?(?:個)?月"), _relative_month),
+    (re.compile(r"(?P<which>上|本|這)一?(?:個)?" + _WEEK), _relative_week),
+    (re.compile(_YEAR), _relative_year),
+    (re.compile(r"大前天|前天|昨天|昨日|今天|今日"), _relative_day),
+]
+
+
+def _is_partial(question: str, match: re.Match) -> bool:
+    """
+    時間描述前後緊鄰修飾語時, 規則只涵蓋了描述的一部分, 例如「上上個月」中的「上個月」。
+    """
+    start, end = match.span()
+    return bool(_MODIFIER_BEFORE.search(question[:start]) or _MODIFIER_AFTER.match(question, end))
+
+
+def find_date_expressions(question: str) -> List[Tuple[re.Match, Callable[[re.Match, date], DateRange]]]:
+    """
+    找出問句中所有不重疊的時間描述。
+    """
+    found = []
+    taken = [False] * len(question)
+    for pattern, func in _RULES:
+        for match in pattern.finditer(question):
+            start, end = match.span()
+            if any(taken[start:end]):
+                continue
+            taken[start:end] = [True] * (end - start)
+            found.append((match, func))
+    return found
+
+
+def resolve_date_range(
+    question: str,
+    reference: Union[str, date, datetime],
+    fmt: str = "%Y/%m/%d",
+) -> Optional[Tuple[str, str]]:
+    """
+    依基準日換算問句中的時間描述為起迄日。
+
+    :param question: 用戶問句
+    :param reference: 基準日, date 或 "YYYY-MM-DD" 字串
+    :param fmt: 回傳日期格式, 預設 YYYY/MM/DD
+    :return: (起日, 迄日); 沒有或有多個時間描述、或無法換算時回傳 None
+    """
+    if isinstance(reference, datetime):
+        base = reference.date()
+    elif isinstance(reference, date):
+        base = reference
+    else:
+        base = datetime.strptime(reference, "%Y-%m-%d").date()
+
+    found = find_date_expressions(question)
+    if len(found) != 1:
+        return None
+
+    match, func = found[0]
+    if _is_partial(question, match):
+        return None
+    try:
+        start, end = func(match, base)
+    except (KeyError, ValueError):
+        return None
+    return start.strftime(fmt), end.strftime(fmt)
@@ -0,0 +1,145 @@
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables.config import run_in_executor
+
+from setting.utils_cache import InMemoryBackend
+
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteEmbeddingStore:
+    """
+    On-disk embedding store, vectors are kept as float32 blobs in SQLite.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): Path of the SQLite database file.
+        """
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embedding (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            row = self._conn.execute("SELECT vector FROM embedding WHERE key = ?", (key,)).fetchone()
+        return None if row is None else np.frombuffer(row[0], dtype=np.float32)
+
+    def set(self, key: str, vector: np.ndarray):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embedding (key, vector) VALUES (?, ?)",
+                (key, vector.astype(np.float32).tobytes()),
+            )
+            self._conn.commit()
+
+    def nbytes(self) -> int:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+
+class EmbeddingCache:
+    """
+    Query-embedding cache: an in-memory LRU tier backed by an optional SQLite store.
+    """
+
+    def __init__(self, namespace: str, maxsize: int = 4096, path: Optional[str] = None):
+        """
+        Args:
+            namespace (str): Prefix of the keys, e.g. the embedding deployment name.
+            maxsize (int): Max number of vectors kept in memory.
+            path (Optional[str]): SQLite file for the on-disk tier, None disables it.
+        """
+        self.namespace = namespace
+        self.memory = InMemoryBackend(maxsize=maxsize)
+        self.store = SQLiteEmbeddingStore(path) if path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._dim = 0
+
+    def _key(self, text: str) -> str:
+        return f"{self.namespace}:{text}"
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        key = self._key(text)
+        if (vector := self.memory.get(key)) is not None:
+            self.hits += 1
+            return vector
+        if self.store is not None and (vector := self.store.get(key)) is not None:
+            self.disk_hits += 1
+            self.memory.set(key, vector)
+            return vector
+        self.misses += 1
+        return None
+
+    def set(self, text: str, vector: List[float]):
+        vector = np.asarray(vector, dtype=np.float32)
+        self._dim = vector.shape[0]
+        key = self._key(text)
+        self.memory.set(key, vector)
+        if self.store is not None:
+            self.store.set(key, vector)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the hit/miss counters, the hit rate and the bytes used by each tier.
+        """
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_bytes": len(self.memory) * self._dim * 4,
+            "disk_bytes": self.store.nbytes() if self.store is not None else 0,
+        }
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Embeddings wrapper serving embed_query/aembed_query from an EmbeddingCache.
+    Document embeddings are passed through to the wrapped embeddings.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        if (vector := self.cache.get(text)) is not None:
+            return vector.tolist()
+        vector = self.embeddings.embed_query(text)
+        self.cache.set(text, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if self.cache.store is None:
+            vector = self.cache.get(text)
+        else:
+            vector = await run_in_executor(None, self.cache.get, text)
+        if vector is not None:
+            return vector.tolist()
+        vector = await self.embeddings.aembed_query(text)
+        if self.cache.store is None:
+            self.cache.set(text, vector)
+        else:
+            await run_in_executor(None, self.cache.set, text, vector)
+        return vector
@@ -0,0 +1,108 @@
+import re
+import threading
+from typing import Dict, List, Optional
+
+from langchain_core.messages import BaseMessage
+
+
+# 時間描述, 例如: 上個月、去年同期、過去3個月、本週、Q3、8/1、2024/05/01
+_NUM = r"[0-9０-９一二兩三四五六七八九十]+"
+TIME_PATTERN = re.compile(
+    "|".join(
+        [
+            r"今天|今日|昨天|昨日|前天|大前天",
+            r"(本|這|上|上一|這一)(個)?(週|周|星期|禮拜|月|季)",
+            r"(今|去|前|明)年",
+            r"(過去|最近|近|前)\s*" + _NUM + r"\s*(個)?(天|日|週|周|星期|禮拜|月|季|年)",
+            r"[Qq][1-4]|第" + _NUM + r"季",
+            r"(週|周|星期|禮拜)[一二三四五六日天]",
+            r"\d{4}\s*[/\-年]\s*\d{1,2}(\s*[/\-月]\s*\d{1,2}\s*[日號]?)?",
+            r"\d{1,2}\s*/\s*\d{1,2}",
+            _NUM + r"\s*月(份)?(" + _NUM + r"\s*[日號])?",
+        ]
+    )
+)
+
+# 消費類別, 與 PROMPT_QUESTION_NER 的合法消費類別清單一致
+CATEGORY_PATTERN = re.compile(
+    "|".join(
+        re.escape(category)
+        for category in [
+            "飯店/住宿", "餐飲", "服飾/鞋/精品", "休閒", "旅遊", "交通/運輸", "悠遊卡加值",
+            "加油站", "3C通訊家電", "百貨", "超市/量販", "一般購物(食品)",
+            "一般購物(家具家飾裝潢/雜貨)", "一般購物(其他)", "分期付款", "美容/美髮/保養",
+            "捐獻", "醫療救護/整型", "公共事業費用", "繳稅", "教育/學費", "郵購/直銷", "藝文",
+            "其他類_NOTFOUND",
+        ]
+    )
+)
+
+# 商戶描述, 例如: 在蝦皮的消費、於 Uber 消費、去星巴克花了多少
+MERCHANT_PATTERN = re.compile(
+    r"(在|於|去|到)\s*(?P<name>[^\s，,。?？!！的]{1,30}?)\s*(的|消費|購物|花|刷|買)"
+)
+
+# 需要參考前文才能理解的用語, 例如: 那蝦皮呢?、還是上個月?、同一家
+CONTINUATION_PATTERN = re.compile(
+    r"^\s*(那|那麼|還是|然後|另外|再來|也)|呢\s*[?？]?\s*$|同樣|一樣|剛剛|剛才|上述|上面|這家|那家|同一家|它|該(店|商戶|商家|家|類別)"
+)
+
+
+class CompletionGate:
+    """
+    判斷問句是否需要經過問句補完 LLM。
+
+    - 沒有對話歷史: 無可補完的資訊, 直接略過
+    - 問句已包含時間與商戶/類別, 且沒有承接前文的用語: 直接略過
+    - 其餘情況才交給 LLM 補完
+    """
+
+    def __init__(self):
+        self.skipped_no_history = 0
+        self.skipped_self_contained = 0
+        self.invoked = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_self_contained(question: str) -> bool:
+        if CONTINUATION_PATTERN.search(question):
+            return False
+        if not TIME_PATTERN.search(question):
+            return False
+        rest = TIME_PATTERN.sub(" ", question)
+        return bool(CATEGORY_PATTERN.search(rest) or MERCHANT_PATTERN.search(rest))
+
+    def check(self, question: str, history: List[BaseMessage]) -> Optional[str]:
+        """
+        回傳略過 LLM 的原因, 需要呼叫 LLM 時回傳 None, 並累計次數。
+
+        :param question: 用戶問句
+        :param history: 該 session 的對話歷史
+        :return: "no_history"、"self_contained" 或 None
+        """
+        if not history:
+            reason = "no_history"
+        elif self.is_self_contained(question):
+            reason = "self_contained"
+        else:
+            reason = None
+
+        with self._lock:
+            if reason == "no_history":
+                self.skipped_no_history += 1
+            elif reason == "self_contained":
+                self.skipped_self_contained += 1
+            else:
+                self.invoked += 1
+        return reason
+
+    def stats(self) -> Dict[str, int]:
+        """
+        回傳略過與呼叫 LLM 的次數。
+        """
+        return {
+            "skipped_no_history": self.skipped_no_history,
+            "skipped_self_contained": self.skipped_self_contained,
+            "skipped": self.skipped_no_history + self.skipped_self_contained,
+            "invoked": self.invoked,
+        }
@@ -0,0 +1,283 @@
+"""
+Structured logging for the request hot path.
+
+Loggers only put records on a bounded queue; a listener thread formats them
+(one JSON object per line, or the previous text format), expands pydantic
+extras, truncates long fields and redacts secrets before writing to stderr.
+INFO records of unsampled requests are dropped before they are queued, see
+LogContextMiddleware.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, Optional
+
+import orjson
+
+from app.setting.utils_metrics import Counter
+
+
+LOG_DROPPED = Counter("log_records_dropped_total", "Log records not written", ["reason"])
+
+# LogRecord 本身的屬性, 其餘屬性視為 extra
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+_SECRET_KEY = re.compile(r"api[_-]?key|passw(or)?d|pwd|secret|token|authorization", re.IGNORECASE)
+# key=value / "key": "value" 形式的機密; 值不跨越引號、跳脫字元與括號, 遮蔽後 JSON 仍然合法
+_SECRET_TEXT = re.compile(
+    r"""((?:api[_-]?key|password|pwd|secret|token|authorization)["']?\s*[:=]\s*["']?(?:bearer\s+)?)[^\s"'\\,;{}\[\]]+""",
+    re.IGNORECASE,
+)
+_SECRET_WORDS = ("key", "passw", "pwd", "secret", "token", "authorization")
+_REDACTED = "***"
+# 值要遮蔽的環境變數
+SECRET_ENV = ("AZURE_OPENAI_API_KEY", "AZURE_OPENAI_EMBEDDING_API_KEY", "DB_PWD")
+_JSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+# 目前請求的 endpoint 與是否取樣, 由 LogContextMiddleware 設定
+_endpoint: ContextVar[str] = ContextVar("log_endpoint", default="")
+_sampled: ContextVar[bool] = ContextVar("log_sampled", default=True)
+
+
+class Redactor:
+    """
+    遮蔽 log 中的機密並截斷過長的欄位。
+    """
+
+    def __init__(self, secrets: Iterable[str] = (), max_chars: int = 2000):
+        """
+        :param secrets: 要遮蔽的機密值, 例如 API key
+        :param max_chars: 訊息與 extra 字串欄位的長度上限
+        """
+        self.secrets = [secret for secret in secrets if secret]
+        self.max_chars = max_chars
+
+    def truncate(self, value: str, max_chars: Optional[int] = None) -> str:
+        limit = max_chars or self.max_chars
+        if len(value) > limit:
+            return f"{value[:limit]}...(+{len(value) - limit} chars)"
+        return value
+
+    def field(self, key: str, value: Any) -> Any:
+        """
+        extra 欄位: 機密名稱的欄位直接遮蔽, 字串與 bytes 截斷, 其餘留給 _default 序列化。
+        """
+        if _SECRET_KEY.search(key):
+            return _REDACTED
+        if isinstance(value, (bytes, bytearray)):
+            value = bytes(value[: self.max_chars * 4]).decode("utf-8", "replace")
+        if isinstance(value, str):
+            return self.truncate(value)
+        return value
+
+    def redact(self, text: str) -> str:
+        """
+        對輸出的整行遮蔽: 已知的機密值, 以及 key=value / "key": "value" 形式的機密。
+        """
+        for secret in self.secrets:
+            if secret in text:
+                text = text.replace(secret, _REDACTED)
+        # 先以子字串篩選, 大部分的行不需要跑 regex
+        lower = text.lower()
+        if any(word in lower for word in _SECRET_WORDS):
+            return _SECRET_TEXT.sub(rf"\1{_REDACTED}", text)
+        return text
+
+
+def _default(value: Any) -> Any:
+    # pydantic model 在 listener thread 才展開; 其他型別 (例如 Exception) 以字串輸出
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    return str(value)
+
+
+def _extras(record: logging.LogRecord, redactor: Redactor) -> Dict[str, Any]:
+    return {
+        key: redactor.field(key, value)
+        for key, value in record.__dict__.items()
+        if key not in _RECORD_ATTRS
+    }
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    每筆 log 輸出一行 JSON: time、level、logger、message、extra 欄位與 exception。
+    """
+
+    def __init__(self, redactor: Redactor, max_exc_chars: int = 8000):
+        super().__init__()
+        self.redactor = redactor
+        self.max_exc_chars = max_exc_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": self.redactor.truncate(record.getMessage()),
+        }
+        data.update(_extras(record, self.redactor))
+        if record.exc_info:
+            data["exception"] = self.redactor.truncate(self.formatException(record.exc_info), self.max_exc_chars)
+        return self.redactor.redact(orjson.dumps(data, default=_default, option=_JSON_OPTIONS).decode())
+
+
+class TextFormatter(logging.Formatter):
+    """
+    原本的文字格式, 一樣遮蔽機密與截斷; extra 欄位以 JSON 附在訊息後。
+    """
+
+    def __init__(self, fmt: str, redactor: Redactor, max_exc_chars: int = 8000):
+        super().__init__(fmt)
+        self.redactor = redactor
+        self.max_exc_chars = max_exc_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        return self.redactor.redact(super().format(record))
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        record.message = self.redactor.truncate(record.message)
+        if extras := _extras(record, self.redactor):
+            record.message = f"{record.message} {orjson.dumps(extras, default=_default, option=_JSON_OPTIONS).decode()}"
+        return super().formatMessage(record)
+
+    def formatException(self, ei) -> str:
+        return self.redactor.truncate(super().formatException(ei), self.max_exc_chars)
+
+
+class ContextFilter(logging.Filter):
+    """
+    在呼叫端執行: 未取樣的請求捨棄 WARNING 以下的 log, 並標記 endpoint。
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING and not _sampled.get():
+            LOG_DROPPED.inc(reason="sampled")
+            return False
+        if endpoint := _endpoint.get():
+            record.endpoint = endpoint
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    只把 record 放入 queue; 訊息格式化與 I/O 都在 listener thread 執行, queue 滿時捨棄。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc(reason="queue_full")
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _env_secrets(min_length: int = 8) -> Iterable[str]:
+    # 太短的值容易誤遮一般文字
+    return [value for value in (os.environ.get(key, "") for key in SECRET_ENV) if len(value) >= min_length]
+
+
+def setup_logging(
+    level: str = "INFO",
+    fmt: str = "json",
+    max_chars: int = 2000,
+    queue_size: int = 10000,
+):
+    """
+    設定 root logger: QueueHandler -> listener thread -> stderr。
+
+    :param level: log level
+    :param fmt: json 或 text
+    :param max_chars: 訊息與 extra 字串的長度上限
+    :param queue_size: 尚未寫出的 log 上限, 超過時捨棄
+    """
+    global _listener
+    redactor = Redactor(_env_secrets(), max_chars=max_chars)
+    if fmt == "json":
+        formatter = JsonFormatter(redactor)
+    else:
+        formatter = TextFormatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s", redactor)
+    stream = logging.StreamHandler()
+    stream.setFormatter(formatter)
+
+    handler = _QueueHandler(queue.Queue(maxsize=queue_size))
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    shutdown_logging()
+    _listener = logging.handlers.QueueListener(handler.queue, stream, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """
+    停止 listener thread, 寫出 queue 中剩餘的 log。
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
+
+
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    """
+    :param value: 例如 "chat=0.1,evaluate=0.01"
+    :return: {endpoint: rate}
+    """
+    rates = {}
+    for item in value.split(","):
+        if "=" in item:
+            endpoint, rate = item.rsplit("=", 1)
+            rates[endpoint.strip()] = float(rate)
+    return rates
+
+
+class LogContextMiddleware:
+    """
+    ASGI middleware: 依 endpoint 的取樣比例決定此請求 WARNING 以下的 log 是否輸出,
+    錯誤一律輸出。
+    """
+
+    def __init__(self, app, prefix: str = "", rates: Optional[Dict[str, float]] = None, default_rate: float = 1.0):
+        """
+        :param prefix: 路徑前綴, endpoint 名稱為去掉前綴後的路徑
+        :param rates: {endpoint: 取樣比例}
+        :param default_rate: 未列在 rates 的 endpoint 的取樣比例
+        """
+        self.app = app
+        self.prefix = prefix
+        self.rates = rates or {}
+        self.default_rate = default_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        path = scope["path"]
+        endpoint = path[len(self.prefix):] if path.startswith(self.prefix) else path.lstrip("/")
+        rate = self.rates.get(endpoint, self.default_rate)
+        endpoint_token = _endpoint.set(endpoint)
+        sampled_token = _sampled.set(rate >= 1 or random.random() < rate)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _sampled.reset(sampled_token)
+            _endpoint.reset(endpoint_token)
@@ -1,9 +1,216 @@
 
-import mlflow
+import logging
+import queue
+import random
+import threading
+import time
 import traceback
 from functools import wraps
-# from langchain.callbacks import get_openai_callback
-from langchain_community.callbacks.manager import get_openai_callback
+from typing import Dict, List, Optional
+from app.setting.config import Settings
+from app.setting.utils_metrics import Counter, Gauge
+from app.setting.utils_token import estimate_tokens
+
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DROPPED = Counter("mlflow_export_dropped_total", "Telemetry records dropped by the MLflow exporter", ["reason"])
+EXPORT_FAILURES = Counter("mlflow_export_failures_total", "Failed MLflow export attempts")
+EXPORT_QUEUED = Gauge("mlflow_export_queued", "Telemetry records waiting to be exported")
+
+# log_batch 單次最多 1000 個 metric
+_MAX_BATCH_METRICS = 1000
+
+
+class MlflowExporter:
+    """
+    背景 MLflow telemetry exporter:
+    - record 只把資料放入有上限的 queue, 不做任何網路呼叫; queue 滿時捨棄
+    - worker thread 每 flush_interval 秒建立一個 run, 以 log_batch 寫入該區間的所有紀錄與加總
+    - tracking server 失敗時保留資料並以指數退避重試, 超過上限的資料捨棄
+    """
+
+    def __init__(
+        self,
+        tracking_uri: str,
+        experiment_name: str,
+        flush_interval: float = 30,
+        max_queue: int = 10000,
+        sample_rate: float = 1.0,
+        max_backoff: float = 300,
+    ):
+        """
+        :param tracking_uri: MLflow tracking server
+        :param experiment_name: MLflow experiment 名稱
+        :param flush_interval: 匯出的間隔秒數
+        :param max_queue: 尚未匯出的紀錄上限
+        :param sample_rate: 取樣比例, 0~1
+        :param max_backoff: 匯出失敗時最長的重試間隔秒數
+        """
+        self.tracking_uri = tracking_uri
+        self.experiment_name = experiment_name
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.sample_rate = sample_rate
+        self.max_backoff = max_backoff
+        self._queue: "queue.Queue[Dict]" = queue.Queue(maxsize=max_queue)
+        self._pending: List[Dict] = []
+        self._backoff = 0.0
+        self._experiment_id: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        EXPORT_QUEUED.set_function(lambda: self._queue.qsize() + len(self._pending))
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="mlflow-exporter", daemon=True)
+            self._thread.start()
+
+    def close(self, timeout: Optional[float] = None):
+        """
+        停止 worker 並嘗試匯出剩餘的紀錄。
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _put(self, record: Dict):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            EXPORT_DROPPED.inc(reason="queue_full")
+
+    def record(self, endpoint: str, cb) -> None:
+        """
+        記錄一次請求的 OpenAI 用量。
+
+        :param endpoint: 請求的 endpoint 名稱
+        :param cb: get_openai_callback 的 callback handler
+        """
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        self._put({
+            "endpoint": endpoint,
+            "timestamp": int(time.time() * 1000),
+            "metrics": {
+                "total_cost_USD": cb.total_cost,
+                "total_tokens": cb.total_tokens,
+                "prompt_tokens": cb.prompt_tokens,
+                "completion_tokens": cb.completion_tokens,
+                "successful_requests": cb.successful_requests,
+            },
+            "text": str(cb),
+        })
+
+    def record_exception(self, endpoint: str, message: str) -> None:
+        self._put({"endpoint": endpoint, "timestamp": int(time.time() * 1000), "metrics": {}, "error": message})
+
+    def _drain(self) -> List[Dict]:
+        records, self._pending = self._pending, []
+        while True:
+            try:
+                records.append(self._queue.get_nowait())
+            except queue.Empty:
+                return records
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval + self._backoff):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        """
+        將累積的紀錄匯出到一個新的 run; 失敗時放回 pending 並延長下次匯出的間隔。
+        """
+        records = self._drain()
+        if not records:
+            return
+        try:
+            self._export(records)
+            self._backoff = 0.0
+        except Exception as e:
+            EXPORT_FAILURES.inc()
+            self._backoff = min(max(self._backoff * 2, self.flush_interval), self.max_backoff)
+            overflow = len(records) - self.max_queue
+            if overflow > 0:
+                EXPORT_DROPPED.inc(overflow, reason="export_failed")
+                records = records[overflow:]
+            self._pending = records
+            logger.warning(f"mlflow export fail, retry in {self.flush_interval + self._backoff}s: {e}")
+
+    def _export(self, records: List[Dict]):
+        # mlflow 很重, 第一次匯出時才在 worker thread 載入
+        from mlflow import MlflowClient
+        from mlflow.entities import Metric
+
+        client = MlflowClient(tracking_uri=self.tracking_uri)
+        if self._experiment_id is None:
+            experiment = client.get_experiment_by_name(self.experiment_name)
+            self._experiment_id = (
+                experiment.experiment_id if experiment else client.create_experiment(self.experiment_name)
+            )
+
+        metrics, totals, texts, errors = [], {}, [], []
+        for step, record in enumerate(records):
+            for key, value in record["metrics"].items():
+                metrics.append(Metric(f"{record['endpoint']}.{key}", value, record["timestamp"], step))
+                totals[f"sum.{key}"] = totals.get(f"sum.{key}", 0) + value
+            if "text" in record:
+                texts.append(f"[{record['endpoint']}] {record['text']}")
+            if "error" in record:
+                errors.append(f"[{record['endpoint']}] {record['error']}")
+        now = int(time.time() * 1000)
+        totals["requests"] = len(records)
+        metrics.extend(Metric(key, value, now, 0) for key, value in totals.items())
+
+        run = client.create_run(self._experiment_id, tags={"mlflow.runName": f"telemetry-{now}"})
+        run_id = run.info.run_id
+        try:
+            for i in range(0, len(metrics), _MAX_BATCH_METRICS):
+                client.log_batch(run_id, metrics=metrics[i:i + _MAX_BATCH_METRICS])
+            if texts:
+                client.log_text(run_id, "\n\n".join(texts), "total_cost.txt")
+            if errors:
+                client.log_text(run_id, "\n\n".join(errors), "uncaught_error_log.txt")
+        finally:
+            client.set_terminated(run_id)
+        logger.info(f"mlflow export {len(records)} records to run {run_id}")
+
+
+telemetry_exporter = MlflowExporter(
+    tracking_uri=Settings.TRACKING_SERVER_URI,
+    experiment_name=Settings.MLFLOW_EXPERIMENT,
+    flush_interval=Settings.MLFLOW_FLUSH_SECONDS,
+    max_queue=Settings.MLFLOW_QUEUE_MAXSIZE,
+    sample_rate=Settings.MLFLOW_SAMPLE_RATE,
+)
+
+
+def configure_autolog():
+    """
+    設定 tracking server 並開啟 langchain autolog; 需要連線 tracking server, 失敗時只記錄 log。
+    """
+    try:
+        import mlflow
+
+        mlflow.set_tracking_uri(Settings.TRACKING_SERVER_URI)
+        mlflow.set_experiment(Settings.MLFLOW_EXPERIMENT)
+        mlflow.langchain.autolog()
+        logger.info("mlflow langchain autolog enabled")
+    except Exception as e:
+        logger.warning(f"mlflow autolog fail: {e}")
+
+
+def get_openai_callback():
+    """
+    延遲載入 langchain_community 的 get_openai_callback。
+    """
+    # from langchain.callbacks import get_openai_callback
+    from langchain_community.callbacks.manager import get_openai_callback
+
+    return get_openai_callback()
 
 
 def mlflow_exception_logger(func):
@@ -13,25 +220,36 @@ def mlflow_exception_logger(func):
             return await func(*args, **kwargs)
         except Exception as e:
             error_message = f"Uncaught exception: {e}\n{traceback.format_exc()}"
-            mlflow.set_tag("uncaught_error_message", e)
-            mlflow.log_text(error_message, "uncaught_error_log.txt")
+            telemetry_exporter.record_exception(func.__name__, error_message)
             # raise
 
     return wrapper
 
 
+def record_stream_usage(endpoint: str, cb, prompt_tokens: int, completion: str):
+    """
+    記錄串流請求的 OpenAI 用量; 串流回應不含 token 用量 (llm_output 為空) 時以 utils_token 估算,
+    此時沒有 model 名稱, total_cost_USD 為 0。
+
+    :param endpoint: 請求的 endpoint 名稱
+    :param cb: get_openai_callback 的 callback handler
+    :param prompt_tokens: 估算的 prompt tokens
+    :param completion: 串流送出的回覆
+    """
+    if not cb.total_tokens and completion:
+        cb.prompt_tokens = prompt_tokens
+        cb.completion_tokens = estimate_tokens(completion)
+        cb.total_tokens = cb.prompt_tokens + cb.completion_tokens
+        cb.successful_requests = max(cb.successful_requests, 1)
+    telemetry_exporter.record(endpoint, cb)
+
+
 def mlflow_openai_callback(func):
     @wraps(func)
     async def wrapper(*args, **kwargs):
-        with mlflow.start_run() as run:
-            with get_openai_callback() as cb:
-                result = await func(*args, **kwargs)
-                mlflow.log_text(str(cb), "total_cost.txt")
-                mlflow.log_metric("total_cost_USD", cb.total_cost)
-                mlflow.log_metric("total_tokens", cb.total_tokens)
-                mlflow.log_metric("successful_requests", cb.successful_requests)
-            
-            return result
+        with get_openai_callback() as cb:
+            result = await func(*args, **kwargs)
+        telemetry_exporter.record(func.__name__, cb)
+        return result
 
     return wrapper
-
@@ -0,0 +1,529 @@
+"""
+Timeouts, retries, hedging and circuit breaking for Azure OpenAI calls.
+
+Every attempt is bounded by the smaller of its stage timeout and what is
+left of the request budget (set per request by DeadlineMiddleware).
+Retryable failures are retried with full-jitter exponential backoff; with a
+second deployment configured, a hedged request is sent when the first one
+has not answered after ``hedge_delay``. Each deployment has a circuit
+breaker: once open, calls fail fast with TimeOutError (2003) or go to the
+other deployment.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from app.setting.exceptions import TimeOutError
+from app.setting.utils_metrics import Counter, Gauge
+from app.setting.utils_router import DeploymentRouter
+from app.setting.utils_tracing import current_stage
+
+
+logger = logging.getLogger(__name__)
+
+CALL_ATTEMPTS = Counter("llm_call_attempts_total", "Azure OpenAI call attempts", ["stage", "deployment", "outcome"])
+HEDGED_CALLS = Counter("llm_hedged_calls_total", "Hedged requests sent to the second deployment", ["stage", "deployment"])
+CIRCUIT_STATE = Gauge("llm_circuit_state", "Circuit breaker state, 0 closed, 1 half-open, 2 open", ["deployment"])
+
+T = TypeVar("T")
+
+# 目前請求的截止時間 (time.monotonic), 由 DeadlineMiddleware 設定; None 表示不限制
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+# 可重試的 HTTP 狀態碼
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+def remaining() -> Optional[float]:
+    """
+    :return: 目前請求剩餘的秒數, 沒有設定預算時為 None
+    """
+    if (deadline := _deadline.get()) is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def _is_timeout(error: BaseException) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, TimeOutError)):
+        return True
+    # openai.APITimeoutError / httpx.TimeoutException, 不 import openai 以免拖慢啟動
+    return "Timeout" in type(error).__name__
+
+
+def _is_throttled(error: BaseException) -> bool:
+    return getattr(error, "status_code", None) == 429
+
+
+def _is_retryable(error: BaseException) -> bool:
+    if _is_timeout(error):
+        return True
+    if getattr(error, "status_code", None) in _RETRYABLE_STATUS:
+        return True
+    return type(error).__name__ in ("APIConnectionError", "ConnectError", "RemoteProtocolError")
+
+
+class CircuitBreaker:
+    """
+    連續失敗 failure_threshold 次後斷路 reset_timeout 秒; 之後每 reset_timeout 秒放行一個
+    試探請求 (half-open), 成功即恢復, 失敗則再次斷路。
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+    STATES = ("closed", "half-open", "open")
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        """
+        :param name: deployment 名稱
+        :param failure_threshold: 斷路前的連續失敗次數, 0 表示不斷路
+        :param reset_timeout: 斷路後多久放行試探請求
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.set(self.state, deployment=name)
+
+    def _transition(self, state: int):
+        if state != self.state:
+            logger.warning("circuit %s: %s -> %s", self.name, self.STATES[self.state], self.STATES[state])
+            self.state = state
+            CIRCUIT_STATE.set(state, deployment=self.name)
+
+    def available(self) -> bool:
+        """
+        :return: 是否可能放行請求, 不改變狀態
+        """
+        return self.state == self.CLOSED or time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def allow(self) -> bool:
+        """
+        :return: 是否可以送出請求; 斷路期滿時放行一個試探請求, 試探沒有結果時下一個期滿再放行
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.opened_at = time.monotonic()
+                self._transition(self.HALF_OPEN)
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._transition(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (
+                self.failure_threshold and self.failures >= self.failure_threshold
+            ):
+                self.opened_at = time.monotonic()
+                self._transition(self.OPEN)
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str, failure_threshold: int = 5, reset_timeout: float = 30) -> CircuitBreaker:
+    """
+    取得 deployment 共用的 circuit breaker, 同一個 deployment 的所有 model 共用狀態。
+    """
+    with _breakers_lock:
+        if (breaker := _breakers.get(name)) is None:
+            breaker = _breakers[name] = CircuitBreaker(name, failure_threshold, reset_timeout)
+        return breaker
+
+
+# (deployment 名稱, 以單次逾時秒數執行呼叫的函式)
+Call = Tuple[str, Callable[[float], Any]]
+
+
+class ResiliencePolicy:
+    """
+    依序對 deployment 清單 (第一個為主要 deployment) 執行呼叫的逾時、重試與 hedging 規則。
+    """
+
+    def __init__(
+        self,
+        timeout: float = 10,
+        stage_timeouts: Optional[Dict[str, float]] = None,
+        max_retries: int = 2,
+        backoff: float = 0.2,
+        backoff_max: float = 2,
+        hedge_delay: float = 0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        router: Optional[DeploymentRouter] = None,
+    ):
+        """
+        :param timeout: 單次呼叫的逾時, stage_timeouts 沒有列出的階段使用
+        :param stage_timeouts: {stage: 逾時}, stage 為 utils_tracing.stage 的名稱
+        :param max_retries: 失敗後重試的次數
+        :param backoff: 第一次重試前等待的上限, 之後每次加倍, 實際等待為 0 到上限間的亂數
+        :param backoff_max: 等待的上限
+        :param hedge_delay: 主要 deployment 超過此秒數未回應時送出 hedge 請求, 0 表示不 hedge
+        :param failure_threshold: circuit breaker 斷路前的連續失敗次數
+        :param reset_timeout: circuit breaker 斷路的秒數
+        :param router: 依負載排序 deployment 並處理 429, None 時依清單順序
+        """
+        self.timeout = timeout
+        self.stage_timeouts = stage_timeouts or {}
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.hedge_delay = hedge_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.router = router
+
+    def _breaker(self, name: str) -> CircuitBreaker:
+        return get_breaker(name, self.failure_threshold, self.reset_timeout)
+
+    def _attempt_timeout(self, stage: str) -> float:
+        """
+        :return: 本次呼叫的逾時: 階段逾時與剩餘預算取小
+        :raises TimeOutError: 請求預算已用完
+        """
+        timeout = self.stage_timeouts.get(stage, self.timeout)
+        if (left := remaining()) is not None:
+            if left <= 0:
+                raise TimeOutError(f"{stage}: request budget exhausted")
+            timeout = min(timeout, left)
+        return timeout
+
+    def _available(self, calls: Sequence[Call], stage: str) -> Tuple[List[Call], float]:
+        """
+        :return: (可用的 deployment, 有 router 時依負載排序; 全部被限流時需要等待的秒數)
+        :raises TimeOutError: 全部斷路, 或限流的等待超過剩餘預算
+        """
+        available = [call for call in calls if self._breaker(call[0]).available()]
+        if not available:
+            CALL_ATTEMPTS.inc(stage=stage, deployment=calls[0][0], outcome="circuit_open")
+            raise TimeOutError(f"{stage}: circuit open for {', '.join(name for name, _ in calls)}")
+        if self.router is None:
+            return available, 0.0
+
+        funcs = dict(available)
+        if ready := self.router.order(list(funcs)):
+            return [(name, funcs[name]) for name in ready], 0.0
+        wait = self.router.cooldown(list(funcs))
+        if (left := remaining()) is not None and wait >= left:
+            raise TimeOutError(f"{stage}: all deployments throttled for {wait:.1f}s")
+        return [], wait
+
+    def _pick(self, available: List[Call], attempt: int) -> Call:
+        # 有 router 時負載最低的在最前面; 否則重試時改送下一個 deployment
+        if self.router is not None:
+            return available[0]
+        return available[min(attempt, len(available) - 1)]
+
+    def _retry_delay(self, attempt: int, stage: str, error: BaseException, calls: Sequence[Call]) -> float:
+        """
+        :return: 下一次重試前等待的秒數; 429 時改送其他 deployment, 不等待
+        :raises: 不可重試、沒有重試次數或剩餘預算不足時拋出 error
+        """
+        if not _is_retryable(error):
+            raise error
+        if self.router is not None and _is_throttled(error):
+            # 被限流的 deployment 已暫停使用, 每個 deployment 各多給一次機會
+            if attempt >= self.max_retries + len(calls):
+                raise error
+            return 0.0
+        return self._backoff(attempt, stage, error)
+
+    def _backoff(self, attempt: int, stage: str, error: BaseException) -> float:
+        """
+        :return: 下一次重試前等待的秒數
+        :raises: 沒有重試次數或剩餘預算不足時拋出 error
+        """
+        if attempt >= self.max_retries:
+            raise error
+        delay = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+        if (left := remaining()) is not None and left <= delay:
+            raise error
+        logger.info("%s retry %d in %.2fs: %s", stage, attempt + 1, delay, error)
+        return delay
+
+    def _failed(self, name: str, stage: str, timeout: float, error: Exception) -> Exception:
+        """
+        記錄失敗並轉換例外: 逾時轉為 TimeOutError, 不可重試的錯誤不計入 circuit breaker。
+        429 表示配額用盡而非 deployment 異常, 不計入 circuit breaker, 有 router 時暫停該 deployment。
+        """
+        if _is_throttled(error):
+            if self.router is not None:
+                self.router.throttle(name, error)
+            CALL_ATTEMPTS.inc(stage=stage, deployment=name, outcome="throttled")
+            return error
+        if _is_timeout(error):
+            self._breaker(name).record_failure()
+            CALL_ATTEMPTS.inc(stage=stage, deployment=name, outcome="timeout")
+            if isinstance(error, TimeOutError):
+                return error
+            timeout_error = TimeOutError(f"{stage}: {name} did not answer within {timeout:.1f}s")
+            timeout_error.__cause__ = error
+            return timeout_error
+        if _is_retryable(error):
+            self._breaker(name).record_failure()
+            CALL_ATTEMPTS.inc(stage=stage, deployment=name, outcome="retryable")
+        else:
+            self._breaker(name).record_success()
+            CALL_ATTEMPTS.inc(stage=stage, deployment=name, outcome="error")
+        return error
+
+    def _allow(self, name: str, stage: str):
+        """
+        :raises TimeOutError: deployment 斷路中
+        """
+        if not self._breaker(name).allow():
+            CALL_ATTEMPTS.inc(stage=stage, deployment=name, outcome="circuit_open")
+            raise TimeOutError(f"{stage}: circuit open for {name}")
+        if self.router is not None:
+            self.router.dispatched(name)
+
+    def _succeeded(self, name: str, stage: str):
+        self._breaker(name).record_success()
+        CALL_ATTEMPTS.inc(stage=stage, deployment=name, outcome="ok")
+
+    def call(self, calls: Sequence[Call]) -> Any:
+        """
+        同步呼叫; 逾時由 client 的 timeout 參數處理, 重試時改送下一個 deployment。
+        """
+        stage = current_stage()
+        attempt = 0
+        while True:
+            available, wait = self._available(calls, stage)
+            if not available:
+                time.sleep(wait)
+                continue
+            name, func = self._pick(available, attempt)
+            timeout = self._attempt_timeout(stage)
+            try:
+                self._allow(name, stage)
+                try:
+                    result = func(timeout)
+                except Exception as e:
+                    raise self._failed(name, stage, timeout, e)
+            except Exception as e:
+                time.sleep(self._retry_delay(attempt, stage, e, calls))
+                attempt += 1
+                continue
+            self._succeeded(name, stage)
+            return result
+
+    async def _aattempt(self, call: Call, stage: str) -> Any:
+        name, func = call
+        timeout = self._attempt_timeout(stage)
+        self._allow(name, stage)
+        try:
+            result = await asyncio.wait_for(func(timeout), timeout)
+        except Exception as e:
+            raise self._failed(name, stage, timeout, e)
+        self._succeeded(name, stage)
+        return result
+
+    async def _ahedged(self, available: List[Call], stage: str) -> Any:
+        """
+        送出主要請求; 超過 hedge_delay 未完成時再送 hedge 請求, 先成功的結果勝出, 另一個取消。
+        """
+        if len(available) == 1 or not self.hedge_delay:
+            return await self._aattempt(available[0], stage)
+
+        tasks = {asyncio.ensure_future(self._aattempt(available[0], stage))}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay)
+            if not done:
+                HEDGED_CALLS.inc(stage=stage, deployment=available[1][0])
+                tasks.add(asyncio.ensure_future(self._aattempt(available[1], stage)))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def acall(self, calls: Sequence[Call]) -> Any:
+        """
+        async 呼叫; 以 asyncio.wait_for 限制每次呼叫的時間, 可 hedge 到第二個 deployment。
+        """
+        stage = current_stage()
+        attempt = 0
+        while True:
+            available, wait = self._available(calls, stage)
+            if not available:
+                await asyncio.sleep(wait)
+                continue
+            if attempt and len(available) > 1 and self.router is None:
+                # 重試時先送另一個 deployment
+                available = available[1:] + available[:1]
+            try:
+                return await self._ahedged(available, stage)
+            except Exception as e:
+                await asyncio.sleep(self._retry_delay(attempt, stage, e, calls))
+                attempt += 1
+
+    async def astream(self, calls: Sequence[Tuple[str, Callable[[float], AsyncIterator[T]]]]) -> AsyncIterator[T]:
+        """
+        串流呼叫; 第一個片段之前的失敗可以重試, 之後每個片段都受剩餘預算限制, 不再重試。
+        """
+        stage = current_stage()
+        attempt = 0
+        while True:
+            available, wait = self._available(calls, stage)
+            if not available:
+                await asyncio.sleep(wait)
+                continue
+            name, func = self._pick(available, attempt)
+            timeout = self._attempt_timeout(stage)
+            try:
+                self._allow(name, stage)
+                iterator = func(timeout).__aiter__()
+                try:
+                    first = await asyncio.wait_for(iterator.__anext__(), timeout)
+                except StopAsyncIteration:
+                    self._succeeded(name, stage)
+                    return
+                except Exception as e:
+                    raise self._failed(name, stage, timeout, e)
+            except Exception as e:
+                await asyncio.sleep(self._retry_delay(attempt, stage, e, calls))
+                attempt += 1
+                continue
+            break
+
+        self._succeeded(name, stage)
+        yield first
+        while True:
+            timeout = self._attempt_timeout(stage)
+            try:
+                chunk = await asyncio.wait_for(iterator.__anext__(), timeout)
+            except StopAsyncIteration:
+                return
+            except Exception as e:
+                raise self._failed(name, stage, timeout, e)
+            yield chunk
+
+
+class ResilientChatModel(Runnable):
+    """
+    以 ResiliencePolicy 呼叫一或多個 chat model (第一個為主要 deployment), 可直接放在 chain 中取代 model。
+    """
+
+    def __init__(self, models: Sequence[Tuple[str, Runnable]], policy: ResiliencePolicy):
+        """
+        :param models: [(deployment 名稱, chat model)]
+        :param policy: 逾時、重試與 hedging 規則
+        """
+        self.models = list(models)
+        self.policy = policy
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        return self.policy.call([
+            (name, lambda timeout, model=model: model.invoke(input, config, timeout=timeout, **kwargs))
+            for name, model in self.models
+        ])
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        return await self.policy.acall([
+            (name, lambda timeout, model=model: model.ainvoke(input, config, timeout=timeout, **kwargs))
+            for name, model in self.models
+        ])
+
+    def stream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[Any]:
+        yield self.invoke(input, config, **kwargs)
+
+    async def astream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[Any]:
+        async for chunk in self.policy.astream([
+            (name, lambda timeout, model=model: model.astream(input, config, timeout=timeout, **kwargs))
+            for name, model in self.models
+        ]):
+            yield chunk
+
+
+class ResilientEmbeddings(Embeddings):
+    """
+    以 ResiliencePolicy 呼叫 embeddings; 同步呼叫的逾時由 embeddings client 的 timeout 處理。
+    """
+
+    def __init__(self, embeddings: Sequence[Tuple[str, Embeddings]], policy: ResiliencePolicy):
+        """
+        :param embeddings: [(deployment 名稱, embeddings)]
+        :param policy: 逾時、重試與 hedging 規則
+        """
+        self.embeddings = list(embeddings)
+        self.policy = policy
+
+    def _calls(self, method: str, *args) -> List[Call]:
+        return [
+            (name, lambda timeout, embeddings=embeddings: getattr(embeddings, method)(*args))
+            for name, embeddings in self.embeddings
+        ]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.policy.call(self._calls("embed_documents", texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.policy.call(self._calls("embed_query", text))
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.policy.acall(self._calls("aembed_documents", texts))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.policy.acall(self._calls("aembed_query", text))
+
+
+def parse_stage_timeouts(value: str) -> Dict[str, float]:
+    """
+    :param value: 例如 "ner_llm=8,genai_llm=15"
+    :return: {stage: 逾時}
+    """
+    timeouts = {}
+    for item in value.split(","):
+        if "=" in item:
+            stage, seconds = item.rsplit("=", 1)
+            timeouts[stage.strip()] = float(seconds)
+    return timeouts
+
+
+class DeadlineMiddleware:
+    """
+    ASGI middleware: 為每個請求設定截止時間, 請求中所有 LLM / embedding 呼叫共用這個預算。
+    """
+
+    def __init__(self, app, budget: float, batch_budget: Optional[float] = None):
+        """
+        :param budget: 一般請求的預算秒數, 0 表示不限制
+        :param batch_budget: :batch 請求的預算秒數, 預設同 budget
+        """
+        self.app = app
+        self.budget = budget
+        self.batch_budget = budget if batch_budget is None else batch_budget
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        budget = self.batch_budget if scope["path"].endswith(":batch") else self.budget
+        token = _deadline.set(time.monotonic() + budget if budget else None)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _deadline.reset(token)
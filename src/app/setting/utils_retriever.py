@@ -1,45 +1,100 @@
 
-from collections import Counter
-from langchain_core.runnables import RunnableLambda
-from typing import List, Callable, Dict, Union, Any
+from langchain_core.runnables import Runnable, RunnableLambda
+from langchain_core.runnables.config import run_in_executor
+from typing import List, Callable, Dict, Union, Any, Optional, Tuple
+from functools import partial
 from operator import itemgetter
 import re
 
 from langchain_core.documents import Document
-from langchain_core.runnables import chain
+from setting.utils_embedding import EmbeddingCache, CachedQueryEmbeddings
+from setting.utils_vindex import InMemoryVectorIndex
+from app.setting.utils_tracing import stage
 
 
-def _get_metadata(response: List[Any], *keys: str) -> List[Any]:
+def aggregate_metadata(
+    response: List[Any], fields: Dict[str, Tuple[str, ...]]
+) -> Dict[str, List[Any]]:
     """
-    Retrieve metadata based on provided keys from the response.
+    Retrieve several metadata groups from the response in a single pass.
 
     For single-element responses, return the value directly.
     For multiple-element responses, return the maximum value for numerical types,
-    or the most common value for other types.
+    or the most common value for other types (ties go to the value seen first).
+    A group with several keys is compared as a tuple of its values.
 
     Parameters:
     response -- A list containing metadata
-    *keys -- The keys to retrieve from the metadata
+    fields -- Output name mapped to the keys of that group
 
     Returns:
-    A list containing the retrieved values.
+    {name: list of the retrieved values}
     """
 
     if not response:
-        return []
+        return {name: [] for name in fields}
+
+    groups = list(fields.items())
+    getters = [itemgetter(*keys) for _, keys in groups]
 
     if len(response) == 1:
-        result = itemgetter(*keys)(response[0].metadata)
+        metadata = response[0].metadata
+        values = [getter(metadata) for getter in getters]
     else:
-        metadata_list = [itemgetter(*keys)(item.metadata) for item in response]
+        # numeric groups keep a running max, others count occurrences
+        # (dict keeps insertion order, so max() over counts breaks ties like Counter.most_common)
+        # a missing key (KeyError) takes precedence over values that cannot be
+        # compared or hashed (TypeError), as when every group read all documents first
+        first = response[0].metadata
+        values = [getter(first) for getter in getters]
+        numeric = [isinstance(value, (int, float)) for value in values]
+        error = None
+        try:
+            counts = [None if is_numeric else {value: 1} for value, is_numeric in zip(values, numeric)]
+        except TypeError as e:
+            error = e
+
+        for item in response[1:]:
+            metadata = item.metadata
+            for i, getter in enumerate(getters):
+                value = getter(metadata)
+                if error is not None:
+                    continue
+                try:
+                    if numeric[i]:
+                        if value > values[i]:
+                            values[i] = value
+                    else:
+                        counts[i][value] = counts[i].get(value, 0) + 1
+                except TypeError as e:
+                    error = e
+
+        if error is not None:
+            raise error
+
+        for i, count in enumerate(counts):
+            if count is not None:
+                values[i] = max(count, key=count.get)
+
+    return {
+        name: [value] if len(keys) == 1 else list(value)
+        for (name, keys), value in zip(groups, values)
+    }
 
-        if isinstance(metadata_list[0], (int, float)):
-            result = max(metadata_list)
-        else:
-            counter = Counter(metadata_list)
-            result = counter.most_common(1)[0][0]
 
-    return [result] if len(keys) == 1 else list(result)
+def _get_metadata(response: List[Any], *keys: str) -> List[Any]:
+    """
+    Retrieve metadata based on provided keys from the response,
+    see aggregate_metadata for the semantics.
+
+    Parameters:
+    response -- A list containing metadata
+    *keys -- The keys to retrieve from the metadata
+
+    Returns:
+    A list containing the retrieved values.
+    """
+    return aggregate_metadata(response, {"value": keys})["value"]
 
 
 def _create_partial_func(func: Callable, *keys: str) -> Callable:
@@ -76,6 +131,21 @@ def get_metadata_runnable(*keys: str) -> Callable[[List], List]:
     return RunnableLambda(f)
 
 
+def get_metadata_fields_runnable(fields: Dict[str, Tuple[str, ...]]) -> Runnable[List[Document], Dict[str, List]]:
+    """
+    Creates one langchain runnable extracting several metadata groups from the
+    retrieved documents in a single pass, instead of one runnable per group.
+
+    Parameters:
+    fields -- Output name mapped to the metadata keys of that group,
+              e.g. {"SQL": ("SQL1", "SQL2", "SQL3"), "score": ("score",)}
+
+    Returns:
+    A langchain runnable returning aggregate_metadata(documents, fields).
+    """
+    return RunnableLambda(partial(aggregate_metadata, fields=fields), name="metadata")
+
+
 def get_sql_querys(response: Dict[str, Dict[str, str]], user_id: str) -> List[str]:
     """
     Get processed SQL queries based on the response and customer ID.
@@ -100,24 +170,63 @@ def get_sql_querys(response: Dict[str, Dict[str, str]], user_id: str) -> List[st
     return querys
 
 
-def RetrieveWithScore(
+def _to_scored_documents(
     vectorstore: "VectorStore",
+    docs_and_distances: List[Tuple[Document, float]],
+    score_threshold: float,
+) -> List[Document]:
+    """
+    Converts distances returned by the vector store to relevance scores and
+    keeps the documents reaching the threshold.
+
+    Args:
+        vectorstore (VectorStore): The vector store instance.
+        docs_and_distances (List[Tuple[Document, float]]): Documents with distances.
+        score_threshold (float): Minimum relevance score.
+
+    Returns:
+        List[Document]: Documents with the relevance score in metadata["score"].
+    """
+    relevance_score_fn = vectorstore._select_relevance_score_fn()
+    docs = []
+    for doc, distance in docs_and_distances:
+        score = relevance_score_fn(distance)
+        if score >= score_threshold:
+            doc.metadata["score"] = score
+            docs.append(doc)
+    return docs
+
+
+def RetrieveWithScore(
+    vectorstore: Union["VectorStore", Callable[[], "VectorStore"]],
     k: int = 4,
     score_threshold: float = 0.8,
-) -> Callable[[str], List[Document]]:
+    embedding_cache: Optional[EmbeddingCache] = None,
+    vector_index: Optional[InMemoryVectorIndex] = None,
+) -> Runnable[str, List[Document]]:
     """
     Creates a retriever to fetch relevant documents from a vector store.
 
     Args:
-        vectorstore (VectorStore): The vector store instance.
+        vectorstore (Union[VectorStore, Callable[[], VectorStore]]): The vector
+            store instance, or a function returning the current one (it is
+            replaced when Chroma reconnects); each query reads it once.
         k (int, optional): Max number of documents to retrieve. Default is 4.
         score_threshold (float, optional): Minimum relevance score. Default is 0.8.
+        embedding_cache (EmbeddingCache, optional): Cache for query embeddings.
+        vector_index (InMemoryVectorIndex, optional): In-process mirror of the
+            collection, queried instead of Chroma when given.
 
     Returns:
-        Callable[[str], List[Document]]: A function that retrieves documents.
+        Runnable[str, List[Document]]: A runnable that retrieves documents,
+        supporting both invoke and ainvoke.
     """
+    get_vectorstore = vectorstore if callable(vectorstore) else (lambda: vectorstore)
+    # embeddings 在重新連線時不會更換
+    embeddings = get_vectorstore().embeddings
+    if embedding_cache is not None:
+        embeddings = CachedQueryEmbeddings(embeddings, embedding_cache)
 
-    @chain
     def retriever(query: str) -> List[Document]:
         """
         Retrieves relevant documents based on a query.
@@ -128,14 +237,42 @@ def RetrieveWithScore(
         Returns:
             List[Document]: List of documents with relevance scores.
         """
-        result = vectorstore.similarity_search_with_relevance_scores(
-            query=query, k=k, score_threshold=score_threshold
-        )
-        if result:
-            docs, scores = zip(*result)
-            for doc, score in zip(docs, scores):
-                doc.metadata["score"] = score
-            return list(docs)
-        return []
-
-    return retriever
+        vectorstore = get_vectorstore()
+        with stage("embedding"):
+            embedding = embeddings.embed_query(query)
+        with stage("vector_search"):
+            if vector_index is not None:
+                result = vector_index.search(embedding, k)
+            else:
+                result = vectorstore.similarity_search_by_vector_with_relevance_scores(
+                    embedding=embedding, k=k
+                )
+        return _to_scored_documents(vectorstore, result, score_threshold)
+
+    async def aretriever(query: str) -> List[Document]:
+        """
+        Async version of retriever, the query embedding is awaited and the
+        Chroma query (when no vector_index is given) runs in the executor.
+
+        Args:
+            query (str): The query string.
+
+        Returns:
+            List[Document]: List of documents with relevance scores.
+        """
+        vectorstore = get_vectorstore()
+        with stage("embedding"):
+            embedding = await embeddings.aembed_query(query)
+        with stage("vector_search"):
+            if vector_index is not None:
+                result = vector_index.search(embedding, k)
+            else:
+                result = await run_in_executor(
+                    None,
+                    vectorstore.similarity_search_by_vector_with_relevance_scores,
+                    embedding,
+                    k,
+                )
+        return _to_scored_documents(vectorstore, result, score_threshold)
+
+    return RunnableLambda(retriever, afunc=aretriever, name="retriever")
@@ -0,0 +1,226 @@
+"""
+Load-aware routing across several Azure OpenAI chat deployments.
+
+Each deployment has a weight and optional TPM / RPM quotas. The router
+keeps a one-minute sliding window of requests (counted at dispatch) and
+tokens (from the LLM usage callbacks) per deployment, and orders the
+deployments by utilization of their quota divided by their weight. A
+deployment answering 429 is skipped until its Retry-After has passed.
+"""
+
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import LLMResult
+
+from app.setting.utils_metrics import Counter, Gauge
+from app.setting.utils_token import estimate_message_tokens, estimate_tokens
+
+
+logger = logging.getLogger(__name__)
+
+DEPLOYMENT_LOAD = Gauge("llm_deployment_load", "Requests / tokens in the last minute per deployment", ["deployment", "type"])
+DEPLOYMENT_THROTTLED = Counter("llm_deployment_throttled_total", "429 responses per deployment", ["deployment"])
+
+_WINDOW = 60
+
+
+class Deployment:
+    """
+    一個 Azure OpenAI chat deployment 的連線設定與配額。
+    """
+
+    def __init__(
+        self,
+        deployment: str,
+        endpoint: str,
+        api_key_env: str = "AZURE_OPENAI_API_KEY",
+        weight: float = 1,
+        tpm: int = 0,
+        rpm: int = 0,
+        name: Optional[str] = None,
+    ):
+        """
+        :param deployment: Azure OpenAI deployment 名稱
+        :param endpoint: Azure OpenAI endpoint
+        :param api_key_env: 存放 API key 的環境變數名稱, API key 不寫在設定中
+        :param weight: 權重, 負載相同時權重高的優先
+        :param tpm: 每分鐘 token 配額, 0 表示不限制
+        :param rpm: 每分鐘請求配額, 0 表示不限制
+        :param name: 在 metrics 與 circuit breaker 中的名稱, 預設為 deployment 名稱
+        """
+        self.deployment = deployment
+        self.endpoint = endpoint
+        self.api_key_env = api_key_env
+        self.weight = weight
+        self.tpm = tpm
+        self.rpm = rpm
+        self.name = name or deployment
+
+
+def parse_deployments(value: str, default_endpoint: str = "") -> List[Deployment]:
+    """
+    :param value: JSON 陣列, 例如
+        [{"deployment": "gpt-4o", "endpoint": "https://east.openai.azure.com",
+          "api_key_env": "AZURE_OPENAI_EAST_API_KEY", "weight": 2, "tpm": 240000, "rpm": 1440}]
+    :param default_endpoint: 未指定 endpoint 時使用
+    :return: deployment 清單, value 為空時回傳空清單
+    """
+    if not value.strip():
+        return []
+    deployments = []
+    for item in json.loads(value):
+        item = dict(item)
+        item.setdefault("endpoint", default_endpoint)
+        deployments.append(Deployment(**item))
+    names = [deployment.name for deployment in deployments]
+    if len(set(names)) != len(names):
+        raise ValueError(f"deployment names must be unique, set name for duplicates: {names}")
+    return deployments
+
+
+class DeploymentLoad:
+    """
+    最近一分鐘的請求數與 token 數, 以每秒一格的環狀 bucket 累計。
+    """
+
+    def __init__(self):
+        self._seconds = [0] * _WINDOW
+        self._requests = [0] * _WINDOW
+        self._tokens = [0] * _WINDOW
+        self._lock = threading.Lock()
+
+    def _bucket(self, now: int) -> int:
+        i = now % _WINDOW
+        if self._seconds[i] != now:
+            self._seconds[i] = now
+            self._requests[i] = 0
+            self._tokens[i] = 0
+        return i
+
+    def add(self, requests: int = 0, tokens: int = 0):
+        with self._lock:
+            i = self._bucket(int(time.monotonic()))
+            self._requests[i] += requests
+            self._tokens[i] += tokens
+
+    def totals(self) -> Dict[str, int]:
+        """
+        :return: {"requests": 最近一分鐘的請求數, "tokens": 最近一分鐘的 token 數}
+        """
+        now = int(time.monotonic())
+        with self._lock:
+            live = [i for i in range(_WINDOW) if now - self._seconds[i] < _WINDOW]
+            return {
+                "requests": sum(self._requests[i] for i in live),
+                "tokens": sum(self._tokens[i] for i in live),
+            }
+
+
+class DeploymentUsageCallback(BaseCallbackHandler):
+    """
+    將 LLM 回傳的 token 用量記到 deployment 的負載; 沒有用量時 (例如串流) 以估算值代替。
+    """
+
+    def __init__(self, load: DeploymentLoad):
+        self.load = load
+        self._prompt_tokens: Dict[UUID, int] = {}
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], *, run_id: UUID, **kwargs: Any) -> None:
+        self._prompt_tokens[run_id] = sum(estimate_message_tokens(batch) for batch in messages)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        estimated = self._prompt_tokens.pop(run_id, 0)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if not (tokens := usage.get("total_tokens")):
+            tokens = estimated + sum(
+                estimate_tokens(generation.text) for generations in response.generations for generation in generations
+            )
+        self.load.add(tokens=tokens)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._prompt_tokens.pop(run_id, None)
+
+
+class DeploymentRouter:
+    """
+    依負載排序 deployment; 回應 429 的 deployment 在 Retry-After 之前不再使用。
+    """
+
+    def __init__(self, deployments: Sequence[Deployment], throttle_seconds: float = 10):
+        """
+        :param deployments: deployment 清單
+        :param throttle_seconds: 429 沒有 Retry-After 時暫停使用的秒數
+        """
+        self.deployments = {deployment.name: deployment for deployment in deployments}
+        self.loads = {name: DeploymentLoad() for name in self.deployments}
+        self.throttle_seconds = throttle_seconds
+        self._throttled_until: Dict[str, float] = {}
+        for name, load in self.loads.items():
+            for key in ("requests", "tokens"):
+                DEPLOYMENT_LOAD.set_function(lambda load=load, key=key: load.totals()[key], deployment=name, type=key)
+
+    def callback(self, name: str) -> DeploymentUsageCallback:
+        """
+        :return: 記錄該 deployment token 用量的 callback, 建立 model 時加入 callbacks
+        """
+        return DeploymentUsageCallback(self.loads[name])
+
+    def utilization(self, name: str) -> float:
+        """
+        :return: 配額使用率 (TPM 與 RPM 取大) 除以權重; 沒有配額時以每分鐘請求數除以權重
+        """
+        deployment = self.deployments[name]
+        totals = self.loads[name].totals()
+        ratios = []
+        if deployment.tpm:
+            ratios.append(totals["tokens"] / deployment.tpm)
+        if deployment.rpm:
+            ratios.append(totals["requests"] / deployment.rpm)
+        used = max(ratios) if ratios else totals["requests"]
+        return used / (deployment.weight or 1)
+
+    def ready(self, name: str) -> bool:
+        return self._throttled_until.get(name, 0) <= time.monotonic()
+
+    def cooldown(self, names: Sequence[str]) -> float:
+        """
+        :return: names 中最早恢復的 deployment 還需要等待的秒數, 有可用的 deployment 時為 0
+        """
+        now = time.monotonic()
+        return max(0.0, min(self._throttled_until.get(name, 0) for name in names) - now)
+
+    def order(self, names: Sequence[str]) -> List[str]:
+        """
+        :return: 未被限流的 deployment, 依負載由低到高排序
+        """
+        return sorted((name for name in names if self.ready(name)), key=self.utilization)
+
+    def dispatched(self, name: str):
+        """
+        送出請求時記錄, 讓同時間的其他請求立即看到負載變化。
+        """
+        self.loads[name].add(requests=1)
+
+    def throttle(self, name: str, error: BaseException):
+        """
+        deployment 回應 429 時暫停使用, 優先採用 Retry-After。
+        """
+        seconds = self.throttle_seconds
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        try:
+            seconds = float(headers.get("retry-after-ms")) / 1000
+        except (TypeError, ValueError):
+            try:
+                seconds = float(headers.get("retry-after"))
+            except (TypeError, ValueError):
+                pass
+        self._throttled_until[name] = max(self._throttled_until.get(name, 0), time.monotonic() + seconds)
+        DEPLOYMENT_THROTTLED.inc(deployment=name)
+        logger.warning("deployment %s throttled for %.1fs", name, seconds)
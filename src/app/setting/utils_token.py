@@ -0,0 +1,52 @@
+import re
+from typing import Any, Sequence
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import LLMResult
+
+from app.setting.utils_tracing import LLM_TOKENS, current_stage
+
+
+# CJK 字元約 1 token/字, 其餘以英數字詞約 4 字元/token 估算
+_CJK = re.compile(r"[　-〿㐀-䶿一-鿿豈-﫿＀-￯]")
+_MESSAGE_OVERHEAD = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    不呼叫 tokenizer, 以字元數快速估算 token 數 (偏保守)。
+
+    :param text: 文字
+    :return: 估算的 token 數
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_message_tokens(messages: Sequence[BaseMessage]) -> int:
+    """
+    估算多則訊息的 token 數, 每則訊息另加角色標記的固定成本。
+
+    :param messages: 訊息列表
+    :return: 估算的 token 數
+    """
+    return sum(estimate_tokens(str(message.content)) + _MESSAGE_OVERHEAD for message in messages)
+
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """
+    依目前的階段累計 LLM 回傳的 prompt / completion tokens。
+    """
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        name = current_stage()
+        for key in ("prompt_tokens", "completion_tokens"):
+            if usage.get(key):
+                LLM_TOKENS.inc(usage[key], stage=name, type=key.split("_")[0])
+
+
+token_usage_callback = TokenUsageCallback()
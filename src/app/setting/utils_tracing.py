@@ -0,0 +1,104 @@
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from app.setting.utils_metrics import Counter, Gauge, Histogram
+
+
+logger = logging.getLogger(__name__)
+
+STAGE_SECONDS = Histogram("pipeline_stage_seconds", "Wall time of a pipeline stage", ["stage", "status"])
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens used by LLM calls", ["stage", "type"])
+REQUEST_SECONDS = Histogram("http_request_seconds", "Wall time of an HTTP request", ["path", "status"])
+COMPONENT_STATS = Gauge("pipeline_component_stat", "Counters reported by caches and gates", ["component", "owner", "stat"])
+
+# 目前請求各階段累計的耗時, 由 TimingMiddleware 建立; 子 task / executor 會複製 context, 共用同一個 dict
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+# 目前所在的階段, 用來標記 LLM token 屬於哪個階段
+_current_stage: ContextVar[str] = ContextVar("current_stage", default="other")
+
+
+def record_stage(name: str, seconds: float, status: str = "ok"):
+    """
+    記錄一個階段的耗時到 histogram 與目前請求的 timing。
+    """
+    STAGE_SECONDS.observe(seconds, stage=name, status=status)
+    if (timings := _request_timings.get()) is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    量測區塊的耗時, 發生例外時以 status="error" 記錄後再拋出。
+
+    :param name: 階段名稱, 例如 ner_llm、embedding、vector_search
+    """
+    token = _current_stage.set(name)
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        record_stage(name, time.perf_counter() - start, status)
+        _current_stage.reset(token)
+
+
+def current_stage() -> str:
+    """
+    :return: 目前所在的階段, 不在任何階段時為 "other"
+    """
+    return _current_stage.get()
+
+
+def export_stats(component: str, owner: str, stats: Callable[[], Dict[str, Any]]):
+    """
+    將元件的 stats() 以 gauge 匯出, 每次 render 時讀取最新的值。
+
+    :param component: 元件名稱, 例如 ner_cache、embedding_cache、completion_gate
+    :param owner: 擁有者, 例如 deployment 名稱
+    :param stats: 回傳 {stat: value} 的函式
+    """
+    for key, value in stats().items():
+        if isinstance(value, (int, float)):
+            COMPONENT_STATS.set_function(
+                lambda key=key: stats()[key], component=component, owner=owner, stat=key
+            )
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware: 記錄每個請求的耗時, 並在 debug log 輸出各階段的耗時明細。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timings: Dict[str, float] = {}
+        token = _request_timings.set(timings)
+        status = {"code": 500}
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_timings.reset(token)
+            REQUEST_SECONDS.observe(elapsed, path=scope["path"], status=str(status["code"]))
+            if logger.isEnabledFor(logging.DEBUG):
+                breakdown = " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in timings.items())
+                logger.debug(f"timing {scope['path']} total={elapsed * 1000:.1f}ms {breakdown}")
@@ -0,0 +1,131 @@
+import logging
+import threading
+from typing import Any, Callable, List, Optional, Tuple, Union
+
+import numpy as np
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryVectorIndex:
+    """
+    In-process mirror of a Chroma collection answering top-k queries with one matmul.
+
+    Embeddings are loaded into a contiguous float32 matrix. Distances follow the
+    collection's ``hnsw:space`` (squared l2, cosine or ip) exactly like Chroma
+    returns them, so the vector store's relevance score function applies unchanged.
+    The mirror is reloaded when the collection's count or metadata "version"
+    changes, checked every ``refresh_interval`` seconds in a background thread.
+    """
+
+    def __init__(self, vectorstore: Union[Chroma, Callable[[], Chroma]], refresh_interval: float = 300):
+        """
+        Args:
+            vectorstore (Union[Chroma, Callable[[], Chroma]]): The langchain Chroma vector
+                store to mirror, or a function returning the current one (it is
+                replaced when Chroma reconnects).
+            refresh_interval (float): Seconds between version checks, 0 disables the thread.
+        """
+        self.get_vectorstore = vectorstore if callable(vectorstore) else (lambda: vectorstore)
+        self.refresh_interval = refresh_interval
+        self.version: Optional[Tuple[int, Any]] = None
+        self._snapshot = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _current_version(self, vectorstore: Chroma) -> Tuple[int, Any]:
+        collection = vectorstore._client.get_collection(name=vectorstore._collection.name)
+        return collection.count(), (collection.metadata or {}).get("version")
+
+    def load(self):
+        """
+        Loads embeddings, documents and metadata of the whole collection.
+        """
+        vectorstore = self.get_vectorstore()
+        collection = vectorstore._collection
+        version = self._current_version(vectorstore)
+        data = collection.get(include=["embeddings", "documents", "metadatas"])
+        matrix = np.ascontiguousarray(np.asarray(data["embeddings"], dtype=np.float32))
+        if matrix.ndim != 2:
+            matrix = matrix.reshape(0, 0)
+        space = (collection.metadata or {}).get("hnsw:space", "l2")
+        if space == "cosine":
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix = matrix / np.where(norms == 0, 1, norms)
+
+        self._snapshot = (
+            space,
+            matrix,
+            np.einsum("ij,ij->i", matrix, matrix),
+            data["documents"],
+            [metadata or {} for metadata in data["metadatas"]],
+        )
+        self.version = version
+        logger.info(f"vector index loaded {matrix.shape[0]} vectors, version {version}")
+
+    def refresh(self) -> bool:
+        """
+        Reloads the mirror when the collection version changed.
+
+        Returns:
+            bool: True when the mirror was reloaded.
+        """
+        if self._current_version(self.get_vectorstore()) == self.version:
+            return False
+        self.load()
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"vector index refresh fail: {e}")
+
+    def start(self):
+        """
+        Loads the mirror and starts the periodic refresh thread.
+        """
+        self.load()
+        if self.refresh_interval and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="vector-index-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def search(self, embedding: List[float], k: int = 4) -> List[Tuple[Document, float]]:
+        """
+        Returns the k nearest documents with their Chroma-compatible distances.
+
+        Args:
+            embedding (List[float]): The query embedding.
+            k (int): Number of documents to return.
+
+        Returns:
+            List[Tuple[Document, float]]: Documents and distances, nearest first.
+        """
+        space, matrix, sq_norms, documents, metadatas = self._snapshot
+        if not len(documents):
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32)
+        dot = matrix @ query
+        if space == "cosine":
+            norm = np.linalg.norm(query)
+            distances = 1.0 - dot / (norm if norm else 1.0)
+        elif space == "ip":
+            distances = 1.0 - dot
+        else:
+            distances = sq_norms + query @ query - 2.0 * dot
+
+        k = min(k, len(documents))
+        top = np.argpartition(distances, k - 1)[:k] if k < len(documents) else np.arange(k)
+        top = top[np.argsort(distances[top])]
+        return [
+            (Document(page_content=documents[i], metadata=dict(metadatas[i])), float(distances[i]))
+            for i in top
+        ]
@@ -1,82 +1,182 @@
+import logging
 import os
+import threading
+from typing import Dict, Optional
 import chromadb
-from chromadb.utils import embedding_functions
+import httpx
+from chromadb.api.shared_system_client import SharedSystemClient
 from langchain_chroma import Chroma
-from langchain_openai import AzureOpenAIEmbeddings
+from app.setting.config import Settings
+from app.setting.utils_resilience import ResilientEmbeddings
+from app.gai_executors.models import create_embeddings
+
+
+logger = logging.getLogger(__name__)
 
 
 class ChromaDBClient:
+    """
+    Chroma DB 連線, 每個 process 共用一個 HTTP client (keep-alive 連線池),
+    每個集合只解析一次並快取; 請以 ChromaDBClient.get_instance 取得。
+    """
+
+    _instances: Dict[str, "ChromaDBClient"] = {}
+    _client: Optional[chromadb.HttpClient] = None
+    _lock = threading.RLock()
+
     def __init__(self, collection_name: str):
         """
-        初始化 ChromaDBClient 類別，建立與 Chroma DB 的連接並創建或取得指定的集合。
+        初始化 ChromaDBClient 類別，建立與 Chroma DB 的連接並取得指定的集合。
 
         :param collection_name: Chroma DB 集合的名稱
         """
         self.collection_name = collection_name
         self.client = self._initialize_client()
-        self.collection = self._get_or_create_collection()
+        self.embeddings = self._get_Embeddings_func()
         self.vectorstore = self._get_or_create_vectorstore()
+        self.collection = self.vectorstore._collection
 
-    def _initialize_client(self) -> chromadb.HttpClient:
+    @classmethod
+    def get_instance(cls, collection_name: str) -> "ChromaDBClient":
         """
-        初始化 Chroma DB HTTP 客戶端。
+        取得集合對應的共用 ChromaDBClient, 第一次呼叫時建立。
 
-        :return: 初始化的 Chroma DB 客戶端
+        :param collection_name: Chroma DB 集合的名稱
+        :return: 共用的 ChromaDBClient
         """
-        return chromadb.HttpClient(
-            host=os.environ["CHROMA_HOST"],
-            port=os.environ["CHROMA_PORT"],
-        )
+        if (instance := cls._instances.get(collection_name)) is not None:
+            return instance
 
-    def _get_azure_openai_ef(self) -> embedding_functions.OpenAIEmbeddingFunction:
-        """
-        取得 Azure OpenAI embedding function。
+        with cls._lock:
+            if (instance := cls._instances.get(collection_name)) is None:
+                instance = cls(collection_name)
+                cls._instances[collection_name] = instance
+        return instance
 
-        :return: Azure OpenAI embedding function
+    @classmethod
+    def _initialize_client(cls) -> chromadb.HttpClient:
         """
-        openai_ef = embedding_functions.OpenAIEmbeddingFunction(
-            api_key=os.environ["AZURE_OPENAI_EMBEDDING_API_KEY"],
-            model_name="text-embedding-3-small",
-            api_base=os.environ["AZURE_OPENAI_EMBEDDING_ENDPOINT"],
-            api_type="azure",
-            api_version=os.environ["AZURE_OPENAI_EMBEDDING_API_VERSION"],
-            deployment_id=os.environ["AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME"],
-        )
-        return openai_ef
+        初始化 (或取得已建立的) Chroma DB HTTP 客戶端。
 
-    def _get_or_create_collection(self):
+        :return: 共用的 Chroma DB 客戶端
         """
-        創建或取得指定的集合。
+        with cls._lock:
+            if cls._client is None:
+                client = chromadb.HttpClient(
+                    host=os.environ["CHROMA_HOST"],
+                    port=os.environ["CHROMA_PORT"],
+                )
+                cls._configure_session(client)
+                cls._client = client
+                logger.info("create chroma http client finish")
+            return cls._client
 
-        :return: Chroma DB 集合物件
+    @staticmethod
+    def _configure_session(client: chromadb.HttpClient):
+        """
+        以可設定 timeout 與連線池大小的 keep-alive session 取代 chromadb 預設的 session。
         """
-        return self.client.get_or_create_collection(
-            name=self.collection_name,
-            embedding_function=self._get_azure_openai_ef(),
+        server = getattr(client, "_server", None)
+        session = getattr(server, "_session", None)
+        if not isinstance(session, httpx.Client):
+            return
+
+        # chromadb 以 chroma_server_ssl_verify 建立 session 時一併沿用
+        verify = getattr(getattr(server, "_settings", None), "chroma_server_ssl_verify", None)
+        server._session = httpx.Client(
+            headers=session.headers,
+            verify=True if verify is None else verify,
+            timeout=httpx.Timeout(Settings.CHROMA_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=Settings.CHROMA_MAX_CONNECTIONS,
+                max_keepalive_connections=Settings.CHROMA_MAX_CONNECTIONS,
+                keepalive_expiry=Settings.CHROMA_KEEPALIVE_EXPIRY,
+            ),
         )
+        session.close()
 
     def _get_or_create_vectorstore(
         self
     ) -> Chroma:
-        vectordb = Chroma(
-            client=self.client,
-            collection_name=self.collection_name,
-            embedding_function=self._get_Embeddings_func(),
-        )
+        """
+        建立 vectorstore; 優先以 get_collection (唯讀) 取得集合, 不存在時才建立。
+
+        :return: Chroma vectorstore
+        """
+        try:
+            vectordb = Chroma(
+                client=self.client,
+                collection_name=self.collection_name,
+                embedding_function=self.embeddings,
+                create_collection_if_not_exists=False,
+            )
+        except Exception:
+            logger.info(f"collection {self.collection_name} not found, create it")
+            vectordb = Chroma(
+                client=self.client,
+                collection_name=self.collection_name,
+                embedding_function=self.embeddings,
+            )
         return vectordb
 
-    def _get_Embeddings_func(self) -> AzureOpenAIEmbeddings:
+    def _get_Embeddings_func(self) -> ResilientEmbeddings:
         """
-        Get the embeddings function based on the specified type.
+        取得 Azure OpenAI embeddings, 查詢與寫入共用同一個 client。
 
-        :param emb_type: Type of embeddings to use ("azure" or other).
         :return: Embeddings function.
         """
-        embeddings = AzureOpenAIEmbeddings(
-            api_key=os.environ["AZURE_OPENAI_EMBEDDING_API_KEY"],
-            azure_endpoint=os.environ["AZURE_OPENAI_EMBEDDING_ENDPOINT"],
-            azure_deployment=os.environ["AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME"],
-            openai_api_version=os.environ["AZURE_OPENAI_EMBEDDING_API_VERSION"],
-        )
-        return embeddings
+        return create_embeddings()
+
+    def heartbeat(self) -> bool:
+        """
+        檢查 Chroma DB 是否可連線。
+
+        :return: 可連線時回傳 True
+        """
+        try:
+            self.client.heartbeat()
+            return True
+        except Exception as e:
+            logger.warning(f"chroma heartbeat fail: {e}")
+            return False
 
+    def reconnect(self):
+        """
+        重建共用的 HTTP client, 並為每個集合建立新的 vectorstore 後替換 instance.vectorstore;
+        retriever 每次查詢時讀取 vectorstore, 進行中的請求繼續使用舊的物件。
+        任一集合建立失敗時不替換, 維持原本的連線。
+        """
+        with self._lock:
+            logger.info("reconnect chroma http client")
+            ChromaDBClient._client = None
+            SharedSystemClient.clear_system_cache()
+            client = self._initialize_client()
+            instances = {*self._instances.values(), self}
+            vectorstores = {
+                instance: Chroma(
+                    client=client,
+                    collection_name=instance.collection_name,
+                    embedding_function=instance.embeddings,
+                    create_collection_if_not_exists=False,
+                )
+                for instance in instances
+            }
+            for instance, vectorstore in vectorstores.items():
+                instance.client = client
+                instance.collection = vectorstore._collection
+                instance.vectorstore = vectorstore
+
+    def ensure_healthy(self) -> bool:
+        """
+        heartbeat 失敗時嘗試重新連線; 只在啟動 warm-up 時使用, readiness 只做 heartbeat。
+
+        :return: 重新檢查後是否可連線
+        """
+        if self.heartbeat():
+            return True
+        try:
+            self.reconnect()
+        except Exception as e:
+            logger.warning(f"chroma reconnect fail: {e}")
+            return False
+        return self.heartbeat()
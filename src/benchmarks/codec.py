@@ -0,0 +1,231 @@
+"""
+Microbenchmark of request decoding and response encoding per endpoint.
+
+Compares the handlers' previous path with app/schemas/codec.py, without the
+app, the network or any backend:
+
+- legacy: ``json.loads`` of the body, dict indexing, ``MWHeader``/``*TranRS``/
+  ``*Response`` construction, ``orjson.dumps(response.dict())`` and FastAPI
+  encoding the returned bytes a second time as a JSON string
+- codec: ``codec.decode`` into the request models, one assignment of TRANRS
+  and ``codec.encode`` to an ORJSONResponse
+
+Run from ``src``:
+
+    python -m benchmarks.codec --number 20000
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+from typing import Callable, Dict, List, Tuple
+
+_SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _SRC not in sys.path:
+    sys.path.insert(0, _SRC)
+
+import orjson  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from app.schemas import codec  # noqa: E402
+from app.schemas.payload import (  # noqa: E402
+    ChatBatchRequest, ChatRequest, EvaluateRequest, GenaiBatchRequest, GenaiRequest,
+)
+from app.schemas.response import (  # noqa: E402
+    ChatBatchResponse, ChatResponse, ChatTranRS, EvaluateResponse, GenaiBatchResponse, GenaiResponse,
+    GenAIResponseTranRS, MWHeader,
+)
+
+
+PAYLOADS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "payloads.json")
+HEADER = {"MSGID": None, "SOURCECHANNEL": "CHAT-API", "TXNSEQ": "bench-0"}
+IDENTITY = {"sessionId": "S00000000001", "customerId": "C000000001"}
+
+# executor 回傳的代表性結果
+CHAT_RESULT = {
+    **IDENTITY,
+    "template": {
+        "tid": "01", "blockReason": None, "startDate": "2024/04/01", "endDate": "2024/04/30",
+        "storeName": ["蝦皮", None], "categoryName": [None], "message": "請給我上個月在蝦皮的消費紀錄",
+    },
+}
+GENAI_RESULT = {
+    **IDENTITY,
+    "genAI": {"message": "我理解到您的問題是查詢消費紀錄, 以下為您整理的結果。本回答是由AI助理生成"},
+    "template": {"tid": "01", "blockReason": None},
+}
+
+
+def _legacy_header(jdata: Dict) -> MWHeader:
+    return MWHeader(
+        MSGID=jdata["MWHEADER"]["MSGID"],
+        SOURCECHANNEL=jdata["MWHEADER"]["SOURCECHANNEL"],
+        TXNSEQ=jdata["MWHEADER"]["TXNSEQ"],
+    )
+
+
+def _legacy_body(response) -> bytes:
+    # handler 回傳 bytes, FastAPI 以 jsonable_encoder 轉成字串後再 JSON 編碼一次
+    return JSONResponse(jsonable_encoder(orjson.dumps(response.dict()))).body
+
+
+def _single(response_cls, tranrs_cls, request_cls, result):
+    def legacy_decode(body):
+        jdata = json.loads(body)
+        response_cls()
+        return jdata, _legacy_header(jdata)
+
+    def legacy_encode(state):
+        jdata, mwheader = state
+        return _legacy_body(response_cls(MWHEADER=mwheader, TRANRS=tranrs_cls(**result)))
+
+    def codec_decode(body):
+        response = response_cls()
+        codec.decode(body, request_cls, response)
+        return response
+
+    def codec_encode(response):
+        response.TRANRS = tranrs_cls(**result)
+        return codec.encode(response).body
+
+    return (legacy_decode, legacy_encode), (codec_decode, codec_encode)
+
+
+def _evaluate():
+    def legacy_decode(body):
+        jdata = json.loads(body)
+        response = EvaluateResponse()
+        response.MWHEADER.MSGID = jdata["MWHEADER"]["MSGID"]
+        response.MWHEADER.SOURCECHANNEL = jdata["MWHEADER"]["SOURCECHANNEL"]
+        response.MWHEADER.TXNSEQ = jdata["MWHEADER"]["TXNSEQ"]
+        response.TRANRS.sessionId = jdata["TRANRQ"]["sessionId"]
+        response.TRANRS.customerId = jdata["TRANRQ"]["customerId"]
+        return response
+
+    def codec_decode(body):
+        response = EvaluateResponse()
+        rq = codec.decode(body, EvaluateRequest, response)
+        response.TRANRS = response.TRANRS.model_construct(
+            sessionId=rq.TRANRQ.sessionId, customerId=rq.TRANRQ.customerId
+        )
+        return response
+
+    return (legacy_decode, _legacy_body), (codec_decode, lambda response: codec.encode(response).body)
+
+
+def _batch(batch_cls, response_cls, tranrs_cls, request_cls, result):
+    def item(mwheader, value):
+        return response_cls(MWHEADER=mwheader.model_copy(), TRANRS=tranrs_cls(**value))
+
+    def legacy_decode(body):
+        jdata = json.loads(body)
+        batch_cls()
+        return jdata, _legacy_header(jdata)
+
+    def legacy_encode(state):
+        jdata, mwheader = state
+        items = [item(mwheader, result) for _ in jdata["TRANRQ"]]
+        return _legacy_body(batch_cls(MWHEADER=mwheader, TRANRS=items))
+
+    def codec_decode(body):
+        response = batch_cls()
+        _, items = codec.decode_batch(body, request_cls, response, max_items=1000)
+        return response, items
+
+    def codec_encode(state):
+        response, items = state
+        response.TRANRS = [item(response.MWHEADER, result) for _ in items]
+        return codec.encode(response).body
+
+    return (legacy_decode, legacy_encode), (codec_decode, codec_encode)
+
+
+def build_cases(batch_size: int) -> Dict[str, Tuple[bytes, Tuple, Tuple]]:
+    """
+    :return: {endpoint: (request body, (legacy decode, encode), (codec decode, encode))}
+    """
+    with open(PAYLOADS, encoding="utf-8") as f:
+        payloads = json.load(f)
+
+    def body(tranrq) -> bytes:
+        return orjson.dumps({"MWHEADER": HEADER, "TRANRQ": tranrq})
+
+    chat = {**IDENTITY, **payloads["chat"][0]}
+    genai = {**IDENTITY, **payloads["genai"][0]}
+    evaluate = {**IDENTITY, **payloads["evaluate"][0]}
+    return {
+        "chat": (body(chat), *_single(ChatResponse, ChatTranRS, ChatRequest, CHAT_RESULT)),
+        "genai-response": (body(genai), *_single(GenaiResponse, GenAIResponseTranRS, GenaiRequest, GENAI_RESULT)),
+        "evaluate": (body(evaluate), *_evaluate()),
+        "chat:batch": (
+            body([chat] * batch_size),
+            *_batch(ChatBatchResponse, ChatResponse, ChatTranRS, ChatBatchRequest, CHAT_RESULT),
+        ),
+        "genai-response:batch": (
+            body([genai] * batch_size),
+            *_batch(GenaiBatchResponse, GenaiResponse, GenAIResponseTranRS, GenaiBatchRequest, GENAI_RESULT),
+        ),
+    }
+
+
+def _time(func: Callable, number: int, repeat: int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e6
+
+
+def run(number: int, repeat: int, batch_size: int) -> List[Dict]:
+    results = []
+    for endpoint, (body, (legacy_decode, legacy_encode), (codec_decode, codec_encode)) in build_cases(batch_size).items():
+        legacy_state = legacy_decode(body)
+        codec_state = codec_decode(body)
+        legacy_out, codec_out = legacy_encode(legacy_state), codec_encode(codec_state)
+        # 兩條路徑的內容必須一致, legacy 多包了一層字串
+        assert json.loads(json.loads(legacy_out)) == json.loads(codec_out), endpoint
+
+        row = {
+            "endpoint": endpoint,
+            "legacy_decode_us": _time(lambda: legacy_decode(body), number, repeat),
+            "codec_decode_us": _time(lambda: codec_decode(body), number, repeat),
+            "legacy_encode_us": _time(lambda: legacy_encode(legacy_decode(body)), number, repeat),
+            "codec_encode_us": _time(lambda: codec_encode(codec_decode(body)), number, repeat),
+            "legacy_bytes": len(legacy_out),
+            "codec_bytes": len(codec_out),
+        }
+        # encode 的量測包含 decode, 扣掉後才是 encode 本身
+        row["legacy_encode_us"] -= row["legacy_decode_us"]
+        row["codec_encode_us"] -= row["codec_decode_us"]
+        row["speedup"] = (row["legacy_decode_us"] + row["legacy_encode_us"]) / (
+            row["codec_decode_us"] + row["codec_encode_us"]
+        )
+        results.append({key: round(value, 2) if isinstance(value, float) else value for key, value in row.items()})
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=5000, help="calls per timing")
+    parser.add_argument("--repeat", type=int, default=5, help="timings per measurement, the best is kept")
+    parser.add_argument("--batch-size", type=int, default=20, help="items per request on the :batch endpoints")
+    parser.add_argument("--json", help="write the results to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run(args.number, args.repeat, args.batch_size)
+    columns = [
+        ("endpoint", 22), ("legacy_decode_us", 17), ("codec_decode_us", 16), ("legacy_encode_us", 17),
+        ("codec_encode_us", 16), ("legacy_bytes", 13), ("codec_bytes", 12), ("speedup", 8),
+    ]
+    print(" ".join(name.rjust(width) for name, width in columns))
+    for row in results:
+        print(" ".join(str(row[name]).rjust(width) for name, width in columns))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
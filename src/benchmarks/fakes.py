@@ -0,0 +1,322 @@
+"""
+Deterministic local replacements for Azure OpenAI, Chroma and Postgres.
+
+``install()`` must run before ``app.main`` is imported: the executors bind
+``AzureChatOpenAI`` / ``AzureOpenAIEmbeddings`` at import time and the
+SQLAlchemy engine is created when ``app.db.conn`` is imported.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+COLLECTION_NAME = "collect_cubelab_qa_lite"
+
+FAKE_ENV = {
+    "DB_USER": "bench",
+    "DB_PWD": "bench",
+    "DB_DSN": "localhost:5432/bench",
+    "TRACKING_SERVER_URI": f"file://{tempfile.gettempdir()}/qblab-bench-mlruns",
+    "AZURE_OPENAI_API_KEY": "bench",
+    "AZURE_OPENAI_ENDPOINT": "http://localhost",
+    "AZURE_OPENAI_API_VERSION": "2024-02-01",
+    "AZURE_OPENAI_CHAT_DEPLOYMENT_NAME": "bench-chat",
+    "AZURE_OPENAI_EMBEDDING_API_KEY": "bench",
+    "AZURE_OPENAI_EMBEDDING_ENDPOINT": "http://localhost",
+    "AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME": "bench-embedding",
+    "AZURE_OPENAI_EMBEDDING_API_VERSION": "2024-02-01",
+    "CHROMA_HOST": "localhost",
+    "CHROMA_PORT": "8000",
+}
+
+# 向量庫的標準問題與對應的 metadata
+QA_DOCUMENTS = [
+    ("請給我[時間]在[商戶]的消費紀錄", "01", "商戶消費明細"),
+    ("請給我[時間]在[類別]的消費紀錄", "02", "類別消費明細"),
+    ("[時間]我在[商戶]總共花了多少錢", "03", "商戶消費總額"),
+    ("[時間]我在[類別]總共花了多少錢", "04", "類別消費總額"),
+    ("[時間]消費金額最高的是哪一筆", "05", "最高消費"),
+    ("[時間]我最常在哪裡消費", "06", "消費次數排行"),
+]
+
+
+@dataclass
+class Latency:
+    """
+    Simulated latency of one backend in seconds: mean plus uniform jitter,
+    and with probability ``stall_rate`` a stall of ``stall`` seconds instead
+    (a degraded provider region).
+    """
+
+    mean: float = 0.0
+    jitter: float = 0.0
+    rng: random.Random = field(default_factory=lambda: random.Random(0))
+    stall_rate: float = 0.0
+    stall: float = 0.0
+
+    def sample(self) -> float:
+        if self.stall_rate and self.rng.random() < self.stall_rate:
+            return self.stall
+        if not self.mean and not self.jitter:
+            return 0.0
+        return max(0.0, self.mean + self.rng.uniform(-self.jitter, self.jitter))
+
+    def sleep(self):
+        if delay := self.sample():
+            time.sleep(delay)
+
+    async def asleep(self):
+        if delay := self.sample():
+            await asyncio.sleep(delay)
+
+
+class RateLimitError(Exception):
+    """
+    Stand-in for ``openai.RateLimitError``: same ``status_code`` and
+    ``response.headers`` as the real exception.
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__("429 Too Many Requests")
+        self.status_code = 429
+        self.response = SimpleNamespace(headers={"retry-after-ms": str(max(1, int(retry_after * 1000)))})
+
+
+class Quota:
+    """
+    Per-deployment requests-per-minute quota. Like Azure OpenAI it is
+    enforced over short windows (rpm / 60 per second), so a burst above the
+    rate gets 429 rather than waiting for the minute to roll over.
+    """
+
+    def __init__(self, rpm: int = 0):
+        self.rpm = rpm
+        self._windows: Dict[str, List[int]] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, deployment: str):
+        if not self.rpm:
+            return
+        now = time.monotonic()
+        second = int(now)
+        with self._lock:
+            window = self._windows.setdefault(deployment, [second, 0])
+            if window[0] != second:
+                window[:] = [second, 0]
+            if window[1] >= max(1, self.rpm // 60):
+                CONFIG.calls["throttled"] += 1
+                raise RateLimitError(second + 1 - now)
+            window[1] += 1
+
+
+@dataclass
+class FakeConfig:
+    llm: Latency = field(default_factory=Latency)
+    embedding: Latency = field(default_factory=Latency)
+    chroma: Latency = field(default_factory=Latency)
+    db: Latency = field(default_factory=Latency)
+    quota: Quota = field(default_factory=Quota)
+    stream_chunk_chars: int = 4
+    calls: Dict[str, int] = field(
+        default_factory=lambda: {"ner": 0, "completion": 0, "genai": 0, "embedding": 0, "throttled": 0}
+    )
+
+
+CONFIG = FakeConfig()
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 2)
+
+
+def _answer(prompt: str) -> str:
+    """
+    依 prompt 內容回傳固定格式的答案, 與真實 LLM 的輸出格式一致。
+    """
+    if "命名實體" in prompt:
+        CONFIG.calls["ner"] += 1
+        question = prompt.rsplit("用戶問題:", 1)[-1].split("命名實體:")[0].strip()
+        merchant = re.search(r"在\s*([^\s的，,]+?)\s*(的|消費|花)", question)
+        return json.dumps(
+            {
+                "modify_query": "請給我[時間]在[商戶]的消費紀錄" if merchant else "請給我[時間]在[類別]的消費紀錄",
+                "&start_date": "2024/04/01",
+                "&end_date": "2024/04/30",
+                "&string1": merchant.group(1) if merchant else None,
+                "&category1": None if merchant else "餐飲",
+            },
+            ensure_ascii=False,
+        )
+    if "智能問句補完" in prompt:
+        CONFIG.calls["completion"] += 1
+        return prompt.rsplit("user_input:", 1)[-1].strip()
+    CONFIG.calls["genai"] += 1
+    return "我理解到您的問題是查詢消費紀錄, 以下為您整理的結果。本回答是由AI助理生成"
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    取代 AzureChatOpenAI, 接受相同的建構參數; 只使用 azure_deployment 來套用配額。
+    """
+
+    azure_deployment: str = ""
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(callbacks=kwargs.get("callbacks"), azure_deployment=kwargs.get("azure_deployment") or "")
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-azure-chat"
+
+    @staticmethod
+    def _result(prompt: str) -> ChatResult:
+        text = _answer(prompt)
+        usage = {
+            "prompt_tokens": _estimate_tokens(prompt),
+            "completion_tokens": _estimate_tokens(text),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=text))],
+            llm_output={"token_usage": usage, "model_name": "fake"},
+        )
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        CONFIG.quota.acquire(self.azure_deployment)
+        CONFIG.llm.sleep()
+        return self._result(messages[-1].content)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        CONFIG.quota.acquire(self.azure_deployment)
+        await CONFIG.llm.asleep()
+        return self._result(messages[-1].content)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        CONFIG.quota.acquire(self.azure_deployment)
+        text = _answer(messages[-1].content)
+        await CONFIG.llm.asleep()
+        size = CONFIG.stream_chunk_chars
+        for i in range(0, len(text), size):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text[i:i + size]))
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    取代 AzureOpenAIEmbeddings, 以文字的 hash 產生固定的單位向量。
+    """
+
+    dimension = 64
+
+    def __init__(self, **kwargs: Any):
+        pass
+
+    def _vector(self, text: str) -> List[float]:
+        digest = hashlib.sha512(text.encode("utf-8")).digest()
+        vector = [byte / 255 - 0.5 for byte in digest[: self.dimension]]
+        norm = sum(x * x for x in vector) ** 0.5
+        return [x / norm for x in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        CONFIG.embedding.sleep()
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        CONFIG.calls["embedding"] += 1
+        CONFIG.embedding.sleep()
+        return self._vector(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        CONFIG.calls["embedding"] += 1
+        await CONFIG.embedding.asleep()
+        return self._vector(text)
+
+
+def _seed_collection(client):
+    collection = client.get_or_create_collection(COLLECTION_NAME)
+    if collection.count() == 0:
+        documents = [question for question, _, _ in QA_DOCUMENTS]
+        collection.add(
+            ids=[str(i) for i in range(len(documents))],
+            documents=documents,
+            embeddings=FakeEmbeddings().embed_documents(documents),
+            metadatas=[
+                {"SQL1": f"select {i}", "SQL2": "", "SQL3": "", "問題類別": name, "category": category}
+                for i, (_, category, name) in enumerate(QA_DOCUMENTS)
+            ],
+        )
+
+
+def _install_chroma():
+    import chromadb
+    from chromadb.api.models.Collection import Collection
+
+    client = chromadb.EphemeralClient()
+    _seed_collection(client)
+    chromadb.HttpClient = lambda **kwargs: client
+
+    query = Collection.query
+
+    def slow_query(self, *args, **kwargs):
+        CONFIG.chroma.sleep()
+        return query(self, *args, **kwargs)
+
+    Collection.query = slow_query
+
+
+def _install_sqlite(path: str):
+    import sqlalchemy
+    from sqlalchemy import event
+
+    create_engine = sqlalchemy.create_engine
+
+    def sqlite_engine(url, **kwargs):
+        kwargs.pop("connect_args", None)
+        engine = create_engine(
+            f"sqlite:///{path}",
+            connect_args={"check_same_thread": False, "timeout": 30},
+            **kwargs,
+        )
+        event.listen(engine, "before_cursor_execute", lambda *args: CONFIG.db.sleep())
+        return engine
+
+    sqlalchemy.create_engine = sqlite_engine
+
+
+def install(config: Optional[FakeConfig] = None, db_path: Optional[str] = None) -> FakeConfig:
+    """
+    安裝所有 fake; 需在 import app.main 之前呼叫。
+
+    :param config: 各 backend 的延遲設定
+    :param db_path: SQLite 檔案, 預設建立在暫存目錄
+    :return: 生效的設定, calls 欄位會累計各 fake 被呼叫的次數
+    """
+    global CONFIG
+    if config is not None:
+        CONFIG = config
+    for key, value in FAKE_ENV.items():
+        os.environ.setdefault(key, value)
+
+    import langchain_openai
+
+    langchain_openai.AzureChatOpenAI = FakeChatModel
+    langchain_openai.AzureOpenAIEmbeddings = FakeEmbeddings
+    _install_chroma()
+    if db_path is None:
+        db_path = os.path.join(tempfile.mkdtemp(prefix="qblab-bench-"), "bench.sqlite")
+    _install_sqlite(db_path)
+    return CONFIG
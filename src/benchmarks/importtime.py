@@ -0,0 +1,120 @@
+"""
+Import-time benchmark of app.main.
+
+Runs ``python -X importtime -c "import app.main"`` in fresh interpreters,
+reports the median cumulative import time and the slowest top-level
+modules, and exits non-zero when the median exceeds ``--budget`` (default
+BUDGET_SECONDS) or when a module that must stay lazy is imported. Run from
+``src``:
+
+    python -m benchmarks.importtime --repeat 5
+
+tests/test_importtime.py runs the same checks under pytest.
+
+Only the settings come from benchmarks/fakes.py (FAKE_ENV); nothing is
+patched, so the numbers are those of a real worker start.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+from benchmarks.fakes import FAKE_ENV
+
+
+_SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 只在第一次使用時載入的模組, 出現在 import app.main 中即視為退化
+LAZY_MODULES = ["mlflow", "langchain_openai", "langchain_community", "chromadb", "openai", "uvicorn"]
+
+# import app.main 目前約 1.0-1.5 秒, 預留機器差異; 延遲載入退化時 (約 4.5 秒) 會超過
+BUDGET_SECONDS = float(os.environ.get("IMPORT_TIME_BUDGET", "2.5"))
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """
+    解析 -X importtime 的輸出。
+
+    :return: [(module, depth, cumulative us)], 依 import 完成的順序; 最外層的 depth 為 0
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), depth, int(cumulative)))
+    return rows
+
+
+def measure(module: str) -> List[Tuple[str, int, int]]:
+    env = {**FAKE_ENV, **os.environ}
+    env["PYTHONPATH"] = os.pathsep.join([_SRC, os.path.join(_SRC, "app"), env.get("PYTHONPATH", "")])
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=_SRC,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr[-2000:]}")
+    return parse_importtime(completed.stderr)
+
+
+def summarize(runs: List[List[Tuple[str, int, int]]], module: str, top: int) -> Dict:
+    totals = [next(us for name, depth, us in rows if name == module and depth == 0) for rows in runs]
+    # 以 app.main 直接 import 的模組 (depth 1) 為單位, 取各次的中位數
+    children: Dict[str, List[int]] = {}
+    for rows in runs:
+        for name, depth, us in rows:
+            if depth == 1:
+                children.setdefault(name, []).append(us)
+    slowest = sorted(((statistics.median(us), name) for name, us in children.items()), reverse=True)[:top]
+    imported = {name.split(".")[0] for name, _, _ in runs[0]}
+    return {
+        "module": module,
+        "median_seconds": round(statistics.median(totals) / 1e6, 3),
+        "min_seconds": round(min(totals) / 1e6, 3),
+        "slowest": [{"module": name, "seconds": round(us / 1e6, 3)} for us, name in slowest],
+        "lazy_violations": sorted(imported & set(LAZY_MODULES)),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="slowest direct imports to show")
+    parser.add_argument("--budget", type=float, default=BUDGET_SECONDS, help="fail when the median exceeds this, 0 to skip")
+    parser.add_argument("--json", help="write the summary to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    summary = summarize([measure(args.module) for _ in range(args.repeat)], args.module, args.top)
+
+    print(f"import {summary['module']}: median {summary['median_seconds']}s, min {summary['min_seconds']}s")
+    for item in summary["slowest"]:
+        print(f"  {item['seconds']:>7.3f}s  {item['module']}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+    failed = False
+    if summary["lazy_violations"]:
+        print(f"FAIL: imported at startup but expected lazy: {', '.join(summary['lazy_violations'])}")
+        failed = True
+    if args.budget and summary["median_seconds"] > args.budget:
+        print(f"FAIL: median {summary['median_seconds']}s exceeds budget {args.budget}s")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
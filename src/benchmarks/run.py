@@ -0,0 +1,297 @@
+"""
+In-process replay benchmark of app.main:app.
+
+The Azure OpenAI, Chroma and Postgres backends are replaced by the fakes in
+benchmarks/fakes.py, so the numbers measure the service's own overhead plus
+the simulated backend latency. Run from ``src``:
+
+    python -m benchmarks.run --requests 200 --concurrency 16 --llm-latency 0.2
+
+Settings are read from the environment at import, ``--env`` sets them for a
+run, e.g. sequential vs overlapped completion/NER:
+
+    python -m benchmarks.run --endpoints chat --llm-latency 0.2 --env CHAIN_OVERLAP_NER=false
+    python -m benchmarks.run --endpoints chat --llm-latency 0.2 --env CHAIN_OVERLAP_NER=true
+
+``--llm-stall-rate`` makes a fraction of LLM calls hang for ``--llm-stall``
+seconds, to compare tail latency under provider degradation, e.g. with and
+without a hedge deployment:
+
+    python -m benchmarks.run --endpoints genai-response --llm-latency 0.2 --llm-stall-rate 0.05 --llm-stall 20
+    python -m benchmarks.run --endpoints genai-response --llm-latency 0.2 --llm-stall-rate 0.05 --llm-stall 20 \
+        --env AZURE_OPENAI_CHAT_HEDGE_DEPLOYMENT_NAME=bench-chat-2 LLM_HEDGE_DELAY=0.5
+
+``--deployment-rpm`` gives every chat deployment a quota (enforced per
+second, answering 429 above it), to compare throughput as deployments are
+added to the router:
+
+    python -m benchmarks.run --endpoints genai-response --llm-latency 0.05 --deployment-rpm 1200 --concurrency 32
+    python -m benchmarks.run --endpoints genai-response --llm-latency 0.05 --deployment-rpm 1200 --concurrency 32 \
+        --env 'AZURE_OPENAI_CHAT_DEPLOYMENTS=[{"deployment": "bench-chat-1"}, {"deployment": "bench-chat-2"}]'
+
+Overload against the same quota, without and with admission control
+(``ok/s`` counts only successful responses):
+
+    python -m benchmarks.run --endpoints genai-response --llm-latency 0.05 --deployment-rpm 1200 --concurrency 128 \
+        --env ADMISSION_MAX_CONCURRENCY=0
+    python -m benchmarks.run --endpoints genai-response --llm-latency 0.05 --deployment-rpm 1200 --concurrency 128 \
+        --env ADMISSION_TOKENS_PER_MINUTE=420000 ADMISSION_TOKEN_BURST=3600 ADMISSION_MAX_WAIT=1
+
+Each endpoint is measured twice: a timed pass for throughput and latency
+percentiles, and a shorter pass under tracemalloc (kept separate because
+tracing slows allocation-heavy code several times). The traced pass reports
+the peak of traced memory and the memory still retained per request
+afterwards (caches, chat history, leaks).
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+_SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (_SRC, os.path.join(_SRC, "app")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from benchmarks import fakes  # noqa: E402
+
+
+PAYLOADS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "payloads.json")
+PREFIX = "/api/card-consumption"
+ENDPOINTS = ["chat", "genai-response", "genai-response/stream", "evaluate", "chat:batch", "genai-response:batch"]
+
+
+@dataclass
+class Result:
+    endpoint: str
+    requests: int
+    errors: int
+    seconds: float
+    throughput: float
+    goodput: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    first_byte_p50_ms: float
+    retained_kib_per_request: Optional[float] = None
+    peak_kib: Optional[float] = None
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _header(i: int) -> Dict[str, Any]:
+    return {"MSGID": None, "SOURCECHANNEL": "CHAT-API", "TXNSEQ": f"bench-{i}"}
+
+
+def build_requests(payloads: Dict[str, List[Dict]], batch_size: int) -> Dict[str, Callable[[int, int], Dict]]:
+    """
+    依 endpoint 建立請求產生器; worker 以自己的 session 依序重播對話, 讓 chat history 逐輪成長。
+
+    :return: {endpoint: f(i, worker) -> request body}
+    """
+
+    def identity(worker: int) -> Dict[str, str]:
+        return {"sessionId": f"S{worker:011d}", "customerId": f"C{worker:09d}"}
+
+    def chat(i, worker):
+        item = payloads["chat"][i % len(payloads["chat"])]
+        return {"MWHEADER": _header(i), "TRANRQ": {**identity(worker), **item}}
+
+    def genai(i, worker):
+        item = payloads["genai"][i % len(payloads["genai"])]
+        return {"MWHEADER": _header(i), "TRANRQ": {**identity(worker), **item}}
+
+    def evaluate(i, worker):
+        item = payloads["evaluate"][i % len(payloads["evaluate"])]
+        return {"MWHEADER": _header(i), "TRANRQ": {**identity(worker), **item}}
+
+    def batch(single):
+        def build(i, worker):
+            items = [single(i * batch_size + j, worker * batch_size + j)["TRANRQ"] for j in range(batch_size)]
+            return {"MWHEADER": _header(i), "TRANRQ": items}
+        return build
+
+    return {
+        "chat": chat,
+        "genai-response": genai,
+        "genai-response/stream": genai,
+        "evaluate": evaluate,
+        "chat:batch": batch(chat),
+        "genai-response:batch": batch(genai),
+    }
+
+
+def _is_error(status: int, body: bytes, stream: bool) -> bool:
+    if status != 200:
+        return True
+    if stream:
+        # 錯誤碼在最後的 end frame
+        _, sep, body = body.rpartition(b"event: end\ndata: ")
+        if not sep:
+            return True
+    data = json.loads(body)
+    return data.get("MWHEADER", {}).get("RETURNCODE") not in (None, "0000")
+
+
+async def _drive(client, endpoint: str, build: Callable, requests: int, concurrency: int):
+    latencies: List[float] = []
+    first_bytes: List[float] = []
+    errors = 0
+    counter = iter(range(requests))
+    stream = endpoint.endswith("/stream")
+
+    async def worker(worker_id: int):
+        nonlocal errors
+        for i in counter:
+            body = build(i, worker_id)
+            start = time.perf_counter()
+            first = None
+            chunks = []
+            async with client.stream("POST", f"{PREFIX}/{endpoint}", json=body) as response:
+                async for chunk in response.aiter_bytes():
+                    if first is None:
+                        first = time.perf_counter() - start
+                    chunks.append(chunk)
+            latencies.append(time.perf_counter() - start)
+            first_bytes.append(first if first is not None else latencies[-1])
+            if _is_error(response.status_code, b"".join(chunks), stream):
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    return latencies, first_bytes, errors, time.perf_counter() - start
+
+
+async def run(args) -> List[Result]:
+    import httpx
+    from app.main import app
+    from app.db.conn import sqlalchemy_engine
+    from app.db.model import Base
+
+    Base.metadata.create_all(bind=sqlalchemy_engine)
+    with open(PAYLOADS, encoding="utf-8") as f:
+        builders = build_requests(json.load(f), args.batch_size)
+
+    results = []
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for endpoint in args.endpoints:
+                build = builders[endpoint]
+                await _drive(client, endpoint, build, args.warmup, args.concurrency)
+
+                gc.collect()
+                latencies, first_bytes, errors, seconds = await _drive(
+                    client, endpoint, build, args.requests, args.concurrency
+                )
+                result = Result(
+                    endpoint=endpoint,
+                    requests=len(latencies),
+                    errors=errors,
+                    seconds=round(seconds, 3),
+                    throughput=round(len(latencies) / seconds, 1),
+                    goodput=round((len(latencies) - errors) / seconds, 1),
+                    p50_ms=round(_percentile(latencies, 0.50) * 1000, 2),
+                    p95_ms=round(_percentile(latencies, 0.95) * 1000, 2),
+                    p99_ms=round(_percentile(latencies, 0.99) * 1000, 2),
+                    first_byte_p50_ms=round(statistics.median(first_bytes) * 1000, 2) if first_bytes else 0.0,
+                )
+
+                if args.alloc_requests:
+                    gc.collect()
+                    tracemalloc.start()
+                    await _drive(client, endpoint, build, args.alloc_requests, args.concurrency)
+                    gc.collect()
+                    retained, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+                    result.retained_kib_per_request = round(retained / 1024 / args.alloc_requests, 2)
+                    result.peak_kib = round(peak / 1024, 1)
+
+                results.append(result)
+    return results
+
+
+def _print(results: List[Result], config: fakes.FakeConfig):
+    columns = [
+        ("endpoint", 24), ("requests", 8), ("errors", 6), ("req/s", 8), ("ok/s", 8), ("p50 ms", 8),
+        ("p95 ms", 8), ("p99 ms", 8), ("ttfb ms", 8), ("ret KiB/req", 11), ("peak KiB", 9),
+    ]
+    print(" ".join(name.rjust(width) for name, width in columns))
+    for r in results:
+        values = [
+            r.endpoint, r.requests, r.errors, r.throughput, r.goodput, r.p50_ms, r.p95_ms, r.p99_ms,
+            r.first_byte_p50_ms, r.retained_kib_per_request, r.peak_kib,
+        ]
+        print(" ".join(str("-" if v is None else v).rjust(width) for v, (_, width) in zip(values, columns)))
+    print(f"backend calls: {config.calls}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", nargs="+", default=ENDPOINTS, choices=ENDPOINTS)
+    parser.add_argument("--requests", type=int, default=200, help="timed requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=4, help="items per request on the :batch endpoints")
+    parser.add_argument("--alloc-requests", type=int, default=50, help="requests traced by tracemalloc, 0 to skip")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds per LLM call")
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="seconds per embedding call")
+    parser.add_argument("--chroma-latency", type=float, default=0.0, help="seconds per Chroma query")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="seconds per SQL statement")
+    parser.add_argument("--llm-stall-rate", type=float, default=0.0, help="fraction of LLM calls that stall")
+    parser.add_argument("--llm-stall", type=float, default=30.0, help="seconds a stalled LLM call hangs")
+    parser.add_argument("--deployment-rpm", type=int, default=0, help="requests per minute each chat deployment accepts before 429, 0 for no quota")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform jitter as a fraction of each latency")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--env", nargs="*", default=[], metavar="KEY=VALUE", help="settings for this run")
+    parser.add_argument("--json", help="write the results to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    for item in args.env:
+        key, _, value = item.partition("=")
+        os.environ[key] = value
+
+    def latency(mean: float, offset: int) -> fakes.Latency:
+        return fakes.Latency(mean, mean * args.jitter, fakes.random.Random(args.seed + offset))
+
+    config = fakes.install(
+        fakes.FakeConfig(
+            llm=fakes.Latency(
+                args.llm_latency,
+                args.llm_latency * args.jitter,
+                fakes.random.Random(args.seed),
+                stall_rate=args.llm_stall_rate,
+                stall=args.llm_stall,
+            ),
+            embedding=latency(args.embedding_latency, 1),
+            chroma=latency(args.chroma_latency, 2),
+            db=latency(args.db_latency, 3),
+            quota=fakes.Quota(args.deployment_rpm),
+        )
+    )
+    results = asyncio.run(run(args))
+    _print(results, config)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": [asdict(r) for r in results]}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
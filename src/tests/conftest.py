@@ -0,0 +1,17 @@
+"""
+Tests run from ``src`` against the same local fakes as the benchmarks:
+Azure OpenAI, Chroma and Postgres are replaced before any app module is
+imported, so no network or credentials are needed.
+"""
+
+import os
+import sys
+
+_SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (_SRC, os.path.join(_SRC, "app")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from benchmarks import fakes  # noqa: E402
+
+fakes.install()
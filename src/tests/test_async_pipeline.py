@@ -0,0 +1,49 @@
+"""
+Load test against the stubbed LLM: the async path keeps many LLM calls in
+flight on one event loop instead of serializing them.
+"""
+
+import asyncio
+import time
+
+from benchmarks import fakes
+
+from app.gai_executors.gai_response import GenAIResponse
+
+LATENCY = 0.1
+
+
+def _item(i: int) -> dict:
+    return {
+        "sessionId": f"S{i}",
+        "customerId": "C1",
+        "tid": "01",
+        "message": f"上個月在商戶{i}的消費",
+        "consumptionNumber": "3",
+        "totalAmount": "1200",
+        "storeName": [f"商戶{i}"],
+        "categoryName": [],
+    }
+
+
+def _elapsed(concurrency: int) -> float:
+    genai_response = GenAIResponse()
+
+    async def run():
+        start = time.perf_counter()
+        results = await asyncio.gather(*(genai_response.agenerate_answer(**_item(i)) for i in range(concurrency)))
+        assert all(result["genAI"]["message"] for result in results)
+        return time.perf_counter() - start
+
+    return asyncio.run(run())
+
+
+def test_concurrent_calls_overlap(monkeypatch):
+    monkeypatch.setattr(fakes.CONFIG, "llm", fakes.Latency(LATENCY))
+
+    single = _elapsed(1)
+    many = _elapsed(200)
+
+    # 200 個 LLM 呼叫依序執行需要 20 秒; 同時進行時只多了 chain 本身的開銷
+    assert single >= LATENCY
+    assert many < LATENCY * 200 / 10
@@ -0,0 +1,97 @@
+import asyncio
+
+from langchain_core.runnables import RunnableLambda
+
+from app.gai_executors.chain_ner import ChainNer
+
+TIME = "2024-05-10"
+
+
+class _Gate:
+    def __init__(self, reason):
+        self.reason = reason
+
+    def check(self, user_input, messages):
+        return self.reason
+
+
+class _History:
+    def __init__(self, events):
+        self.events = events
+        self.added = []
+
+    async def aget_messages(self):
+        return []
+
+    async def aadd_messages(self, messages):
+        self.events.append("history_start")
+        await asyncio.sleep(0.05)
+        self.added.extend(messages)
+        self.events.append("history_end")
+
+
+def _chain_ner(reason, completed="上個月在蝦皮的消費"):
+    """
+    以 stub 取代 LLM 與對話歷史, 記錄各步驟的先後與 NER 收到的問句。
+    """
+    events = []
+    questions = []
+
+    async def complete(inputs):
+        events.append("completion_start")
+        await asyncio.sleep(0.05)
+        events.append("completion_end")
+        return completed
+
+    async def ner(inputs):
+        events.append("ner_start")
+        questions.append(inputs["question"])
+        await asyncio.sleep(0.05)
+        events.append("ner_end")
+        return {"keys": {}, "retriever": {}}
+
+    chain = ChainNer.__new__(ChainNer)
+    chain.completion_gate = _Gate(reason)
+    chain.history = _History(events)
+    chain.aget_chat_history = lambda session_id: chain.history
+    chain.achian_completeion = RunnableLambda(lambda inputs: completed, afunc=complete)
+    chain.chain_ner = RunnableLambda(lambda inputs: None, afunc=ner)
+    chain.ner_overlap = {"overlapped": 0, "sequential": 0}
+    return chain, events, questions
+
+
+def test_ner_runs_once_after_completion():
+    chain, events, questions = _chain_ner(None)
+
+    completed, result = asyncio.run(chain._acomplete_with_ner("那蝦皮呢", "S1", TIME))
+
+    assert completed == "上個月在蝦皮的消費"
+    assert result is not None
+    # 需要補完時不先以原問句啟動 NER, 每個請求只有一次 NER
+    assert questions == ["上個月在蝦皮的消費"]
+    assert events.index("ner_start") > events.index("completion_end")
+    assert chain.ner_overlap == {"overlapped": 0, "sequential": 1}
+
+
+def test_ner_overlaps_history_write_when_gate_skips():
+    chain, events, questions = _chain_ner("no history")
+
+    completed, result = asyncio.run(chain._acomplete_with_ner("上個月在蝦皮的消費", "S1", TIME))
+
+    assert completed == "上個月在蝦皮的消費"
+    assert result is not None
+    assert questions == ["上個月在蝦皮的消費"]
+    assert "completion_start" not in events
+    assert events.index("ner_start") < events.index("history_end")
+    assert len(chain.history.added) == 2
+    assert chain.ner_overlap == {"overlapped": 1, "sequential": 0}
+
+
+def test_blocked_completion_skips_ner():
+    chain, events, questions = _chain_ner(None, completed="問句被阻擋")
+
+    completed, result = asyncio.run(chain._acomplete_with_ner("那蝦皮呢", "S1", TIME))
+
+    assert completed == "問句被阻擋"
+    assert result is None
+    assert questions == []
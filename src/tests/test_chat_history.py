@@ -0,0 +1,179 @@
+import asyncio
+import time
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from sqlalchemy import event
+from sqlalchemy.engine import create_engine  # sqlalchemy.create_engine 被 fakes 換成共用的 SQLite
+
+from app.db.chat_history import TABLE_NAME, SQLChatHistory, _converter
+from app.setting.utils_cache import InMemoryBackend
+from app.setting.utils_token import estimate_message_tokens
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'history.sqlite'}")
+    yield engine
+    engine.dispose()
+
+
+def _history(engine, session_id="S1", **kwargs) -> SQLChatHistory:
+    return SQLChatHistory(
+        session_id=session_id,
+        connection=engine,
+        table_name=TABLE_NAME,
+        custom_message_converter=_converter,
+        **kwargs,
+    )
+
+
+def _turns(n: int, text: str = "上個月在蝦皮的消費"):
+    messages = []
+    for i in range(n):
+        messages += [HumanMessage(content=f"{text} {i}"), AIMessage(content=f"回答 {i}")]
+    return messages
+
+
+def test_window_keeps_last_max_messages(engine):
+    _history(engine).add_messages(_turns(10))
+
+    messages = _history(engine, max_messages=6).messages
+
+    assert [m.content for m in messages] == ["上個月在蝦皮的消費 7", "回答 7", "上個月在蝦皮的消費 8", "回答 8",
+                                             "上個月在蝦皮的消費 9", "回答 9"]
+
+
+def test_window_starts_with_user_message(engine):
+    _history(engine).add_messages(_turns(3))
+
+    messages = _history(engine, max_messages=3).messages
+
+    assert isinstance(messages[0], HumanMessage)
+    assert [m.content for m in messages] == ["上個月在蝦皮的消費 2", "回答 2"]
+
+
+def test_window_trims_oldest_by_max_tokens(engine):
+    _history(engine).add_messages(_turns(10))
+    budget = estimate_message_tokens(_turns(10)[-4:])
+
+    messages = _history(engine, max_tokens=budget).messages
+
+    assert estimate_message_tokens(messages) <= budget
+    assert [m.content for m in messages] == ["上個月在蝦皮的消費 8", "回答 8", "上個月在蝦皮的消費 9", "回答 9"]
+
+
+def test_sessions_are_isolated(engine):
+    _history(engine, "S1").add_messages(_turns(2))
+    _history(engine, "S2").add_messages(_turns(1, "其他"))
+
+    assert len(_history(engine, "S1").messages) == 4
+    assert [m.content for m in _history(engine, "S2").messages] == ["其他 0", "回答 0"]
+
+
+def test_reads_stay_bounded_as_session_grows(engine):
+    """
+    讀取只取最後 max_messages 筆, SQL 回傳的筆數與訊息數不隨 session 長度成長。
+    """
+    selects = _selects(engine)
+
+    writer = _history(engine)
+    sizes = []
+    for _ in range(5):
+        writer.add_messages(_turns(40))
+        history = _history(engine, max_messages=20)
+        sizes.append(len(history.messages))
+
+    assert sizes == [20] * 5
+    assert selects and all("LIMIT" in statement.upper() for statement in selects)
+
+
+def _selects(engine):
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement)
+                 if statement.lstrip().upper().startswith("SELECT") else None)
+    return statements
+
+
+def test_cache_serves_next_turn_with_version_check_only(engine):
+    cache = InMemoryBackend(maxsize=10)
+    history = _history(engine, max_messages=4, cache=cache)
+    history.add_messages(_turns(1))
+    assert len(history.messages) == 2
+
+    selects = _selects(engine)
+    history.add_messages(_turns(2)[2:])
+    messages = _history(engine, max_messages=4, cache=cache).messages
+
+    assert [m.content for m in messages][-2:] == ["上個月在蝦皮的消費 1", "回答 1"]
+    # 只查詢版本 (count, max id), 不重新載入訊息
+    assert len(selects) == 1 and "count" in selects[0].lower() and "LIMIT" not in selects[0].upper()
+
+
+def test_cache_sees_turns_written_by_another_worker(engine):
+    worker_a = InMemoryBackend(maxsize=10)
+    worker_b = InMemoryBackend(maxsize=10)
+    _history(engine, cache=worker_a).add_messages(_turns(1))
+    assert len(_history(engine, cache=worker_a).messages) == 2
+
+    # 下一輪被分到另一個 worker
+    _history(engine, cache=worker_b).add_messages(_turns(2)[2:])
+    assert len(_history(engine, cache=worker_b).messages) == 4
+
+    assert [m.content for m in _history(engine, cache=worker_a).messages] == [m.content for m in _turns(2)]
+
+
+def test_write_through_after_concurrent_write_reloads(engine):
+    worker_a = InMemoryBackend(maxsize=10)
+    _history(engine, cache=worker_a).add_messages(_turns(1))
+    assert len(_history(engine, cache=worker_a).messages) == 2
+
+    # 其他 worker 先寫入, 接著 worker_a 以 write-through 附加自己的訊息
+    _history(engine).add_messages([HumanMessage(content="其他 worker")])
+    _history(engine, cache=worker_a).add_messages([AIMessage(content="worker_a")])
+
+    contents = [m.content for m in _history(engine, cache=worker_a).messages]
+    assert contents[-2:] == ["其他 worker", "worker_a"]
+
+
+def test_async_engine_cache_is_versioned(tmp_path):
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'history.sqlite'}")
+    cache_a, cache_b = InMemoryBackend(maxsize=10), InMemoryBackend(maxsize=10)
+
+    async def run():
+        await _history(engine, cache=cache_a).aadd_messages(_turns(1))
+        assert len(await _history(engine, cache=cache_a).aget_messages()) == 2
+        await _history(engine, cache=cache_b).aadd_messages(_turns(2)[2:])
+        messages = await _history(engine, cache=cache_a).aget_messages()
+        await engine.dispose()
+        return messages
+
+    assert len(asyncio.run(run())) == 4
+
+
+def test_async_reads_do_not_block_the_event_loop(engine, monkeypatch):
+    """
+    同步 engine 的讀取在 thread pool 執行: 多個 session 同時讀取的總時間接近單次讀取的時間。
+    """
+    for i in range(8):
+        _history(engine, f"S{i}").add_messages(_turns(2))
+    original = SQLChatHistory.messages.fget
+
+    def slow_messages(self):
+        time.sleep(0.2)
+        return original(self)
+
+    monkeypatch.setattr(SQLChatHistory, "messages", property(slow_messages))
+
+    async def read_all():
+        start = time.perf_counter()
+        results = await asyncio.gather(*(_history(engine, f"S{i}").aget_messages() for i in range(8)))
+        return time.perf_counter() - start, results
+
+    seconds, results = asyncio.run(read_all())
+
+    assert all(len(messages) == 4 for messages in results)
+    assert seconds < 0.2 * 8 / 2
@@ -0,0 +1,73 @@
+import asyncio
+
+from app.gai_executors.gai_response import GenAIResponse
+
+ARGS = dict(
+    sessionId="S1",
+    customerId="C1",
+    tid="01",
+    message="上個月在蝦皮的消費",
+    consumptionNumber="3",
+    totalAmount="1200",
+    storeName=["蝦皮"],
+    categoryName=[],
+)
+
+
+class _StubChain:
+    """
+    逐段回傳 chunks 的 chain, 記錄上游串流送出的段數與是否被關閉。
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.sent = 0
+        self.closed = False
+
+    async def astream(self, inputs):
+        try:
+            for chunk in self.chunks:
+                self.sent += 1
+                yield chunk
+                await asyncio.sleep(0)
+        finally:
+            self.closed = True
+
+
+def _stream(chain):
+    genai_response = GenAIResponse()
+    genai_response.chain = chain
+
+    async def collect():
+        events = []
+        async for event, data in genai_response.astream_answer(**ARGS):
+            events.append((event, data))
+            if event == "end":
+                # 在 end 當下檢查, 不依賴 event loop 結束時才回收的 async generator
+                closed_at_end.append(chain.closed)
+        return events
+
+    closed_at_end = []
+    return asyncio.run(collect()), closed_at_end[0]
+
+
+def test_stream_yields_whole_answer():
+    chain = _StubChain(["以下為", "您整理的", "結果。"])
+
+    events, closed = _stream(chain)
+
+    assert "".join(data for event, data in events if event == "token") == "以下為您整理的結果。"
+    assert events[-1][1]["genAI"]["message"] == "以下為您整理的結果。"
+    assert closed
+
+
+def test_block_marker_closes_upstream_stream():
+    chain = _StubChain(["很抱歉", "您的問題被", "阻擋", "了"] + ["後續內容"] * 100)
+
+    events, closed = _stream(chain)
+
+    # 偵測到 BLOCK_MARKER 後立即關閉上游, 不再消耗 token
+    assert closed
+    assert chain.sent == 3
+    assert events[-1][1]["template"]["tid"] == "98"
+    assert all("被阻擋" not in data for event, data in events if event == "token")
@@ -0,0 +1,40 @@
+from benchmarks import importtime
+
+MODULE = "app.main"
+
+
+def test_app_main_import_stays_within_budget_and_lazy():
+    summary = importtime.summarize(
+        [importtime.measure(MODULE) for _ in range(5)], MODULE, top=10
+    )
+
+    assert summary["lazy_violations"] == [], summary
+    # 以最快的一次比較, 避免機器忙碌時 (冷快取、並行測試) 的雜訊; 延遲載入退化時每次都會超過
+    assert summary["min_seconds"] <= importtime.BUDGET_SECONDS, summary
+
+
+def test_lazy_modules_are_reported():
+    stderr = "\n".join([
+        "import time: self [us] | cumulative | imported package",
+        "import time:       100 |        100 |     openai._types",
+        "import time:       200 |        300 |   openai",
+        "import time:       400 |        400 |   fastapi",
+        "import time:       500 |       1200 | app.main",
+    ])
+    rows = importtime.parse_importtime(stderr)
+
+    assert rows[-1] == ("app.main", 0, 1200)
+    assert ("openai", 1, 300) in rows
+
+    summary = importtime.summarize([rows], MODULE, top=10)
+    assert summary["lazy_violations"] == ["openai"]
+    assert summary["median_seconds"] == 0.001
+    assert summary["slowest"][0] == {"module": "fastapi", "seconds": 0.0}
+
+
+def test_main_fails_over_budget(monkeypatch):
+    rows = [("app.main", 0, 3_000_000)]
+    monkeypatch.setattr(importtime, "measure", lambda module: rows)
+
+    assert importtime.main(["--repeat", "1", "--budget", "2.5"]) == 1
+    assert importtime.main(["--repeat", "1", "--budget", "0"]) == 0
@@ -0,0 +1,27 @@
+import asyncio
+import logging
+
+from app import main
+
+
+def test_autolog_failure_is_logged(monkeypatch, caplog):
+    def configure_autolog():
+        raise RuntimeError("tracking server down")
+
+    monkeypatch.setattr(main, "configure_autolog", configure_autolog)
+    monkeypatch.setattr(main.Settings, "MLFLOW_AUTOLOG", True)
+    monkeypatch.setattr(main.Settings, "WARMUP_ENABLED", False)
+    monkeypatch.setattr(main.Settings, "EVALUATION_WRITE_BEHIND", False)
+    monkeypatch.setattr(main.telemetry_exporter, "start", lambda: None)
+    monkeypatch.setattr(main.telemetry_exporter, "close", lambda timeout=None: None)
+    monkeypatch.setattr(main.evaluation_writer, "close", lambda timeout=None: None)
+    monkeypatch.setattr(main, "shutdown_logging", lambda: None)
+
+    async def run():
+        async with main.lifespan(main.app):
+            await asyncio.sleep(0.1)
+
+    with caplog.at_level(logging.WARNING, logger=main.logger.name):
+        asyncio.run(run())
+
+    assert "RuntimeError: tracking server down" in caplog.text
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from sqlalchemy.engine import create_engine
+
+from app import health
+from app.gai_executors import registry
+from app.health import HealthMonitor
+
+
+@pytest.fixture
+def slow_build(monkeypatch):
+    """
+    以會阻塞的假 build 取代 ChainNer / GenAIResponse 的建立, 由 release 放行。
+    """
+    release = threading.Event()
+    builds = []
+
+    def get_chain_ner(collection_name, engine, deployment=None, async_engine=None):
+        builds.append(("chain_ner", collection_name))
+        release.wait(5)
+        if not release.is_set():
+            raise RuntimeError("not released")
+        chain_ner = object()
+        registry._chain_ners[(collection_name, deployment)] = chain_ner
+        return chain_ner
+
+    def get_genai_response(deployment=None):
+        builds.append(("genai_response", deployment))
+        genai_response = object()
+        registry._genai_responses[deployment] = genai_response
+        return genai_response
+
+    monkeypatch.setattr(registry, "get_chain_ner", get_chain_ner)
+    monkeypatch.setattr(registry, "get_genai_response", get_genai_response)
+    registry.clear()
+    yield release, builds
+    release.set()
+    registry.clear()
+
+
+def test_build_does_not_block_the_event_loop(slow_build):
+    release, builds = slow_build
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while not release.is_set():
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        tasks = [asyncio.ensure_future(registry.aget_chain_ner("c", engine=None)) for _ in range(5)]
+        ticking = asyncio.ensure_future(ticker())
+        await asyncio.sleep(0.2)
+        release.set()
+        results = await asyncio.gather(*tasks)
+        await ticking
+        return ticks, results
+
+    ticks, results = asyncio.run(run())
+
+    # 建立期間 event loop 持續執行, 同時的呼叫共用同一次建立
+    assert ticks >= 10
+    assert builds == [("chain_ner", "c")]
+    assert len({id(result) for result in results}) == 1
+
+
+def test_cancelled_caller_does_not_stop_the_build(slow_build):
+    release, builds = slow_build
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(registry.aget_chain_ner("c", engine=None), 0.05)
+        release.set()
+        return await registry.aget_chain_ner("c", engine=None)
+
+    chain_ner = asyncio.run(run())
+
+    assert chain_ner is not None
+    assert builds == [("chain_ner", "c")]
+
+
+def test_failed_build_is_retried(slow_build, monkeypatch):
+    release, builds = slow_build
+    monkeypatch.setattr(release, "wait", lambda timeout: None)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await registry.aget_chain_ner("c", engine=None)
+        release.set()
+        return await registry.aget_chain_ner("c", engine=None)
+
+    assert asyncio.run(run()) is not None
+    assert len(builds) == 2
+
+
+def test_readiness_waits_for_pipelines(slow_build, monkeypatch):
+    release, builds = slow_build
+    monkeypatch.setattr(HealthMonitor, "_check_chroma", lambda self, reconnect=False: True)
+    monitor = HealthMonitor(create_engine("sqlite://"), collection_name="c", check_ttl=0, check_timeout=0.05)
+    monitor.skip_warm_up()
+
+    async def run():
+        # 未執行 warm-up 時由 readiness 在背景建立, 建立完成前回報 fail
+        assert (await monitor.readiness())["status"] == "fail"
+        assert monitor.dependencies["pipelines"]["status"] == "fail"
+        release.set()
+        for _ in range(50):
+            if (report := await monitor.readiness())["status"] == "ok":
+                return report
+            await asyncio.sleep(0.02)
+        return report
+
+    report = asyncio.run(run())
+
+    assert report["status"] == "ok"
+    assert builds.count(("chain_ner", "c")) == 1
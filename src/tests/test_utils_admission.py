@@ -0,0 +1,265 @@
+import asyncio
+import contextlib
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.setting import utils_admission
+from app.setting.exceptions import ServiceBusyError
+from app.setting.utils_admission import AdmissionController, TokenBucket, parse_endpoint_limits
+
+
+async def _hold(controller, endpoint="chat", seconds=0.0):
+    async with controller.admit(endpoint):
+        await asyncio.sleep(seconds)
+
+
+def _idle(controller):
+    assert controller._in_flight == 0
+    assert all(count == 0 for count in controller._endpoint_in_flight.values())
+    assert not controller._queue
+
+
+def test_admits_up_to_the_limit_then_queues_in_order():
+    controller = AdmissionController(max_concurrency=2, max_queue=10, max_wait=1)
+    order = []
+
+    async def request(i):
+        async with controller.admit("chat"):
+            order.append(i)
+            await asyncio.sleep(0.01)
+
+    async def run():
+        await asyncio.gather(*(request(i) for i in range(6)))
+
+    asyncio.run(run())
+
+    assert order == list(range(6))
+    _idle(controller)
+
+
+def test_queue_full_is_shed():
+    controller = AdmissionController(max_concurrency=1, max_queue=1, max_wait=1)
+
+    async def run():
+        async with controller.admit("chat"):
+            waiting = asyncio.ensure_future(_hold(controller))
+            await asyncio.sleep(0)
+            with pytest.raises(ServiceBusyError, match="queue_full"):
+                async with controller.admit("chat"):
+                    pass
+            waiting.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await waiting
+
+    asyncio.run(run())
+    _idle(controller)
+
+
+def test_timeout_is_shed_and_leaves_the_queue():
+    controller = AdmissionController(max_concurrency=1, max_queue=10, max_wait=0.05)
+
+    async def run():
+        async with controller.admit("chat"):
+            with pytest.raises(ServiceBusyError, match="timeout"):
+                async with controller.admit("chat"):
+                    pass
+            assert not controller._queue
+        # 逾時的請求不佔名額, 之後的請求可以直接進入
+        async with controller.admit("chat"):
+            assert controller._in_flight == 1
+
+    asyncio.run(run())
+    _idle(controller)
+
+
+def test_slot_handed_over_at_timeout_is_released(monkeypatch):
+    """
+    等候逾時的同時, 前一個請求結束並把名額交給等候者; 等候者被拒絕時要歸還名額。
+    """
+    controller = AdmissionController(max_concurrency=1, max_queue=10, max_wait=1)
+    holder = contextlib.AsyncExitStack()
+
+    async def wait_for(future, timeout):
+        await holder.aclose()
+        assert future.done() and not future.cancelled()
+        raise asyncio.TimeoutError
+
+    async def run():
+        await holder.enter_async_context(controller.admit("chat"))
+        monkeypatch.setattr(utils_admission.asyncio, "wait_for", wait_for)
+        with pytest.raises(ServiceBusyError, match="timeout"):
+            async with controller.admit("chat"):
+                pass
+
+    asyncio.run(run())
+    _idle(controller)
+
+
+def test_cancelled_while_waiting_leaves_the_queue():
+    controller = AdmissionController(max_concurrency=1, max_queue=10, max_wait=1)
+
+    async def run():
+        async with controller.admit("chat"):
+            waiting = asyncio.ensure_future(_hold(controller))
+            await asyncio.sleep(0)
+            assert len(controller._queue) == 1
+            waiting.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiting
+            assert not controller._queue
+
+    asyncio.run(run())
+    _idle(controller)
+
+
+def test_cancelled_after_admission_releases_the_slot():
+    controller = AdmissionController(max_concurrency=1, max_queue=10, max_wait=1)
+
+    async def run():
+        holder = contextlib.AsyncExitStack()
+        await holder.enter_async_context(controller.admit("chat"))
+        waiting = asyncio.ensure_future(_hold(controller))
+        await asyncio.sleep(0)
+        # 名額交給等候者後, 等候者在恢復執行前被取消
+        await holder.aclose()
+        assert controller._in_flight == 1
+        waiting.cancel()
+        # Python 3.11 以前的 wait_for 在 future 已完成時會忽略取消, 兩種結果都要歸還名額
+        with contextlib.suppress(asyncio.CancelledError):
+            await waiting
+
+    asyncio.run(run())
+    _idle(controller)
+
+
+def test_error_inside_the_block_releases_the_slot():
+    controller = AdmissionController(max_concurrency=1, max_queue=10, max_wait=1)
+
+    async def run():
+        with pytest.raises(ValueError):
+            async with controller.admit("chat"):
+                raise ValueError
+        async with controller.admit("chat"):
+            pass
+
+    asyncio.run(run())
+    _idle(controller)
+
+
+def test_endpoint_limit_does_not_block_other_endpoints():
+    controller = AdmissionController(
+        max_concurrency=4, endpoint_limits={"chat": 1}, max_queue=10, max_wait=1
+    )
+    order = []
+
+    async def request(endpoint, delay):
+        async with controller.admit(endpoint):
+            order.append(endpoint)
+            await asyncio.sleep(delay)
+
+    async def run():
+        await asyncio.gather(
+            request("chat", 0.05), request("chat", 0.01), request("genai-response", 0.01)
+        )
+
+    asyncio.run(run())
+
+    # 等待 chat 名額的請求不擋住 genai-response
+    assert order == ["chat", "genai-response", "chat"]
+    _idle(controller)
+
+
+def test_batch_slots_are_capped_by_the_limits():
+    controller = AdmissionController(max_concurrency=8, endpoint_limits={"chat-batch": 4})
+
+    async def run():
+        async with controller.admit("chat-batch", slots=16):
+            assert controller._in_flight == 4
+
+    asyncio.run(run())
+    _idle(controller)
+
+
+def test_token_bucket_refills(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(utils_admission, "time", SimpleNamespace(monotonic=lambda: clock[0]))
+    bucket = TokenBucket(rate=10, capacity=20)
+
+    assert bucket.try_take(15)
+    assert not bucket.try_take(10)
+    assert bucket.delay(10) == pytest.approx(0.5)
+    clock[0] += 0.5
+    assert bucket.try_take(10)
+    clock[0] += 60
+    assert bucket.level() == 20
+
+
+def test_waits_for_tokens():
+    # 每秒 10 個 token, 容量 10
+    controller = AdmissionController(tokens_per_minute=600, burst_tokens=10, max_queue=10, max_wait=2)
+    admitted = []
+
+    async def request(tokens):
+        async with controller.admit("chat", tokens=tokens):
+            admitted.append(time.monotonic())
+
+    async def run():
+        start = time.monotonic()
+        await request(10)
+        await request(5)
+        return start
+
+    start = asyncio.run(run())
+
+    assert admitted[0] - start < 0.1
+    assert admitted[1] - start == pytest.approx(0.5, abs=0.1)
+    _idle(controller)
+
+
+def test_large_request_is_not_starved_by_small_ones():
+    controller = AdmissionController(tokens_per_minute=600, burst_tokens=10, max_queue=10, max_wait=2)
+    order = []
+
+    async def request(name, tokens):
+        async with controller.admit("chat", tokens=tokens):
+            order.append(name)
+
+    async def run():
+        await request("first", 10)
+        await asyncio.gather(request("large", 8), request("small", 1))
+
+    asyncio.run(run())
+
+    assert order == ["first", "large", "small"]
+
+
+def test_tokens_over_capacity_are_capped():
+    controller = AdmissionController(tokens_per_minute=600, burst_tokens=10, max_queue=10, max_wait=0.1)
+
+    async def run():
+        async with controller.admit("chat", tokens=1000):
+            pass
+
+    asyncio.run(run())
+    assert controller.bucket.level() < 1
+
+
+def test_token_timeout_is_shed():
+    controller = AdmissionController(tokens_per_minute=60, burst_tokens=10, max_queue=10, max_wait=0.05)
+
+    async def run():
+        async with controller.admit("chat", tokens=10):
+            pass
+        with pytest.raises(ServiceBusyError, match="timeout"):
+            async with controller.admit("chat", tokens=10):
+                pass
+
+    asyncio.run(run())
+    _idle(controller)
+
+
+def test_parse_endpoint_limits():
+    assert parse_endpoint_limits("chat=48, genai-response=32,") == {"chat": 48, "genai-response": 32}
+    assert parse_endpoint_limits("") == {}
@@ -0,0 +1,156 @@
+import asyncio
+import fnmatch
+import sys
+import threading
+import time
+
+import pytest
+
+from app.setting.utils_cache import InMemoryBackend, NerCache, RedisBackend, normalize_question
+
+RESULT = {"modify_query": "請給我[時間]在[商戶]的消費紀錄", "&string1": "蝦皮"}
+
+
+class _FakeRedis:
+    """
+    只實作 RedisBackend 用到的指令, key 與真實 client 一樣是 bytes。
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key.encode())
+
+    def set(self, key, value, ex=None):
+        self.data[key.encode()] = value.encode()
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key if isinstance(key, bytes) else key.encode(), None)
+
+    def scan_iter(self, match):
+        return [key for key in list(self.data) if fnmatch.fnmatchcase(key.decode(), match)]
+
+
+def _redis_backend() -> RedisBackend:
+    backend = RedisBackend.__new__(RedisBackend)
+    backend.client = _FakeRedis()
+    backend.ttl = None
+    backend.prefix = "qblab:"
+    return backend
+
+
+def test_normalize_question():
+    assert normalize_question("  上個月在 蝦皮 的消費？ ") == normalize_question("上個月在 蝦皮 的消費")
+    assert normalize_question("ＡＢＣ") == "abc"
+
+
+def test_lru_eviction_and_ttl():
+    backend = InMemoryBackend(maxsize=2, ttl=0.05)
+    backend.set("a", 1)
+    backend.set("b", 2)
+    assert backend.get("a") == 1
+    backend.set("c", 3)
+
+    assert backend.get("b") is None
+    assert backend.evictions == 1
+    time.sleep(0.06)
+    assert backend.get("a") is None
+
+
+def _today(day="2024/05/10"):
+    clock = [day]
+    return clock, lambda: clock[0]
+
+
+def test_exact_hit_is_per_reference_date():
+    _, today = _today()
+    cache = NerCache(InMemoryBackend(), today=today)
+    cache.set("上個月在蝦皮的消費", "2024/05/10", RESULT)
+
+    assert cache.get("上個月在蝦皮的消費？", "2024/05/10")[0] == RESULT
+    assert cache.get("上個月在蝦皮的消費", "2024/05/11")[0] is None
+
+
+@pytest.mark.parametrize("backend", [InMemoryBackend(), _redis_backend()], ids=["memory", "redis"])
+def test_new_day_purges_every_older_date(backend):
+    # 共用的 backend 可能留有前幾天的項目, 不只是前一天
+    for day in ("2024/05/07", "2024/05/08", "2024/05/09"):
+        backend.set(f"ner:{day}:上個月在蝦皮的消費", RESULT)
+    backend.set("other:2024/05/08", 1)
+    clock, today = _today("2024/05/09")
+    cache = NerCache(backend, today=today)
+    cache.get("上個月在蝦皮的消費", "2024/05/09")
+    assert backend.get("ner:2024/05/09:上個月在蝦皮的消費") == RESULT
+
+    clock[0] = "2024/05/10"
+    cache.get("上個月在蝦皮的消費", "2024/05/10")
+    cache.set("上個月在蝦皮的消費", "2024/05/10", RESULT)
+    cache.get("本月的消費", "2024/05/10")
+
+    for day in ("2024/05/07", "2024/05/08", "2024/05/09"):
+        assert backend.get(f"ner:{day}:上個月在蝦皮的消費") is None
+    assert backend.get("other:2024/05/08") == 1
+    assert cache.get("上個月在蝦皮的消費", "2024/05/10")[0] == RESULT
+
+
+@pytest.mark.parametrize("backend", [InMemoryBackend(), _redis_backend()], ids=["memory", "redis"])
+def test_client_reference_date_does_not_purge(backend):
+    _, today = _today()
+    cache = NerCache(backend, today=today)
+    cache.set("上個月在蝦皮的消費", "2024/05/10", RESULT)
+    cache.get("上個月在蝦皮的消費", "2024/05/10")
+
+    # 用戶端送來的日期只決定 key, 未來或過去的日期都不會清除今天的項目
+    cache.get("上個月在蝦皮的消費", "2099/01/01")
+    cache.set("上個月在蝦皮的消費", "2099/01/01", RESULT)
+    cache.get("上個月在蝦皮的消費", "2024/05/09")
+
+    assert cache.get("上個月在蝦皮的消費", "2024/05/10")[0] == RESULT
+    assert cache.get("上個月在蝦皮的消費", "2099/01/01")[0] == RESULT
+
+
+def test_purge_runs_once_per_day():
+    backend = InMemoryBackend()
+    purges = []
+    delete_prefix = backend.delete_prefix
+    backend.delete_prefix = lambda prefix, keep=None: (purges.append(keep), delete_prefix(prefix, keep))
+    clock, today = _today()
+    cache = NerCache(backend, today=today)
+
+    for _ in range(3):
+        cache.get("上個月在蝦皮的消費", "2024/05/10")
+    clock[0] = "2024/05/11"
+    cache.get("上個月在蝦皮的消費", "2024/05/11")
+    # 伺服器時間倒退 (例如校時) 不回頭清除
+    clock[0] = "2024/05/10"
+    cache.get("上個月在蝦皮的消費", "2024/05/10")
+
+    assert purges == ["ner:2024/05/10:", "ner:2024/05/11:"]
+
+
+def test_async_purge_of_blocking_backend_runs_off_the_loop():
+    backend = _redis_backend()
+    backend.set("ner:2024/05/09:上個月在蝦皮的消費", RESULT)
+    threads = []
+    delete_prefix = backend.delete_prefix
+    backend.delete_prefix = lambda prefix, keep=None: (threads.append(threading.get_ident()), delete_prefix(prefix, keep))
+    _, today = _today()
+    cache = NerCache(backend, today=today)
+
+    async def run():
+        await cache.aget("上個月在蝦皮的消費", "2024/05/10")
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+
+    assert threads and threads[0] != loop_thread
+    assert backend.get("ner:2024/05/09:上個月在蝦皮的消費") is None
+
+
+def test_redis_backend_without_package_is_a_config_error(monkeypatch):
+    monkeypatch.setitem(sys.modules, "redis", None)
+
+    with pytest.raises(RuntimeError, match="NER_CACHE_BACKEND=memory"):
+        RedisBackend("redis://localhost:6379/0")
@@ -0,0 +1,163 @@
+"""
+PROMPT_QUESTION_NER 日期規則的範例, 以及 resolver 必須交回 LLM 處理的情況。
+"""
+
+import re
+from datetime import date
+
+import pytest
+
+from app.setting.utils_date import find_date_expressions, resolve_date_range
+
+
+# (基準日, 問句, 起日, 迄日), 依 prompt 中規則的編號排列
+PROMPT_EXAMPLES = [
+    # 2. 基準日 2024/05/01 為 2024 第 18 週, 去年星期二是 2023 第 18 週的星期二
+    ("2024-05-01", "去年星期二的消費", "2023/05/02", "2023/05/02"),
+    # 3.1 上個 / 去: 前一個完整週期
+    ("2024-05-01", "上個月在蝦皮的消費", "2024/04/01", "2024/04/30"),
+    ("2024-05-01", "去年在蝦皮的消費", "2023/01/01", "2023/12/31"),
+    # 3.2 這個 / 本 / 今: 當前週期, 迄日為基準日
+    ("2024-06-07", "今年在蝦皮的消費", "2024/01/01", "2024/06/07"),
+    ("2024-06-07", "這個月在蝦皮的消費", "2024/06/01", "2024/06/07"),
+    ("2024-06-01", "本月在蝦皮的消費", "2024/06/01", "2024/06/01"),
+    # 4. 過去三個月
+    ("2024-04-20", "過去三個月在蝦皮的消費", "2024/02/01", "2024/04/20"),
+    # 5.1 過去 n 週: 基準日所在的週算作第一週
+    ("2024-05-01", "過去1週在蝦皮的消費", "2024/04/28", "2024/05/01"),
+    ("2024-05-01", "過去2週在蝦皮的消費", "2024/04/21", "2024/05/01"),
+    ("2024-05-01", "過去2周在蝦皮的消費", "2024/04/21", "2024/05/01"),
+    # 5.2 過去 n 個月: 基準日所在的月算作第一月
+    ("2024-05-01", "過去1個月在蝦皮的消費", "2024/05/01", "2024/05/01"),
+    ("2024-05-01", "過去2個月在蝦皮的消費", "2024/04/01", "2024/05/01"),
+    ("2024-05-01", "過去2月在蝦皮的消費", "2024/04/01", "2024/05/01"),
+    ("2024-05-01", "過去兩個月在蝦皮的消費", "2024/04/01", "2024/05/01"),
+    # 6. 本週: 週日至基準日
+    ("2024-05-01", "本週在蝦皮的消費", "2024/04/28", "2024/05/01"),
+    # 7. 前天
+    ("2024-05-01", "前天在蝦皮的消費", "2024/04/29", "2024/04/29"),
+    # 8. 去年的這一週: 去年同週數
+    ("2024-05-01", "去年的這一週在蝦皮的消費", "2023/04/30", "2023/05/06"),
+    # 9. 上週一 / 上週二: 上星期的該日
+    ("2024-05-01", "上週一在蝦皮的消費", "2024/04/22", "2024/04/22"),
+    ("2024-05-01", "上週二在蝦皮的消費", "2024/04/23", "2024/04/23"),
+    # 10. 昨天: 基準日前 1 天
+    ("2024-05-01", "昨天在蝦皮的消費", "2024/04/30", "2024/04/30"),
+    # 11. 去年同期: 去年的基準日當天
+    ("2024-02-01", "去年同期在蝦皮的消費", "2023/02/01", "2023/02/01"),
+    # 12. 特定日期: 忽略「期間」、「內」, 起迄日同一天
+    ("2024-03-04", "去年8/1在蝦皮的消費", "2023/08/01", "2023/08/01"),
+    ("2024-03-04", "去年8/1期間在蝦皮的消費", "2023/08/01", "2023/08/01"),
+    ("2024-03-04", "去年8/1內在蝦皮的消費", "2023/08/01", "2023/08/01"),
+    # 13. 季
+    ("2024-05-10", "Q1在蝦皮的消費", "2024/01/01", "2024/03/31"),
+    ("2024-05-10", "第二季度在蝦皮的消費", "2024/04/01", "2024/06/30"),
+    ("2024-05-10", "去年Q3在蝦皮的消費", "2023/07/01", "2023/09/30"),
+    ("2024-05-10", "去年第四季在蝦皮的消費", "2023/10/01", "2023/12/31"),
+]
+
+# 未指定年份、晚於基準日的月份 / 日期 / 季取去年; 2/29 與跨年的週
+EDGE_CASES = [
+    ("2024-05-10", "12月在蝦皮的消費", "2023/12/01", "2023/12/31"),
+    ("2024-05-10", "十二月在蝦皮的消費", "2023/12/01", "2023/12/31"),
+    ("2024-05-10", "5月在蝦皮的消費", "2024/05/01", "2024/05/31"),
+    ("2024-05-10", "4月在蝦皮的消費", "2024/04/01", "2024/04/30"),
+    ("2024-05-10", "今年12月在蝦皮的消費", "2024/12/01", "2024/12/31"),
+    ("2024-03-04", "8/1在蝦皮的消費", "2023/08/01", "2023/08/01"),
+    ("2024-03-04", "3/4在蝦皮的消費", "2024/03/04", "2024/03/04"),
+    ("2024-03-04", "3月5號在蝦皮的消費", "2023/03/05", "2023/03/05"),
+    ("2024-05-10", "Q4在蝦皮的消費", "2023/10/01", "2023/12/31"),
+    ("2024-05-10", "第三季在蝦皮的消費", "2023/07/01", "2023/09/30"),
+    # 2/29
+    ("2024-03-01", "2/29在蝦皮的消費", "2024/02/29", "2024/02/29"),
+    ("2025-03-01", "2/29在蝦皮的消費", "2024/02/29", "2024/02/29"),
+    ("2025-03-01", "2024/2/29在蝦皮的消費", "2024/02/29", "2024/02/29"),
+    ("2024-02-29", "去年同期在蝦皮的消費", "2023/02/28", "2023/02/28"),
+    ("2024-02-29", "昨天在蝦皮的消費", "2024/02/28", "2024/02/28"),
+    ("2024-03-01", "上個月在蝦皮的消費", "2024/02/01", "2024/02/29"),
+    # 第 53 週: 去年的第 53 週只有 12/31 在去年
+    ("2024-12-31", "去年星期日在蝦皮的消費", "2023/12/31", "2023/12/31"),
+    ("2024-12-28", "去年的這一週在蝦皮的消費", "2023/12/24", "2023/12/30"),
+]
+
+# 換算結果不合理, 交回 LLM
+UNRESOLVABLE = [
+    ("2024-05-10", "過去0天在蝦皮的消費"),
+    ("2024-05-10", "過去0個月在蝦皮的消費"),
+    ("2024-05-10", "最近零週在蝦皮的消費"),
+    ("2024-12-31", "去年的這一週在蝦皮的消費"),
+    ("2024-12-31", "去年星期二在蝦皮的消費"),
+    ("2024-05-10", "2023/2/29在蝦皮的消費"),
+    ("2024-05-10", "2/30在蝦皮的消費"),
+]
+
+# 規則只比對到時間描述的一部分, 換算結果一定是錯的, 必須交回 LLM
+PARTIAL_EXPRESSIONS = [
+    "上上個月在蝦皮的消費",
+    "上上週在蝦皮的消費",
+    "今年上半年在蝦皮的消費",
+    "去年下半年在蝦皮的消費",
+    "上個月初在蝦皮的消費",
+    "上個月底在蝦皮的消費",
+    "上個月中在蝦皮的消費",
+    "上週末在蝦皮的消費",
+    "上個月10號在蝦皮的消費",
+    "上個月三號在蝦皮的消費",
+    "去年季末在蝦皮的消費",
+    "13月在蝦皮的消費",
+]
+
+
+@pytest.mark.parametrize("reference, question, start, end", PROMPT_EXAMPLES)
+def test_prompt_examples(reference, question, start, end):
+    assert resolve_date_range(question, reference) == (start, end)
+
+
+@pytest.mark.parametrize("reference, question, start, end", EDGE_CASES)
+def test_edge_cases(reference, question, start, end):
+    assert resolve_date_range(question, reference) == (start, end)
+
+
+@pytest.mark.parametrize("reference, question", UNRESOLVABLE)
+def test_unresolvable_falls_back_to_llm(reference, question):
+    assert resolve_date_range(question, reference) is None
+
+
+@pytest.mark.parametrize("reference", ["2024-01-01", "2024-02-29", "2024-05-10", "2024-12-31", "2025-01-01"])
+@pytest.mark.parametrize(
+    "question",
+    [question for _, question, _, _ in PROMPT_EXAMPLES + EDGE_CASES if not re.search(r"今年|\d{4}", question)],
+)
+def test_never_starts_after_reference(reference, question):
+    # 沒有指定年份時, 區間不會在基準日之後開始, 起日不晚於迄日
+    if (resolved := resolve_date_range(question, reference)) is not None:
+        start, end = resolved
+        assert start <= end
+        assert start <= reference.replace("-", "/")
+
+
+@pytest.mark.parametrize("question", PARTIAL_EXPRESSIONS)
+def test_partial_expression_falls_back_to_llm(question):
+    assert resolve_date_range(question, "2024-05-10") is None
+
+
+def test_no_expression_returns_none():
+    assert find_date_expressions("在蝦皮的消費") == []
+    assert resolve_date_range("在蝦皮的消費", "2024-05-10") is None
+
+
+@pytest.mark.parametrize("question", ["去年和今年在蝦皮的消費", "上個月跟這個月的消費", "昨天和前天的消費"])
+def test_more_than_one_expression_returns_none(question):
+    assert len(find_date_expressions(question)) > 1
+    assert resolve_date_range(question, "2024-05-10") is None
+
+
+def test_unaffected_neighbours_still_resolve():
+    assert resolve_date_range("上個月一共花了多少", "2024-05-10") == ("2024/04/01", "2024/04/30")
+    assert resolve_date_range("請給我上個月的消費紀錄", "2024-05-10") == ("2024/04/01", "2024/04/30")
+
+
+def test_reference_types_and_format():
+    expected = ("2024-04-01", "2024-04-30")
+    assert resolve_date_range("上個月的消費", date(2024, 5, 10), fmt="%Y-%m-%d") == expected
+    assert resolve_date_range("上個月的消費", "2024-05-10", fmt="%Y-%m-%d") == expected
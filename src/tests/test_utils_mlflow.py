@@ -0,0 +1,46 @@
+from langchain_community.callbacks.openai_info import OpenAICallbackHandler
+
+from app.setting import utils_mlflow
+from app.setting.utils_mlflow import record_stream_usage
+from app.setting.utils_token import estimate_tokens
+
+
+def _capture(monkeypatch):
+    records = []
+    monkeypatch.setattr(utils_mlflow.telemetry_exporter, "record", lambda endpoint, cb: records.append((endpoint, cb)))
+    return records
+
+
+def test_stream_without_usage_is_estimated(monkeypatch):
+    records = _capture(monkeypatch)
+    cb = OpenAICallbackHandler()
+
+    record_stream_usage("gai_response_stream", cb, 500, "上個月您在蝦皮共消費 3 筆")
+
+    assert records == [("gai_response_stream", cb)]
+    assert cb.prompt_tokens == 500
+    assert cb.completion_tokens == estimate_tokens("上個月您在蝦皮共消費 3 筆")
+    assert cb.total_tokens == cb.prompt_tokens + cb.completion_tokens
+    assert cb.successful_requests == 1
+
+
+def test_reported_usage_is_kept(monkeypatch):
+    records = _capture(monkeypatch)
+    cb = OpenAICallbackHandler()
+    cb.prompt_tokens, cb.completion_tokens, cb.total_tokens, cb.successful_requests = 800, 40, 840, 1
+
+    record_stream_usage("gai_response_stream", cb, 500, "回覆")
+
+    assert (cb.prompt_tokens, cb.completion_tokens, cb.total_tokens) == (800, 40, 840)
+    assert len(records) == 1
+
+
+def test_failed_stream_is_recorded_without_usage(monkeypatch):
+    records = _capture(monkeypatch)
+    cb = OpenAICallbackHandler()
+
+    record_stream_usage("gai_response_stream", cb, 500, "")
+
+    assert cb.total_tokens == 0
+    assert cb.successful_requests == 0
+    assert len(records) == 1
@@ -0,0 +1,166 @@
+import math
+import random
+from collections import Counter
+from operator import itemgetter
+
+import pytest
+from langchain_core.documents import Document
+
+from app.setting.utils_retriever import aggregate_metadata, get_metadata_fields_runnable
+
+FIELDS = {
+    "SQL": ("SQL1", "SQL2", "SQL3"),
+    "標準問題": ("問題類別",),
+    "category": ("category",),
+    "score": ("score",),
+}
+
+
+def _get_metadata(response, *keys):
+    """
+    aggregate_metadata 之前的實作, 每個欄位群組各走訪一次 response。
+    """
+    if not response:
+        return []
+
+    if len(response) == 1:
+        result = itemgetter(*keys)(response[0].metadata)
+    else:
+        metadata_list = [itemgetter(*keys)(item.metadata) for item in response]
+
+        if isinstance(metadata_list[0], (int, float)):
+            result = max(metadata_list)
+        else:
+            counter = Counter(metadata_list)
+            result = counter.most_common(1)[0][0]
+
+    return [result] if len(keys) == 1 else list(result)
+
+
+def _outcome(func, *args):
+    """
+    :return: 回傳值, 或拋出的例外型別
+    """
+    try:
+        return func(*args)
+    except Exception as e:
+        return type(e)
+
+
+def _expected(response, fields):
+    return {name: _outcome(_get_metadata, response, *keys) for name, keys in fields.items()}
+
+
+def _actual(response, fields):
+    return _outcome(aggregate_metadata, response, fields)
+
+
+def _same(actual, expected):
+    """
+    舊實作逐群組執行, 任一群組失敗整個 retriever chain 即失敗;
+    新實作失敗時, 拋出的例外需是某個群組在舊實作會拋出的例外。
+    """
+    if isinstance(actual, type):
+        errors = {value for value in expected.values() if isinstance(value, type)}
+        return actual in errors
+    return actual == expected and not any(isinstance(value, type) for value in expected.values())
+
+
+VALUES = [
+    "", "A", "B", "SELECT 1", None,
+    0, 1, 2, 1.0, 0.5, -1, True, False, float("inf"),
+    ("A",), ["A"], {"k": "v"},
+]
+
+
+def _random_documents(rng):
+    keys = ["SQL1", "SQL2", "SQL3", "問題類別", "category", "score"]
+    documents = []
+    for _ in range(rng.choice([0, 1, 1, 2, 3, 5, 8])):
+        metadata = {}
+        for key in keys:
+            # 偶爾缺少欄位
+            if rng.random() < 0.05:
+                continue
+            if rng.random() < 0.6:
+                # 取自小的集合, 讓重複與平手常出現
+                metadata[key] = rng.choice(VALUES[:4] if key != "score" else VALUES[5:9])
+            else:
+                metadata[key] = rng.choice(VALUES)
+        documents.append(Document(page_content="", metadata=metadata))
+    return documents
+
+
+@pytest.mark.parametrize("seed", range(500))
+def test_matches_previous_implementation(seed):
+    rng = random.Random(seed)
+    documents = _random_documents(rng)
+
+    actual = _actual(documents, FIELDS)
+    expected = _expected(documents, FIELDS)
+
+    assert _same(actual, expected), (documents, actual, expected)
+
+
+def _docs(*metadatas):
+    return [Document(page_content="", metadata=metadata) for metadata in metadatas]
+
+
+@pytest.mark.parametrize(
+    "documents, fields",
+    [
+        # 空結果
+        (_docs(), FIELDS),
+        # 單筆直接回傳, 不需可 hash
+        (_docs({"a": ["x"], "b": {"k": 1}}), {"a": ("a",), "b": ("b",), "ab": ("a", "b")}),
+        # 平手取先出現的值
+        (_docs({"a": "x"}, {"a": "y"}), {"a": ("a",)}),
+        (_docs({"a": "y"}, {"a": "x"}, {"a": "x"}, {"a": "y"}), {"a": ("a",)}),
+        (_docs({"a": "x", "b": "1"}, {"a": "y", "b": "2"}), {"ab": ("a", "b")}),
+        # 數值取最大, 相等時取先出現的值
+        (_docs({"s": 1}, {"s": 1.0}, {"s": True}), {"s": ("s",)}),
+        (_docs({"s": 0.5}, {"s": 0.9}, {"s": 0.7}), {"s": ("s",)}),
+        (_docs({"s": False}, {"s": 2}), {"s": ("s",)}),
+        # 第一筆決定是否為數值
+        (_docs({"s": "1"}, {"s": 2}, {"s": 2}), {"s": ("s",)}),
+        (_docs({"s": 1}, {"s": "2"}), {"s": ("s",)}),
+        # 空字串與 None
+        (_docs({"a": ""}, {"a": None}, {"a": ""}), {"a": ("a",)}),
+        (_docs({"a": None}, {"a": None}, {"a": ""}), {"a": ("a",)}),
+        # 相等的不同型別視為同一個值
+        (_docs({"a": "x"}, {"a": 1}, {"a": True}), {"a": ("a",)}),
+        # 缺少欄位
+        (_docs({"a": "x"}), {"a": ("b",)}),
+        (_docs({"a": "x"}, {"b": "y"}), {"a": ("a",)}),
+        (_docs({"a": 1}, {}), {"a": ("a",)}),
+        # 無法 hash 的值
+        (_docs({"a": ["x"]}, {"a": ["x"]}), {"a": ("a",)}),
+        (_docs({"a": "x", "b": ["y"]}, {"a": "x", "b": ["y"]}), {"ab": ("a", "b")}),
+        (_docs({"a": {"k": 1}}, {"a": {"k": 1}}), {"a": ("a",)}),
+    ],
+)
+def test_edge_cases_match_previous_implementation(documents, fields):
+    actual = _actual(documents, fields)
+    expected = _expected(documents, fields)
+
+    assert _same(actual, expected), (actual, expected)
+
+
+def test_nan_scores_match_previous_implementation():
+    documents = _docs({"s": 0.5}, {"s": math.nan}, {"s": 0.9})
+
+    assert aggregate_metadata(documents, {"s": ("s",)})["s"] == _get_metadata(documents, "s")
+
+
+def test_fields_runnable():
+    documents = _docs(
+        {"SQL1": "q1", "SQL2": "q2", "SQL3": "q3", "問題類別": "消費", "category": "01", "score": 0.8},
+        {"SQL1": "r1", "SQL2": "r2", "SQL3": "r3", "問題類別": "消費", "category": "02", "score": 0.9},
+    )
+
+    assert get_metadata_fields_runnable(FIELDS).invoke(documents) == {
+        "SQL": ["q1", "q2", "q3"],
+        "標準問題": ["消費"],
+        "category": ["01"],
+        "score": [0.9],
+    }
@@ -0,0 +1,216 @@
+import asyncio
+import math
+import time
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from app.setting import utils_router
+from app.setting.utils_resilience import ResiliencePolicy, get_breaker
+from app.setting.utils_router import Deployment, DeploymentRouter, parse_deployments
+from benchmarks.fakes import Quota, RateLimitError
+
+LATENCY = 0.005
+PER_SECOND = 20  # 每個 deployment 每秒的配額
+
+
+def _names(n):
+    # circuit breaker 以名稱共用, 每個測試使用不同的名稱
+    suffix = uuid.uuid4().hex[:8]
+    return [f"deployment-{i}-{suffix}" for i in range(n)]
+
+
+class _FakeDeployment:
+    """
+    以 fakes.Quota 模擬每秒配額, 超過時回應 429 (Retry-After 到下一秒)。
+    """
+
+    def __init__(self, name, quota):
+        self.name = name
+        self.quota = quota
+        self.calls = 0
+        self.throttled = 0
+        self.started = []
+
+    async def __call__(self, timeout):
+        try:
+            self.quota.acquire(self.name)
+        except RateLimitError:
+            self.throttled += 1
+            raise
+        self.calls += 1
+        self.started.append(asyncio.get_running_loop().time())
+        await asyncio.sleep(LATENCY)
+        return self.name
+
+
+def _routed(n, **kwargs):
+    names = _names(n)
+    router = DeploymentRouter([Deployment(name, "https://fake", **kwargs) for name in names])
+    policy = ResiliencePolicy(router=router, max_retries=2, backoff=0.01)
+    quota = Quota(rpm=PER_SECOND * 60)
+    deployments = [_FakeDeployment(name, quota) for name in names]
+    return router, policy, deployments
+
+
+async def _run_for_one_second_window(policy, deployments, workers=8, duration=0.9):
+    """
+    從整秒開始, 以 workers 個並行請求在 duration 秒內持續呼叫, 回傳完成的請求數。
+    配額以每秒計, 所以在同一秒內的完成數即為該秒的 throughput。
+    """
+    now = time.monotonic()
+    await asyncio.sleep(math.ceil(now) - now + 0.01)
+    loop = asyncio.get_running_loop()
+    end = loop.time() + duration
+    calls = [(deployment.name, deployment) for deployment in deployments]
+    done = 0
+
+    async def worker():
+        nonlocal done
+        while loop.time() < end:
+            await policy.acall(calls)
+            if loop.time() < end:
+                done += 1
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    # 等待下一秒配額的請求在 end 之後才送出, 不計入
+    for deployment in deployments:
+        deployment.calls = sum(started < end for started in deployment.started)
+    return done
+
+
+@pytest.mark.parametrize("n", [1, 2, 4])
+def test_throughput_scales_with_deployments(n):
+    router, policy, deployments = _routed(n)
+
+    done = asyncio.run(_run_for_one_second_window(policy, deployments))
+
+    # 每個 deployment 都用滿配額, 超過配額的請求在 429 後改送其他 deployment
+    assert done == n * PER_SECOND
+    assert [deployment.calls for deployment in deployments] == [PER_SECOND] * n
+    assert all(deployment.throttled for deployment in deployments)
+
+
+def test_throttled_deployment_is_skipped_until_retry_after():
+    router, policy, (limited, healthy) = _routed(2)
+
+    async def always_429(timeout):
+        limited.calls += 1
+        raise RateLimitError(retry_after=5)
+
+    calls = [(limited.name, always_429), (healthy.name, healthy)]
+
+    async def run():
+        return [await policy.acall(calls) for _ in range(20)]
+
+    results = asyncio.run(run())
+
+    assert results == [healthy.name] * 20
+    # 429 後在 Retry-After 之前不再送往該 deployment
+    assert limited.calls == 1
+    assert not router.ready(limited.name)
+    assert router.ready(healthy.name)
+    # 429 不計入 circuit breaker
+    assert get_breaker(limited.name).available()
+
+
+def test_all_throttled_waits_for_cooldown():
+    router, policy, (deployment,) = _routed(1)
+    attempts = []
+
+    async def once_429(timeout):
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RateLimitError(retry_after=0.2)
+        return "ok"
+
+    async def run():
+        return await policy.acall([(deployment.name, once_429)])
+
+    assert asyncio.run(run()) == "ok"
+    assert attempts[1] - attempts[0] >= 0.19
+
+
+@pytest.mark.parametrize(
+    "settings, expected",
+    [
+        # 沒有配額時依每分鐘請求數 / 權重分配
+        ([{"weight": 3}, {"weight": 1}], [300, 100]),
+        ([{"weight": 1}, {"weight": 1}, {"weight": 2}], [100, 100, 200]),
+        # 有配額時依配額使用率 / 權重分配
+        ([{"rpm": 600}, {"rpm": 200}], [300, 100]),
+        ([{"rpm": 400, "weight": 2}, {"rpm": 400}], [267, 133]),
+    ],
+)
+def test_load_spreads_by_weight(settings, expected):
+    names = _names(len(settings))
+    router = DeploymentRouter([Deployment(name, "https://fake", **item) for name, item in zip(names, settings)])
+    policy = ResiliencePolicy(router=router)
+    counts = dict.fromkeys(names, 0)
+
+    def call(name):
+        def func(timeout):
+            counts[name] += 1
+            return name
+        return func
+
+    calls = [(name, call(name)) for name in names]
+    for _ in range(sum(expected)):
+        policy.call(calls)
+
+    for name, count in zip(names, expected):
+        assert abs(counts[name] - count) <= 1, counts
+
+
+def test_window_slides(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(utils_router, "time", SimpleNamespace(monotonic=lambda: clock[0]))
+    first, second = names = _names(2)
+    router = DeploymentRouter([Deployment(name, "https://fake") for name in names])
+
+    for _ in range(30):
+        router.dispatched(first)
+    clock[0] += 30
+    for _ in range(10):
+        router.dispatched(second)
+    assert router.order(names) == [second, first]
+
+    # 一分鐘前的請求不再計入, first 的負載歸零
+    clock[0] += 31
+    assert router.loads[first].totals() == {"requests": 0, "tokens": 0}
+    assert router.loads[second].totals()["requests"] == 10
+    assert router.order(names) == [first, second]
+
+
+def test_throttle_prefers_retry_after_header(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(utils_router, "time", SimpleNamespace(monotonic=lambda: clock[0]))
+    (name,) = _names(1)
+    router = DeploymentRouter([Deployment(name, "https://fake")], throttle_seconds=10)
+
+    router.throttle(name, RateLimitError(retry_after=2))
+    assert router.cooldown([name]) == pytest.approx(2)
+
+    router.throttle(name, SimpleNamespace(response=SimpleNamespace(headers={"retry-after": "4"})))
+    assert router.cooldown([name]) == pytest.approx(4)
+
+    router.throttle(name, Exception("no headers"))
+    assert router.cooldown([name]) == pytest.approx(10)
+    clock[0] += 10
+    assert router.ready(name)
+
+
+def test_parse_deployments():
+    deployments = parse_deployments(
+        '[{"deployment": "gpt-4o", "weight": 2, "tpm": 240000}, {"deployment": "gpt-4o", "endpoint": "https://b", "name": "b"}]',
+        default_endpoint="https://a",
+    )
+
+    assert [(d.name, d.endpoint, d.weight, d.tpm) for d in deployments] == [
+        ("gpt-4o", "https://a", 2, 240000),
+        ("b", "https://b", 1, 0),
+    ]
+    assert parse_deployments(" ") == []
+    with pytest.raises(ValueError):
+        parse_deployments('[{"deployment": "gpt-4o"}, {"deployment": "gpt-4o"}]')
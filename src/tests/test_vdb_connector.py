@@ -0,0 +1,84 @@
+import asyncio
+import ssl
+from types import SimpleNamespace
+
+import httpx
+from sqlalchemy.engine import create_engine
+
+from app.health import HealthMonitor
+from app.setting.utils_retriever import RetrieveWithScore
+from app.vdb_connector import ChromaDBClient
+from benchmarks.fakes import COLLECTION_NAME
+
+
+def _verify_mode(session: httpx.Client):
+    return session._transport._pool._ssl_context.verify_mode
+
+
+def test_configure_session_keeps_ssl_verify():
+    session = httpx.Client(headers={"X-Chroma-Token": "token"}, verify=False)
+    server = SimpleNamespace(
+        _session=session,
+        _settings=SimpleNamespace(chroma_server_ssl_verify=False),
+    )
+
+    ChromaDBClient._configure_session(SimpleNamespace(_server=server))
+
+    assert server._session is not session
+    assert server._session.headers["X-Chroma-Token"] == "token"
+    assert _verify_mode(server._session) == ssl.CERT_NONE
+    server._session.close()
+
+
+def test_configure_session_verifies_by_default():
+    server = SimpleNamespace(_session=httpx.Client(), _settings=SimpleNamespace())
+
+    ChromaDBClient._configure_session(SimpleNamespace(_server=server))
+
+    assert _verify_mode(server._session) == ssl.CERT_REQUIRED
+    server._session.close()
+
+
+def test_reconnect_swaps_vectorstore_and_keeps_the_old_one_intact():
+    chroma = ChromaDBClient.get_instance(COLLECTION_NAME)
+    old = chroma.vectorstore
+    old_client, old_collection = old._client, old._collection
+    retriever = RetrieveWithScore(lambda: chroma.vectorstore, score_threshold=0)
+    seen = []
+    search = type(old).similarity_search_by_vector_with_relevance_scores
+
+    def spy(self, *args, **kwargs):
+        seen.append(self)
+        return search(self, *args, **kwargs)
+
+    type(old).similarity_search_by_vector_with_relevance_scores = spy
+    try:
+        retriever.invoke("請給我上個月在蝦皮的消費紀錄")
+        chroma.reconnect()
+        retriever.invoke("請給我上個月在蝦皮的消費紀錄")
+    finally:
+        type(old).similarity_search_by_vector_with_relevance_scores = search
+
+    assert chroma.vectorstore is not old
+    assert chroma.collection is chroma.vectorstore._collection
+    assert old._client is old_client
+    assert old._collection is old_collection
+    assert seen == [old, chroma.vectorstore]
+
+
+def test_readiness_does_not_reconnect(monkeypatch):
+    calls = []
+    chroma = SimpleNamespace(
+        heartbeat=lambda: calls.append("heartbeat") or False,
+        ensure_healthy=lambda: calls.append("ensure_healthy") or False,
+        reconnect=lambda: calls.append("reconnect"),
+    )
+    monkeypatch.setattr(ChromaDBClient, "get_instance", lambda collection_name: chroma)
+    monitor = HealthMonitor(create_engine("sqlite://"), COLLECTION_NAME, required=("database", "chroma"))
+    monitor.warmed_up = True
+    monkeypatch.setattr(monitor, "_pipelines_ready", lambda: True)
+
+    asyncio.run(monitor.check())
+
+    assert calls == ["heartbeat"]
+    assert monitor.dependencies["chroma"]["status"] == "fail"